@@ -0,0 +1,342 @@
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from timeit import default_timer as timer
+
+from Cryptodome.Random import random
+
+from schemes import (
+    precompute_both_scheme,
+    precompute_gm_scheme,
+    precompute_gnr_scheme,
+    scheme1,
+    scheme3,
+)
+from schemes.affinity import Placement
+from schemes.config import CHEAT, DEFAULT_KEYSIZE, NO_GNR, POWER
+from schemes.service import PaillierClient
+
+RESULTS_PATH = os.path.join(os.path.dirname(__file__), "results")
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    index = max(0, math.ceil(p / 100 * len(values)) - 1)
+    return values[index]
+
+
+def read_cpu_times():
+    # System-wide (busy, total) jiffies, so the CPU usage of a separate
+    # service process is included too
+    try:
+        with open("/proc/stat", encoding="ISO-8859-2") as file:
+            fields = [int(x) for x in file.readline().split()[1:]]
+        idle = fields[3] + fields[4]
+        return sum(fields) - idle, sum(fields)
+    except (OSError, IndexError, ValueError):
+        times = os.times()
+        return times.user + times.system, times.elapsed * os.cpu_count()
+
+
+def createTarget(name, params):
+    if name == "service":
+        return PaillierClient(params) if params else PaillierClient()
+    if name == "scheme1":
+        return scheme1.PaillierScheme()
+    if name == "scheme3":
+        return scheme3.PaillierScheme()
+
+    module = {
+        "precompute_gm": precompute_gm_scheme,
+        "precompute_gnr": precompute_gnr_scheme,
+        "precompute_both": precompute_both_scheme,
+    }[name]
+    return module.PaillierScheme.constructFromJsonFile(params)
+
+
+def createClientPool(name, params, clients):
+    # One process per client, each loads its own scheme, so clients of
+    # in-process targets are not serialized by one GIL
+    barrier = multiprocessing.Barrier(clients + 1)
+    executor = ProcessPoolExecutor(
+        max_workers=clients,
+        initializer=_init_client,
+        initargs=(name, params, barrier),
+    )
+    return executor, barrier
+
+
+# Scheme instance and start barrier of a client process, set once by
+# _init_client so every client process loads its own scheme
+_client_target = None
+_client_barrier = None
+
+
+def _init_client(name, params, barrier):
+    global _client_target, _client_barrier
+    try:
+        _client_target = createTarget(name, params)
+    except Exception:
+        barrier.abort()  # the run would wait for this client forever
+        raise
+    _client_barrier = barrier
+
+
+def _run_client_process(operation, index, clients, rate, duration):
+    return runClient(
+        _client_target,
+        operation,
+        index,
+        clients,
+        rate,
+        duration,
+        _client_barrier,
+    )
+
+
+def runClient(target, operation, index, clients, rate, duration, barrier):
+    # One closed-loop client, all clients start together by the barrier
+    try:
+        messages = [
+            random.getrandbits(int(math.log2(POWER)) * 2) for _ in range(64)
+        ]
+        payloads = (
+            messages
+            if operation == "encrypt"
+            else [target.encrypt(message) for message in messages]
+        )
+        call = getattr(target, operation)
+    except Exception:
+        barrier.abort()
+        raise
+
+    samples = []
+    errors = 0
+    interval = clients / rate if rate else 0
+
+    barrier.wait()
+    start = timer()
+    stop = start + duration
+
+    next_send = start + interval * index / clients
+    i = index
+    while True:
+        now = timer()
+        if next_send > now:
+            time.sleep(next_send - now)
+        sent = timer()
+        if sent >= stop:
+            break
+        try:
+            call(payloads[i % len(payloads)])
+            samples.append((sent - start, timer() - sent))
+        except Exception:
+            errors += 1
+        i += 1
+        next_send = max(next_send + interval, sent) if interval else 0
+    return samples, errors
+
+
+def runLoad(target, operation, clients, rate, duration, window, pool=None):
+    """
+    Closed-loop load: every client sends next request only after the
+    previous one was answered, paced so all clients together do not exceed
+    rate requests per second (rate = 0 means as fast as possible).
+
+    Clients are threads sharing target, or processes of pool (created by
+    createClientPool) with a scheme of their own, then target is unused.
+    """
+    if pool is None:
+        barrier = threading.Barrier(clients + 1)
+        executor = ThreadPoolExecutor(max_workers=clients)
+        futures = [
+            executor.submit(
+                runClient,
+                target,
+                operation,
+                index,
+                clients,
+                rate,
+                duration,
+                barrier,
+            )
+            for index in range(clients)
+        ]
+    else:
+        executor, barrier = pool
+        futures = [
+            executor.submit(
+                _run_client_process,
+                operation,
+                index,
+                clients,
+                rate,
+                duration,
+            )
+            for index in range(clients)
+        ]
+
+    # Loading of targets and payloads is not part of the run
+    try:
+        barrier.wait()
+    except threading.BrokenBarrierError:
+        for future in futures:
+            future.result()  # raises the error of the failed client
+        raise
+
+    cpu = []
+    cpu_start = previous = read_cpu_times()
+
+    while not all(future.done() for future in futures):
+        time.sleep(window)
+        current = read_cpu_times()
+        total = current[1] - previous[1]
+        cpu.append((current[0] - previous[0]) / total if total else 0)
+        previous = current
+
+    if pool is None:
+        executor.shutdown()
+    results = [future.result() for future in futures]
+
+    cpu_total = previous[1] - cpu_start[1]
+    completed = sorted(
+        sample for client_samples, _ in results for sample in client_samples
+    )
+    latencies = [latency for _, latency in completed]
+
+    windows = []
+    for index in range(math.ceil(duration / window)):
+        in_window = [
+            latency
+            for sent, latency in completed
+            if index * window <= sent < (index + 1) * window
+        ]
+        windows.append(
+            {
+                "t": (index + 1) * window,
+                "throughput": len(in_window) / window,
+                "cpu": cpu[index] if index < len(cpu) else None,
+                **{f"p{p}": percentile(in_window, p) for p in PERCENTILES},
+            }
+        )
+
+    return {
+        "clients": clients,
+        "rate": rate,
+        "duration": duration,
+        "completed": len(latencies),
+        "errors": sum(errors for _, errors in results),
+        "throughput": len(latencies) / duration,
+        "cpu": (previous[0] - cpu_start[0]) / cpu_total if cpu_total else 0,
+        "latency": {f"p{p}": percentile(latencies, p) for p in PERCENTILES},
+        "windows": windows,
+        "latencies": latencies,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Closed-loop load generator for schemes or the service"
+    )
+    parser.add_argument(
+        "target",
+        choices=[
+            "scheme1",
+            "scheme3",
+            "precompute_gm",
+            "precompute_gnr",
+            "precompute_both",
+            "service",
+        ],
+    )
+    parser.add_argument(
+        "--params",
+        help="params file name (or socket path for the service target)",
+    )
+    parser.add_argument(
+        "--operation", choices=["encrypt", "decrypt"], default="encrypt"
+    )
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument(
+        "--rates",
+        default="0",
+        help="comma separated target rates in requests/s, one run per rate"
+        " (0 = unlimited)",
+    )
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--window", type=float, default=1)
+    args = parser.parse_args()
+
+    # Threads are enough for the service, it computes in its own process
+    if args.target == "service":
+        target, pool = createTarget(args.target, args.params), None
+    else:
+        target = None
+        pool = createClientPool(args.target, args.params, args.clients)
+
+    results = {
+        "type": "loadtest",
+        "target": args.target,
+        "operation": args.operation,
+        "cheat": CHEAT,
+        "no_gnr": NO_GNR,
+        "power": POWER,
+        "default_keysize": DEFAULT_KEYSIZE,
+        "cpu_count": os.cpu_count(),
+        "placement": Placement().report(),
+        "runs": [],
+    }
+
+    for rate in [float(rate) for rate in args.rates.split(",")]:
+        print(f"Running {args.clients} clients at rate {rate or 'max'}...")
+        run = runLoad(
+            target,
+            args.operation,
+            args.clients,
+            rate,
+            args.duration,
+            args.window,
+            pool,
+        )
+        print(
+            f"Throughput: {run['throughput']:.1f} req/s, "
+            f"p99: {run['latency']['p99'] * 10 ** 3:.2f} ms, "
+            f"CPU: {run['cpu'] * 100:.0f} %"
+        )
+        results["runs"].append(run)
+
+    if pool is not None:
+        pool[0].shutdown()
+
+    file_path = os.path.join(
+        RESULTS_PATH,
+        (
+            "loadtest-"
+            + str(datetime.now()).replace(" ", "_").replace(":", ".")
+            + ".json"
+        ),
+    )
+
+    print(f"Results file path: {file_path}")
+
+    if not os.path.exists(RESULTS_PATH):
+        os.mkdir(RESULTS_PATH)
+
+    with open(
+        file_path,
+        "w",
+        encoding="ISO-8859-2",
+    ) as file:
+        json.dump(results, file)
+
+    print("Finished successfully")
@@ -13,6 +13,7 @@ from schemes import (
     scheme1,
     scheme3,
 )
+from schemes.affinity import Placement
 from schemes.config import CHEAT, DEFAULT_KEYSIZE, NO_GNR, POWER
 
 BATCH_SIZE = 50
@@ -144,6 +145,7 @@ if __name__ == "__main__":
         "no_gnr": NO_GNR,
         "power": POWER,
         "default_keysize": DEFAULT_KEYSIZE,
+        "placement": Placement().report(),
         "scheme1": {"enc": [], "dec": []},
         "scheme3": {"enc": [], "dec": []},
         "precompute_gm": {"enc": [], "dec": []},
@@ -1,9 +1,35 @@
+import argparse
 import json
 import os
 import statistics
 
 import matplotlib.pyplot as plt
 
+# Directory and formats of exported figures, None = show figures instead
+SAVE_PATH = None
+FORMATS = ["png", "svg"]
+
+
+def show(name):
+    if SAVE_PATH is None:
+        plt.show()
+        return
+
+    figure = plt.gcf()
+    figure.set_size_inches(18, 10)
+    figure.tight_layout()
+    os.makedirs(SAVE_PATH, exist_ok=True)
+    for extension in FORMATS:
+        path = os.path.join(SAVE_PATH, f"{name}.{extension}")
+        figure.savefig(path, bbox_inches="tight")
+        print(f"Figure saved: {path}")
+    plt.close(figure)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[max(0, -(-len(values) * p // 100) - 1)]
+
 
 def plot(file_path):
     schemes_path = os.path.join(os.path.dirname(__file__), "schemes")
@@ -13,7 +39,7 @@ def plot(file_path):
     schemes = [
         e.replace("_scheme.py", "").replace(".py", "")
         for e in os.listdir(schemes_path)
-        if e not in ("__init__.py", "__pycache__", "common.py", "config.py")
+        if e.startswith("scheme") or e.endswith("_scheme.py")
     ]
 
     data = {}
@@ -67,10 +93,229 @@ def plot(file_path):
         "Paillier encryption scheme optimalization - CHEAT: "
         + str(data["cheat"])
     )
-    plt.show()
+    show(os.path.splitext(os.path.basename(file_path))[0])
+
+
+def plotLoadtest(data, name="loadtest"):
+    runs = data["runs"]
+    # CPU utilization is a share of all CPUs of the machine which ran the
+    # test, results without its CPU count are plotted as that share
+    cpu_count = data.get("cpu_count")
+    cpu_unit = "one core" if cpu_count else "all cores"
+
+    plt.subplot(1, 3, 1)
+    for run in runs:
+        label = "rate: " + (str(run["rate"]) if run["rate"] else "max")
+        times = [window["t"] for window in run["windows"]]
+        plt.plot(
+            times,
+            [window["throughput"] for window in run["windows"]],
+            "x-",
+            label=label,
+        )
+        plt.plot(
+            times,
+            [
+                (window["cpu"] or 0) * 100 * (cpu_count or 1)
+                for window in run["windows"]
+            ],
+            ":",
+            label=f"{label} - CPU [% of {cpu_unit}]",
+        )
+    plt.xlabel("Time [s]")
+    plt.ylabel("Throughput [req/s]")
+    plt.title("Throughput and CPU utilization over time")
+    plt.legend()
+
+    plt.subplot(1, 3, 2)
+    for run in runs:
+        run_label = "rate: " + (str(run["rate"]) if run["rate"] else "max")
+        for label in ("p50", "p99"):
+            plt.plot(
+                [window["t"] for window in run["windows"]],
+                [window[label] * (10 ** 3) for window in run["windows"]],
+                "x-",
+                label=run_label + " - " + label,
+            )
+    plt.xlabel("Time [s]")
+    plt.ylabel("Latency [ms]")
+    plt.title("Latency percentiles over time")
+    plt.legend()
+
+    # Knee of the throughput curve: achieved throughput and tail latency
+    # against offered load of all runs
+    plt.subplot(1, 3, 3)
+    throughputs = [run["throughput"] for run in runs]
+    for label in ("p50", "p95", "p99"):
+        plt.plot(
+            throughputs,
+            [run["latency"][label] * (10 ** 3) for run in runs],
+            "x-",
+            label=label,
+        )
+    plt.xlabel("Achieved throughput [req/s]")
+    plt.ylabel("Latency [ms]")
+    plt.title("Latency vs throughput")
+    plt.legend()
+
+    plt.suptitle(
+        f"Load test of {data['target']} ({data['operation']}) - clients: "
+        + str(runs[0]["clients"])
+    )
+    show(name)
+
+
+def plotStartup(data, name="startup"):
+    summary = data["summary"]
+    labels = list(summary)
+    positions = range(len(labels))
+
+    # Time to first ciphertext split into its phases
+    plt.subplot(1, 3, 1)
+    bottom = [0] * len(labels)
+    for phase in ("import", "load", "first_encryption"):
+        values = [summary[label][phase] * (10 ** 3) for label in labels]
+        plt.bar(positions, values, bottom=bottom, label=phase)
+        bottom = [b + v for b, v in zip(bottom, values)]
+    plt.xticks(positions, labels, rotation=30, ha="right")
+    plt.ylabel("Time [ms]")
+    plt.title("Time to first encryption")
+    plt.legend()
+
+    plt.subplot(1, 3, 2)
+    width = 0.4
+    for offset, key in ((-width / 2, "rss_steady"), (width / 2, "rss_peak")):
+        plt.bar(
+            [position + offset for position in positions],
+            [summary[label][key] / 2 ** 20 for label in labels],
+            width,
+            label=key.replace("rss_", ""),
+        )
+    plt.xticks(positions, labels, rotation=30, ha="right")
+    plt.ylabel("RSS [MiB]")
+    plt.title("Resident memory after first encryption")
+    plt.legend()
+
+    # Only runs with tables were traced
+    traced = [
+        label for label in labels if summary[label].get("bytes_per_entry")
+    ]
+    plt.subplot(1, 3, 3)
+    plt.bar(
+        range(len(traced)),
+        [summary[label]["bytes_per_entry"] for label in traced],
+    )
+    plt.xticks(range(len(traced)), traced, rotation=30, ha="right")
+    plt.ylabel("Traced bytes per table entry")
+    plt.title("Table memory (tracemalloc)")
+
+    plt.suptitle(
+        f"Startup and memory - key size: {data['default_keysize']}, "
+        f"POWER: {data['power']}"
+    )
+    show(name)
+
+
+def plotScaling(data, name="scaling"):
+    # Throughput against worker count, with linear scaling from the first
+    # run for parallel efficiency
+    plt.subplot(2, 2, 1)
+    runs = data["workers"]
+    workers = [run["workers"] for run in runs]
+    for operation in ("enc", "dec"):
+        throughputs = [run[operation + "_throughput"] for run in runs]
+        plt.plot(workers, throughputs, "x-", label=operation)
+        plt.plot(
+            workers,
+            [throughputs[0] * count / workers[0] for count in workers],
+            ":",
+            label=operation + " - linear",
+        )
+    plt.xlabel("Workers (threads)")
+    plt.ylabel("Throughput [ops/s]")
+    plt.title(f"Throughput vs workers - backend: {data['backend']}")
+    plt.legend()
+
+    plt.subplot(2, 2, 2)
+    runs = data["key_sizes"]
+    for scheme in dict.fromkeys(run["scheme"] for run in runs):
+        scheme_runs = [run for run in runs if run["scheme"] == scheme]
+        key_sizes = [run["n_length"] for run in scheme_runs]
+        for operation in ("enc", "dec"):
+            for p, style in ((50, "x-"), (99, "x:")):
+                plt.plot(
+                    key_sizes,
+                    [
+                        percentile(run[operation], p) * (10 ** 3)
+                        for run in scheme_runs
+                    ],
+                    style,
+                    label=f"{scheme} - {operation} p{p}",
+                )
+    plt.yscale("log")
+    plt.xlabel("Key size [bits]")
+    plt.ylabel("Latency [ms]")
+    plt.title("Latency vs key size")
+    plt.legend()
+
+    plt.subplot(2, 2, 3)
+    runs = data["batch_sizes"]
+    for operation in ("enc", "dec"):
+        plt.plot(
+            [run["batch_size"] for run in runs],
+            [run[operation + "_throughput"] for run in runs],
+            "x-",
+            label=operation,
+        )
+    plt.xscale("log", base=2)
+    plt.xlabel("Batch size")
+    plt.ylabel("Throughput [ops/s]")
+    plt.title(f"Throughput vs batch size - {data['target']}")
+    plt.legend()
+
+    plt.subplot(2, 2, 4)
+    for scheme, latencies in data["latencies"].items():
+        for operation, style in (("enc", "-"), ("dec", "--")):
+            times = sorted(time * (10 ** 3) for time in latencies[operation])
+            plt.plot(
+                times,
+                [(index + 1) / len(times) for index in range(len(times))],
+                style,
+                label=f"{scheme} - {operation}",
+            )
+    plt.xscale("log")
+    plt.xlabel("Latency [ms]")
+    plt.ylabel("Fraction of operations")
+    plt.title(f"Latency CDF - key size: {data['default_keysize']}")
+    plt.legend()
+
+    plt.suptitle(
+        f"Scaling of {data['target']} - CHEAT: {data['cheat']}, "
+        f"POWER: {data['power']}"
+    )
+    show(name)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plot results files")
+    parser.add_argument(
+        "file", nargs="?", help="results file, chosen interactively if missing"
+    )
+    parser.add_argument(
+        "--save",
+        metavar="DIR",
+        help="save figures into DIR instead of showing them (headless)",
+    )
+    parser.add_argument(
+        "--formats", default=",".join(FORMATS), help="comma separated"
+    )
+    args = parser.parse_args()
+
+    if args.save is not None:
+        plt.switch_backend("Agg")
+        SAVE_PATH = args.save
+        FORMATS = args.formats.split(",")
+
     results_path = os.path.join(os.path.dirname(__file__), "results")
 
     if not os.path.exists(results_path):
@@ -79,11 +324,14 @@ if __name__ == "__main__":
     filelist = os.listdir(results_path)
     filelist.sort()
 
-    print("--------------------------------------")
-    for index, filename in enumerate(filelist):
-        print(f"{index}: {filename}")
-    print("--------------------------------------")
-    choice = input("Choose file index or add own path for results: ")
+    if args.file is not None:
+        choice = args.file
+    else:
+        print("--------------------------------------")
+        for index, filename in enumerate(filelist):
+            print(f"{index}: {filename}")
+        print("--------------------------------------")
+        choice = input("Choose file index or add own path for results: ")
 
     if str.isnumeric(choice):
         filename = os.path.join(
@@ -94,4 +342,15 @@ if __name__ == "__main__":
     else:
         raise LookupError(f"Results file does not exist: {choice}")
 
-    plot(filename)
+    with open(filename, encoding="ISO-8859-2") as file:
+        data = json.load(file)
+
+    name = os.path.splitext(os.path.basename(filename))[0]
+    if data.get("type") == "loadtest":
+        plotLoadtest(data, name)
+    elif data.get("type") == "startup":
+        plotStartup(data, name)
+    elif data.get("type") == "scaling":
+        plotScaling(data, name)
+    else:
+        plot(filename)
@@ -0,0 +1,214 @@
+import argparse
+import json
+import math
+import os
+from datetime import datetime
+from timeit import default_timer as timer
+
+from Cryptodome.Random import random
+
+from schemes import (
+    precompute_both_scheme,
+    precompute_gm_scheme,
+    precompute_gnr_scheme,
+    scheme1,
+    scheme3,
+)
+from schemes.affinity import Placement
+from schemes.backend import BACKEND
+from schemes.config import CHEAT, DEFAULT_KEYSIZE, NO_GNR, POWER
+from schemes.threaded import ThreadedPaillierScheme
+
+RESULTS_PATH = os.path.join(os.path.dirname(__file__), "results")
+
+PRECOMPUTE_SCHEMES = {
+    "precompute_gm": precompute_gm_scheme,
+    "precompute_gnr": precompute_gnr_scheme,
+    "precompute_both": precompute_both_scheme,
+}
+
+
+def randomMessages(count):
+    return [
+        random.getrandbits(int(math.log2(POWER)) * 2) for _ in range(count)
+    ]
+
+
+def createKey(name, n_length):
+    # scheme3 raises ValueError for sizes DSA can't generate (p and q must
+    # be 1024, 2048 or 3072 bits long)
+    module = scheme1 if name == "scheme1" else scheme3
+    return module.PaillierScheme(n_length=n_length)
+
+
+def measureLatencies(ps, messages):
+    # Latency of every single encryption and decryption
+    enc, dec = [], []
+    for message in messages:
+        start = timer()
+        ct = ps.encrypt(message)
+        middle = timer()
+        pt = ps.decrypt(ct)
+        end = timer()
+
+        if pt != message:
+            raise ValueError("Decrypted is not the same as message")
+        enc.append(middle - start)
+        dec.append(end - middle)
+    return {"enc": enc, "dec": dec}
+
+
+def sweepWorkers(ps, messages, workers_list):
+    runs = []
+    for workers in workers_list:
+        print(f"workers: {workers}")
+        with ThreadedPaillierScheme(ps, workers=workers) as threaded:
+            start = timer()
+            cts = threaded.encrypt_many(messages)
+            middle = timer()
+            pts = threaded.decrypt_many(cts)
+            end = timer()
+
+        if pts != messages:
+            raise ValueError("Decrypted is not the same as message")
+        runs.append(
+            {
+                "workers": workers,
+                "enc_throughput": len(messages) / (middle - start),
+                "dec_throughput": len(messages) / (end - middle),
+            }
+        )
+    return runs
+
+
+def sweepKeySizes(schemes, key_sizes, messages):
+    runs = []
+    for name in schemes:
+        for n_length in key_sizes:
+            print(f"{name}: key size {n_length}")
+            try:
+                ps = createKey(name, n_length)
+            except ValueError as error:
+                print(f"{name}: key size {n_length} skipped ({error})")
+                continue
+            run = measureLatencies(ps, messages)
+            run.update({"scheme": name, "n_length": n_length})
+            runs.append(run)
+    return runs
+
+
+def sweepBatchSizes(ps, messages, batch_sizes):
+    runs = []
+    for batch_size in batch_sizes:
+        print(f"batch size: {batch_size}")
+        # Every batch size encrypts (at least) all messages
+        batches = [
+            messages[start : start + batch_size]
+            for start in range(0, len(messages), batch_size)
+        ]
+        start = timer()
+        cts = [ps.encrypt_many(batch) for batch in batches]
+        middle = timer()
+        pts = [ps.decrypt_many(batch) for batch in cts]
+        end = timer()
+
+        if [pt for batch in pts for pt in batch] != messages:
+            raise ValueError("Decrypted is not the same as message")
+        runs.append(
+            {
+                "batch_size": batch_size,
+                "enc_throughput": len(messages) / (middle - start),
+                "dec_throughput": len(messages) / (end - middle),
+            }
+        )
+    return runs
+
+
+def integers(text):
+    return [int(value) for value in text.split(",") if value]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure throughput and latency scaling with worker"
+        " count, key size and batch size"
+    )
+    parser.add_argument(
+        "--params",
+        help="precompute_both params file, its key is used for the worker"
+        " and batch size sweeps and latencies of precompute schemes (a new"
+        " scheme3 key is used without it)",
+    )
+    parser.add_argument("--count", type=int, default=256)
+    parser.add_argument("--workers", type=integers, default=[1, 2, 4, 8])
+    parser.add_argument(
+        "--key-sizes", type=integers, default=[1024, 2048, 3072, 4096]
+    )
+    parser.add_argument(
+        "--batch-sizes", type=integers, default=[1, 4, 16, 64, 256]
+    )
+    args = parser.parse_args()
+
+    messages = randomMessages(args.count)
+
+    latencies = {}
+    if args.params:
+        ps = precompute_both_scheme.PaillierScheme.constructFromJsonFile(
+            args.params
+        )
+        target = "precompute_both"
+        for name, module in PRECOMPUTE_SCHEMES.items():
+            print(f"{name}: latencies")
+            latencies[name] = measureLatencies(
+                module.PaillierScheme.constructFromJsonFile(args.params),
+                messages,
+            )
+    else:
+        ps = scheme3.PaillierScheme()
+        target = "scheme3"
+
+    results = {
+        "type": "scaling",
+        "target": target,
+        "backend": BACKEND,
+        "cheat": CHEAT,
+        "no_gnr": NO_GNR,
+        "power": POWER,
+        "default_keysize": DEFAULT_KEYSIZE,
+        "count": args.count,
+        "placement": Placement().report(),
+        "workers": sweepWorkers(ps, messages, args.workers),
+        "key_sizes": sweepKeySizes(
+            ["scheme1", "scheme3"], args.key_sizes, messages
+        ),
+        "batch_sizes": sweepBatchSizes(ps, messages, args.batch_sizes),
+        "latencies": latencies,
+    }
+
+    # Latencies of schemes without params files at the default key size
+    for run in results["key_sizes"]:
+        if run["n_length"] == DEFAULT_KEYSIZE:
+            latencies[run["scheme"]] = {"enc": run["enc"], "dec": run["dec"]}
+
+    file_path = os.path.join(
+        RESULTS_PATH,
+        (
+            "scaling-"
+            + str(datetime.now()).replace(" ", "_").replace(":", ".")
+            + ".json"
+        ),
+    )
+
+    print(f"Results file path: {file_path}")
+
+    if not os.path.exists(RESULTS_PATH):
+        os.mkdir(RESULTS_PATH)
+
+    with open(
+        file_path,
+        "w",
+        encoding="ISO-8859-2",
+    ) as file:
+        json.dump(results, file)
+
+    print("Finished successfully")
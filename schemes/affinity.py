@@ -0,0 +1,184 @@
+"""
+CPU and NUMA placement of workers.
+
+NUMA nodes and their CPUs are read from /sys/devices/system/node (Linux),
+elsewhere all CPUs the process may run on form one node. With pinning
+enabled, workers are split into one group per node and every worker pins
+itself (os.sched_setaffinity) to the CPUs of its node, so the scheduler
+does not move it to the other socket. Read-only tables are copied once per
+node by a thread pinned to that node; Linux places new pages on the node
+of the thread which touches them first, so table lookups of a worker group
+stay in local memory.
+
+Usage:
+    python -m schemes.affinity
+"""
+
+from __future__ import annotations
+
+import glob
+import json
+import os
+import pickle
+import threading
+
+from .config import AFFINITY_NODES, AFFINITY_PIN
+
+NODES_PATH = "/sys/devices/system/node"
+
+
+def parse_cpulist(text: str) -> list:
+    # "0-3,8-11" -> [0, 1, 2, 3, 8, 9, 10, 11]
+    cpus = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        cpus += range(int(first), int(last or first) + 1)
+    return cpus
+
+
+def allowed_cpus() -> list:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def numa_nodes() -> dict:
+    """
+    Returns:
+        dict: node id -> sorted CPUs of the node the process may run on
+    """
+    allowed = set(allowed_cpus())
+    nodes = {}
+    for path in glob.glob(os.path.join(NODES_PATH, "node[0-9]*", "cpulist")):
+        node = int(os.path.basename(os.path.dirname(path))[4:])
+        with open(path, encoding="ascii") as file:
+            cpus = parse_cpulist(file.read())
+        cpus = [cpu for cpu in cpus if cpu in allowed]
+        if cpus:  # memory-only nodes and nodes outside the cpuset
+            nodes[node] = cpus
+    return dict(sorted(nodes.items())) or {0: sorted(allowed)}
+
+
+def pin(cpus: list) -> bool:
+    # Pins the calling thread (on Linux the thread, not the whole process)
+    if not cpus or not hasattr(os, "sched_setaffinity"):
+        return False
+    os.sched_setaffinity(0, cpus)
+    return True
+
+
+# CPUs this worker process pinned itself to by its first pinned job
+_worker_cpus = None
+
+
+def pinned(cpus: list, function, *args):
+    # Picklable wrapper for process pool jobs, cpus = None does not pin.
+    # Any worker may run any job, so a worker pins itself once, to the node
+    # of the first job it runs, and stays there for all later jobs
+    global _worker_cpus
+    if cpus is not None and _worker_cpus is None:
+        pin(cpus)
+        _worker_cpus = cpus
+    return function(*args)
+
+
+def local_copy(value):
+    # Pickling creates new objects, allocated by the calling thread
+    return pickle.loads(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+
+class Placement:
+    """
+    Assignment of workers to NUMA nodes.
+
+    Worker (or job) index i belongs to node nodes[i % len(nodes)], so
+    worker groups of all nodes have the same size (+-1). Process pool
+    workers pinned by pinned() join the node of the first job they run;
+    the first jobs are dispatched one per worker, so groups stay balanced.
+
+    Args:
+        workers (int): number of workers, None = number of allowed CPUs
+        nodes (list): node ids to use, None = all nodes with CPUs
+        pin (bool): pin workers to the CPUs of their node
+    """
+
+    def __init__(
+        self,
+        workers: int = None,
+        nodes: list = AFFINITY_NODES,
+        pin: bool = AFFINITY_PIN,
+    ) -> None:
+        available = numa_nodes()
+        if nodes is not None:
+            missing = set(nodes) - set(available)
+            if missing:
+                raise LookupError(f"No CPUs of NUMA nodes {sorted(missing)}")
+            available = {node: available[node] for node in sorted(nodes)}
+
+        self.cpus = available
+        self.nodes = list(available)
+        self.workers = workers or sum(len(cpus) for cpus in available.values())
+        self.pin = pin and hasattr(os, "sched_setaffinity")
+
+        self.groups = {node: 0 for node in self.nodes}
+        for index in range(self.workers):
+            self.groups[self.node_of(index)] += 1
+
+    @property
+    def replicated(self) -> bool:
+        # Copies only help when workers can't be scheduled on other nodes
+        return self.pin and len(self.nodes) > 1
+
+    def node_of(self, index: int) -> int:
+        return self.nodes[index % len(self.nodes)]
+
+    def cpus_of(self, index: int) -> list:
+        # CPUs a worker or job pins itself to, None when not pinning
+        return self.cpus[self.node_of(index)] if self.pin else None
+
+    def initializer(self, node: int) -> tuple:
+        # initializer and initargs of an executor of one worker group
+        return pin, (self.cpus[node] if self.pin else None,)
+
+    def replicate(self, value) -> dict:
+        """
+        Copies value into the local memory of every node (by a thread pinned
+        to the node), value itself is shared when replication does not help.
+
+        Returns:
+            dict: node id -> copy of value
+        """
+        if not self.replicated:
+            return {node: value for node in self.nodes}
+
+        copies = {}
+
+        def copy(node: int) -> None:
+            pin(self.cpus[node])
+            copies[node] = local_copy(value)
+
+        threads = [
+            threading.Thread(target=copy, args=(node,)) for node in self.nodes
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if len(copies) != len(self.nodes):
+            raise RuntimeError("Copying tables to NUMA nodes failed")
+        return copies
+
+    def report(self) -> dict:
+        return {
+            "pin": self.pin,
+            "replicated": self.replicated,
+            "workers": self.workers,
+            "nodes": {str(node): cpus for node, cpus in self.cpus.items()},
+            "groups": {str(node): size for node, size in self.groups.items()},
+        }
+
+
+if __name__ == "__main__":
+    print(json.dumps(Placement().report(), indent=4))
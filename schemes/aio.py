@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor
+
+from .config import ASYNC_MAX_BATCH_SIZE, ASYNC_MAX_WAIT, ASYNC_WORKERS
+
+# Scheme instance owned by the worker process, set once by _init_worker so
+# the key and pre-computed tables are not pickled with every batch
+_worker_scheme = None
+
+
+def _init_worker(scheme) -> None:
+    global _worker_scheme
+    _worker_scheme = scheme
+
+
+def _run_batch(method: str, items: list) -> list:
+    try:
+        values = getattr(_worker_scheme, method)(items)
+        return [(True, value) for value in values]
+    except Exception:
+        pass
+
+    # One invalid item must not fail the whole batch, so fall back to
+    # processing items one by one and report errors per item
+    single = method.replace("_many", "")
+    results = []
+    for item in items:
+        try:
+            results.append((True, getattr(_worker_scheme, single)(item)))
+        except Exception as error:
+            results.append((False, error))
+    return results
+
+
+class MicroBatcher:
+    def __init__(
+        self,
+        executor: Executor,
+        method: str,
+        max_batch_size: int = ASYNC_MAX_BATCH_SIZE,
+        max_wait: float = ASYNC_MAX_WAIT,
+    ) -> None:
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+
+        self.executor = executor
+        self.method = method
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self._pending = []
+        self._timer = None
+
+    async def submit(self, item: int) -> int:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+
+        # Full batch is dispatched right away, otherwise the first request
+        # of a batch waits at most max_wait for others to join it
+        if len(self._pending) >= self.max_batch_size:
+            self._flush(loop)
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush, loop)
+
+        return await future
+
+    def _flush(self, loop: asyncio.AbstractEventLoop) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        futures = [future for _, future in batch]
+        task = loop.run_in_executor(
+            self.executor, _run_batch, self.method, [item for item, _ in batch]
+        )
+        task.add_done_callback(lambda done: self._resolve(futures, done))
+
+    @staticmethod
+    def _resolve(futures: list, done: asyncio.Future) -> None:
+        if done.exception() is not None:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(done.exception())
+            return
+
+        for future, (ok, value) in zip(futures, done.result()):
+            if future.done():
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+
+class AsyncPaillierScheme:
+    """
+    Asyncio wrapper around any PaillierScheme.
+
+    Concurrent aencrypt/adecrypt calls are coalesced into micro-batches of
+    at most max_batch_size items (or whatever arrived within max_wait
+    seconds) and handed to encrypt_many/decrypt_many in a process pool, so
+    the event loop is never blocked by big-int exponentiation.
+
+    Args:
+        scheme: scheme instance, copied once into every worker process
+        max_batch_size (int): maximal number of requests in one batch
+        max_wait (float): maximal time in seconds a request waits for batch
+        workers (int): number of worker processes (None = CPU count)
+        executor (Executor): use own executor instead of the process pool,
+            it has to be initialized with _init_worker(scheme)
+    """
+
+    def __init__(
+        self,
+        scheme,
+        max_batch_size: int = ASYNC_MAX_BATCH_SIZE,
+        max_wait: float = ASYNC_MAX_WAIT,
+        workers: int = ASYNC_WORKERS,
+        executor: Executor = None,
+    ) -> None:
+        self.scheme = scheme
+        self.public = scheme.public
+
+        self._own_executor = executor is None
+        self.executor = executor or ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(scheme,),
+        )
+
+        self._encrypter = MicroBatcher(
+            self.executor, "encrypt_many", max_batch_size, max_wait
+        )
+        self._decrypter = MicroBatcher(
+            self.executor, "decrypt_many", max_batch_size, max_wait
+        )
+
+    async def aencrypt(self, message: int) -> int:
+        return await self._encrypter.submit(message)
+
+    async def adecrypt(self, ciphertext: int) -> int:
+        return await self._decrypter.submit(ciphertext)
+
+    def add_two_ciphertexts(self, ct1: int, ct2: int) -> int:
+        return self.scheme.add_two_ciphertexts(ct1, ct2)
+
+    def close(self) -> None:
+        if self._own_executor:
+            self.executor.shutdown()
+
+    async def aclose(self) -> None:
+        # shutdown waits for running batches, so it is done in a thread and
+        # the event loop keeps serving other coroutines in the meantime
+        if self._own_executor:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.executor.shutdown)
+
+    async def __aenter__(self) -> AsyncPaillierScheme:
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
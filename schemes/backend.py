@@ -0,0 +1,41 @@
+"""
+Arithmetic backend for batches of modular exponentiations.
+
+With gmpy2, batches are computed by powmod_base_list/powmod_exp_list,
+which release the GIL for the whole batch, so batches run in parallel in
+threads sharing one scheme object. Without gmpy2, Python's pow is used
+(same results, but threads do not run exponentiations in parallel).
+"""
+
+from __future__ import annotations
+
+try:
+    import gmpy2
+except ImportError:  # gmpy2 is optional, Python's pow is used without it
+    gmpy2 = None
+
+BACKEND = "gmpy2" if gmpy2 is not None else "python"
+
+
+def releases_gil() -> bool:
+    return gmpy2 is not None
+
+
+def powmod_base_list(bases: list, exponent: int, modulus: int) -> list:
+    # [b^exponent mod modulus for b in bases]
+    if gmpy2 is None:
+        return [pow(base, exponent, modulus) for base in bases]
+    return [
+        int(value)
+        for value in gmpy2.powmod_base_list(bases, exponent, modulus)
+    ]
+
+
+def powmod_exp_list(base: int, exponents: list, modulus: int) -> list:
+    # [base^e mod modulus for e in exponents]
+    if gmpy2 is None:
+        return [pow(base, exponent, modulus) for exponent in exponents]
+    return [
+        int(value)
+        for value in gmpy2.powmod_exp_list(base, exponents, modulus)
+    ]
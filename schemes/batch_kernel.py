@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+from timeit import default_timer as timer
+
+from .config import BATCH_KERNEL_BLOCK, BATCH_KERNEL_MIN, BATCH_KERNEL_VERIFY
+from .randomness import default_source
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, scalar path is used without it
+    np = None
+
+LIMB_BITS = 16
+LIMB_MASK = (1 << LIMB_BITS) - 1
+
+# Kernels of product(), one per modulus (and process)
+_kernels = {}
+
+
+def _to_limbs(values: list, limbs: int):
+    raw = b"".join(value.to_bytes(2 * limbs, "little") for value in values)
+    return np.frombuffer(raw, dtype="<u2").reshape(len(values), limbs)
+
+
+def _from_limbs(array) -> list:
+    raw = array.astype("<u2").tobytes()
+    width = 2 * array.shape[1]
+    return [
+        int.from_bytes(raw[offset : offset + width], "little")
+        for offset in range(0, len(raw), width)
+    ]
+
+
+def _normalize(coefficients):
+    # Propagate carries (and borrows, >> is floor division) until every limb
+    # is in [0, 2^16), carry out of the top limb is dropped (mod 2^(16*L))
+    while True:
+        carry = coefficients >> LIMB_BITS
+        if not carry[:, :-1].any():
+            coefficients &= LIMB_MASK
+            return coefficients
+        coefficients &= LIMB_MASK
+        coefficients[:, 1:] += carry[:, :-1]
+
+
+def _fft_size(length: int) -> int:
+    size = 1
+    while size < length:
+        size *= 2
+    return size
+
+
+class BatchModMul:
+    """
+    Modular multiplication of many operand pairs at once with NumPy.
+
+    Operands are split into 16-bit limbs, products of blocks of rows are
+    computed as FFT convolutions (exact in float64 for these limb sizes)
+    and reduced by Barrett reduction, whose constants (and their transforms)
+    are computed once per modulus. Blocks of BATCH_KERNEL_BLOCK rows keep
+    the intermediate arrays in cache.
+
+    Python's own multiplication is hard to beat for small moduli, so the
+    first batch of at least min_batch pairs times both paths and the faster
+    one is used from then on (unless vectorized is given). Without NumPy,
+    or for smaller batches, the scalar path (a * b % modulus) is used.
+
+    Every block computed by NumPy has BATCH_KERNEL_VERIFY random results
+    compared with the scalar path.
+
+    Args:
+        modulus (int): modulus, e.g. nsquared
+        min_batch (int): smallest batch handled by NumPy
+        block (int): rows computed at once by NumPy
+        verify (int): results checked against the scalar path per block
+        vectorized (bool): force NumPy path on/off, None = calibrate
+    """
+
+    def __init__(
+        self,
+        modulus: int,
+        min_batch: int = BATCH_KERNEL_MIN,
+        block: int = BATCH_KERNEL_BLOCK,
+        verify: int = BATCH_KERNEL_VERIFY,
+        vectorized: bool = None,
+    ) -> None:
+        self.modulus = modulus
+        self.min_batch = min_batch
+        self.block = block
+        self.verify = verify
+        self.vectorized = False if np is None else vectorized
+        self.timings = {}
+
+        self.k = -(-modulus.bit_length() // LIMB_BITS)
+        if np is None:
+            return
+
+        k = self.k
+        # Barrett constant mu = floor(b^2k / m) for b = 2^16
+        mu = (1 << (2 * k * LIMB_BITS)) // modulus
+
+        self._product_size = _fft_size(2 * k)
+        self._reduce_size = _fft_size(2 * k + 2)
+        self._modulus_limbs = _to_limbs([modulus], k + 2).astype(np.int64)
+        self._mu_fft = np.fft.rfft(
+            _to_limbs([mu], k + 1).astype(np.float64), n=self._reduce_size
+        )
+        self._modulus_fft = np.fft.rfft(
+            _to_limbs([modulus], k).astype(np.float64), n=self._reduce_size
+        )
+
+    @staticmethod
+    def _convolve(a_fft, b_fft, size: int, length: int):
+        product = np.fft.irfft(a_fft * b_fft, n=size, axis=1)[:, :length]
+        return np.rint(product).astype(np.int64)
+
+    def _reduce(self, x):
+        # Barrett reduction of x < m^2 given as 2k normalized limbs
+        k = self.k
+        size = self._reduce_size
+
+        q1 = x[:, k - 1 :].astype(np.float64)
+        q2 = _normalize(
+            self._convolve(
+                np.fft.rfft(q1, n=size, axis=1),
+                self._mu_fft,
+                size,
+                2 * k + 3,
+            )
+        )
+        q3 = q2[:, k + 1 : 2 * k + 2].astype(np.float64)
+        q3m = self._convolve(
+            np.fft.rfft(q3, n=size, axis=1), self._modulus_fft, size, k + 1
+        )
+
+        # r = (x - q3 * m) mod b^(k+1), extra limb keeps the sign when
+        # subtracting m below
+        r = np.zeros((x.shape[0], k + 2), dtype=np.int64)
+        r[:, : k + 1] = x[:, : k + 1] - q3m
+        r[:, k + 1] = 0
+        r[:, : k + 1] = _normalize(r[:, : k + 1])
+
+        # At most two subtractions of m are needed after Barrett reduction
+        for _ in range(2):
+            difference = _normalize(r - self._modulus_limbs)
+            non_negative = difference[:, k + 1] == 0
+            r[non_negative] = difference[non_negative]
+
+        return r[:, :k]
+
+    def _mulmod_block(self, xs: list, ys: list) -> list:
+        k = self.k
+        size = self._product_size
+        product = _normalize(
+            self._convolve(
+                np.fft.rfft(_to_limbs(xs, k).astype(np.float64), n=size),
+                np.fft.rfft(_to_limbs(ys, k).astype(np.float64), n=size),
+                size,
+                2 * k,
+            )
+        )
+        results = _from_limbs(self._reduce(product))
+
+        for _ in range(min(self.verify, len(results))):
+            index = default_source.randbelow(len(results))
+            if results[index] != xs[index] * ys[index] % self.modulus:
+                raise ArithmeticError(
+                    "Batch kernel result differs from the scalar path"
+                )
+
+        return results
+
+    def _mulmod_vectorized(self, xs: list, ys: list) -> list:
+        results = []
+        for start in range(0, len(xs), self.block):
+            results += self._mulmod_block(
+                xs[start : start + self.block], ys[start : start + self.block]
+            )
+        return results
+
+    def _calibrate(self, xs: list, ys: list) -> list:
+        start = timer()
+        results = self._mulmod_vectorized(xs, ys)
+        self.timings["vectorized"] = timer() - start
+
+        start = timer()
+        expected = [x * y % self.modulus for x, y in zip(xs, ys)]
+        self.timings["scalar"] = timer() - start
+
+        if results != expected:
+            raise ArithmeticError(
+                "Batch kernel result differs from the scalar path"
+            )
+        self.vectorized = self.timings["vectorized"] < self.timings["scalar"]
+        return results
+
+    def mulmod(self, xs: list, ys: list) -> list:
+        if len(xs) != len(ys):
+            raise ValueError("Operand lists must have the same length")
+
+        if self.vectorized is False or len(xs) < self.min_batch:
+            return [x * y % self.modulus for x, y in zip(xs, ys)]
+
+        if self.vectorized is None:
+            head = self.min_batch
+            return self._calibrate(xs[:head], ys[:head]) + self.mulmod(
+                xs[head:], ys[head:]
+            )
+
+        return self._mulmod_vectorized(xs, ys)
+
+    def product_many(self, columns: list) -> list:
+        """
+        Element-wise product of several lists of operands, e.g. gm and
+        noise values, reduced after every multiplication.
+        """
+        result = columns[0]
+        for column in columns[1:]:
+            result = self.mulmod(result, column)
+        return result
+
+
+def product(values: list, nsquared: int) -> int:
+    """
+    Product of ciphertexts mod nsquared (encrypted sum), computed as a
+    pairwise tree so that every level is one batch for BatchModMul.
+    """
+    if not values:
+        return 1
+
+    kernel = _kernels.get(nsquared)
+    if kernel is None:
+        kernel = _kernels[nsquared] = BatchModMul(nsquared)
+
+    while len(values) > 1:
+        odd = values[-1] if len(values) % 2 else None
+        values = kernel.mulmod(values[0:-1:2], values[1::2])
+        if odd is not None:
+            values.append(odd)
+    return values[0]
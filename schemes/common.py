@@ -1,10 +1,44 @@
+import hashlib
+import json
 import os
+import pickle
+import sys
+import tempfile
+import threading
+from datetime import datetime
 from functools import reduce
 
+from .config import PARAMS_DISK_CACHE
+
+try:
+    import fcntl
+except ImportError:  # not on Windows, disk cache is written without lock
+    fcntl = None
+
 PARAMS_PATH = os.path.join(
     os.path.dirname(os.path.dirname(__file__)), "params"
 )
 
+# Parsed params files: path -> (size and mtime, content hash, data)
+_params_cache = {}
+_params_lock = threading.Lock()
+
+
+def timestamped_file_name(prefix: str) -> str:
+    return (
+        prefix
+        + str(datetime.now()).replace(" ", "_").replace(":", ".")
+        + ".json"
+    )
+
+
+def key_fingerprint(n: int, g: int) -> str:
+    """
+    Short identifier of a public key, used to check that files produced
+    separately (shards, serialized ciphertexts) belong to the same key.
+    """
+    return hashlib.sha256(f"{n}:{g}".encode()).hexdigest()[:32]
+
 
 # Paillier's L-function
 def Lfunction(u: int, n: int) -> int:
@@ -33,3 +67,189 @@ def chinese_remainder(m: list, a: list) -> int:
         p = prod // n_i
         total += a_i * pow(p, -1, n_i) * p
     return total % prod
+
+
+def batch_inverse(values: list, modulus: int) -> list:
+    """
+    Inverses of all values mod modulus by Montgomery's trick: prefix
+    products, one inversion of the product of all values, then 3 modular
+    multiplications per value.
+
+    Args:
+        values (list): values invertible mod modulus
+        modulus (int): modulus, e.g. nsquared
+
+    Raises:
+        ValueError: if any value is not invertible
+
+    Returns:
+        list: inverses in the same order as values
+    """
+    if not values:
+        return []
+
+    prefix = []
+    accumulator = 1
+    for value in values:
+        accumulator = accumulator * value % modulus
+        prefix.append(accumulator)
+
+    inverse = pow(accumulator, -1, modulus)
+    inverses = [0] * len(values)
+    for i in range(len(values) - 1, 0, -1):
+        inverses[i] = inverse * prefix[i - 1] % modulus
+        inverse = inverse * values[i] % modulus
+    inverses[0] = inverse
+    return inverses
+
+
+def sub_many(cts1: list, cts2: list, nsquared: int) -> list:
+    """
+    Homomorphic differences E(m1 - m2) = E(m1) * E(m2)^-1 of ciphertext
+    pairs, all inverses are computed by one batch_inverse.
+
+    Raises:
+        ValueError: if the lists are not of the same length
+    """
+    if len(cts1) != len(cts2):
+        raise ValueError("Ciphertext lists must have the same length")
+
+    return [
+        (ct1 * inverse) % nsquared
+        for ct1, inverse in zip(cts1, batch_inverse(cts2, nsquared))
+    ]
+
+
+def table_nbytes(table) -> int:
+    """
+    Approximate memory held by a pre-computed table (list or dict with str
+    keys and int values, possibly nested), including the containers.
+    """
+    if isinstance(table, dict):
+        return sys.getsizeof(table) + sum(
+            sys.getsizeof(key) + table_nbytes(value)
+            for key, value in table.items()
+        )
+    if isinstance(table, list):
+        return sys.getsizeof(table) + sum(
+            table_nbytes(value) for value in table
+        )
+    return sys.getsizeof(table)
+
+
+def file_digest(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(2 ** 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _remove(path: str) -> None:
+    # Removal by another process (which lost no data) is a success too
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _write_disk_cache(
+    cache_dir: str, cache_path: str, prefix: str, data: dict
+) -> None:
+    # Processes loading the same file at once (process pools, sharding jobs)
+    # take turns by the lock of the cache directory, the holder removes
+    # caches of older content and writes a unique temporary file
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(os.path.join(cache_dir, ".lock"), "wb") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if os.path.exists(cache_path):  # written while waiting
+                return
+
+            for name in os.listdir(cache_dir):
+                if name.startswith(prefix) and name.endswith(".pickle"):
+                    _remove(os.path.join(cache_dir, name))
+
+            fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as file:
+                    pickle.dump(data, file, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(temp_path, cache_path)
+            finally:
+                _remove(temp_path)
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def load_params(file_name: str) -> dict:
+    """
+    Loads params file from PARAMS_PATH, every file is parsed only once per
+    process.
+
+    Parsed data are cached per file path and content hash, so all schemes
+    constructed from the same file share the same key and table objects
+    (which must not be modified in place by the caller, NoiseTableRefresher
+    refreshes its own copy of the noise entries). With PARAMS_DISK_CACHE,
+    parsed data are also pickled to PARAMS_PATH/.cache, which loads much
+    faster than JSON in the next process. Both caches are invalidated when
+    the content of the source file changes.
+
+    Args:
+        file_name (str): name of the file in PARAMS_PATH
+
+    Returns:
+        dict: parsed params
+    """
+    file_path = os.path.abspath(os.path.join(PARAMS_PATH, file_name))
+    stat = os.stat(file_path)
+    stamp = (stat.st_size, stat.st_mtime_ns)
+
+    with _params_lock:
+        cached = _params_cache.get(file_path)
+        if cached is not None and cached[0] == stamp:
+            return cached[2]
+
+        digest = file_digest(file_path)
+        if cached is not None and cached[1] == digest:
+            _params_cache[file_path] = (stamp, digest, cached[2])
+            return cached[2]
+
+        data = None
+        cache_dir = os.path.join(PARAMS_PATH, ".cache")
+        cache_path = os.path.join(
+            cache_dir, f"{os.path.basename(file_name)}-{digest[:16]}.pickle"
+        )
+
+        if PARAMS_DISK_CACHE:
+            try:
+                with open(cache_path, "rb") as file:
+                    data = pickle.load(file)
+            except FileNotFoundError:
+                pass
+
+        if data is None:
+            with open(file_path, encoding="ISO-8859-2") as file:
+                data = json.load(file)
+
+            if PARAMS_DISK_CACHE:
+                _write_disk_cache(
+                    cache_dir,
+                    cache_path,
+                    os.path.basename(file_name) + "-",
+                    data,
+                )
+
+        _params_cache[file_path] = (stamp, digest, data)
+        return data
+
+
+def clear_params_cache(file_name: str = None) -> None:
+    with _params_lock:
+        if file_name is None:
+            _params_cache.clear()
+        else:
+            _params_cache.pop(
+                os.path.abspath(os.path.join(PARAMS_PATH, file_name)), None
+            )
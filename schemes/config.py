@@ -3,3 +3,39 @@ USE_PARALLEL = True
 POWER = 2 ** 16
 NO_GNR = 5
 CHEAT = True
+ASYNC_MAX_BATCH_SIZE = 64
+ASYNC_MAX_WAIT = 0.002
+ASYNC_WORKERS = None
+SERVICE_SOCKET_PATH = None
+SERVICE_TOKEN_PATH = None
+SERVICE_POOL_SIZE = 8
+SERVICE_MAX_FRAME = 2 ** 24
+RANDOM_SEED = None
+RANDOM_BUFFER_SIZE = 2 ** 16
+GNR_GROUP_SIZE = 1
+GNR_GROUPS = None
+GNR_REFRESH_RATE = 100
+GNR_REFRESH_BATCH = 16
+GM_CACHE_SIZE = 0
+KEYRING_BUDGET = 2 ** 30
+PARAMS_DISK_CACHE = True
+TABLE_WRITE_BUFFER = 1024
+VALIDATE_SAMPLE_SIZE = 256
+VALIDATE_CHUNK = 64
+BATCH_KERNEL_MIN = 256
+BATCH_KERNEL_BLOCK = 32
+BATCH_KERNEL_VERIFY = 4
+ENCODING_BASE = 16
+ENCODING_FLOAT_EXPONENT = -6
+DATASET_CHUNK_ROWS = 2 ** 16
+GROUPBY_PARTITIONS = None
+GROUPBY_MAX_GROUPS = 2 ** 20
+GROUPBY_BATCH = 1024
+GROUPBY_SPILL_FANOUT = 16
+THREAD_WORKERS = None
+THREAD_CHUNK = 64
+KEY_POOL_SIZE = 2
+KEY_FACTORY_WORKERS = 1
+FIXED_EXP_MAX_WINDOW = 8
+AFFINITY_PIN = False
+AFFINITY_NODES = None
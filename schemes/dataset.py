@@ -0,0 +1,338 @@
+"""
+Columnar on-disk format for encrypted tables.
+
+A dataset is a directory with one file per column and meta.json. Column
+files hold fixed-width records only: ciphertext columns big-endian records
+as wide as nsquared of the key, plain columns (used for filtering)
+little-endian signed 64-bit integers. Rows are split into chunks of
+chunk_rows, meta.json holds the key, the columns and for every chunk its
+first row, number of rows and min/max of every plain column, so chunks
+which can't match a filter are skipped without being read.
+
+Column files are memory-mapped, aggregations decode records straight from
+the mapped pages chunk by chunk (in parallel worker processes with
+USE_PARALLEL), so the dataset is never loaded into Python lists as a whole.
+"""
+
+from __future__ import annotations
+
+import json
+import mmap
+import operator
+import os
+import struct
+
+from .batch_kernel import product
+from .common import key_fingerprint
+from .config import DATASET_CHUNK_ROWS, USE_PARALLEL
+
+if USE_PARALLEL:
+    import multiprocessing
+
+    from joblib import Parallel, delayed
+
+    NUM_CORES = multiprocessing.cpu_count()
+
+CIPHERTEXT = "ciphertext"
+PLAIN = "plain"
+PLAIN_RECORD = struct.Struct("<q")
+
+META_FILE = "meta.json"
+VERSION = 1
+
+OPERATORS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+# Opened datasets of worker processes by (path, meta.json mtime), reused by
+# every chunk until the dataset is rewritten
+_datasets = {}
+
+
+def column_file(path: str, column: str) -> str:
+    return os.path.join(path, f"{column}.col")
+
+
+def chunk_may_match(chunk: dict, where: list) -> bool:
+    # Zone maps: a chunk is skipped if any condition can't hold for any
+    # value between min and max of its column
+    for column, op, value in where:
+        low, high = chunk["min"][column], chunk["max"][column]
+        if op == "==" and not low <= value <= high:
+            return False
+        if op == "!=" and low == high == value:
+            return False
+        if op in ("<", "<=") and not OPERATORS[op](low, value):
+            return False
+        if op in (">", ">=") and not OPERATORS[op](high, value):
+            return False
+    return True
+
+
+class DatasetWriter:
+    """
+    Appends rows of ciphertexts (and plain values) to a new dataset.
+
+    Rows are buffered until a chunk is full, then every column of the
+    chunk is written to its file. meta.json is written when closed.
+
+    Args:
+        path (str): directory of the dataset (created)
+        public: public key of all ciphertext columns
+        columns (dict): column name -> CIPHERTEXT or PLAIN
+        chunk_rows (int): number of rows in one chunk
+    """
+
+    def __init__(
+        self,
+        path: str,
+        public,
+        columns: dict,
+        chunk_rows: int = DATASET_CHUNK_ROWS,
+    ) -> None:
+        if any(kind not in (CIPHERTEXT, PLAIN) for kind in columns.values()):
+            raise ValueError(f"Column kind must be {CIPHERTEXT} or {PLAIN}")
+
+        os.makedirs(path, exist_ok=False)
+        self.path = path
+        self.public = public
+        self.columns = dict(columns)
+        self.chunk_rows = chunk_rows
+        self.width = (public.nsquared.bit_length() + 7) // 8
+
+        self.rows = 0
+        self.chunks = []
+        self._buffer = {column: [] for column in columns}
+        self._files = {
+            column: open(column_file(path, column), "wb")
+            for column in columns
+        }
+
+    def append(self, row: dict) -> None:
+        for column in self.columns:
+            self._buffer[column].append(row[column])
+        if len(self._buffer[next(iter(self.columns))]) >= self.chunk_rows:
+            self.flush()
+
+    def extend(self, rows) -> None:
+        for row in rows:
+            self.append(row)
+
+    def flush(self) -> None:
+        count = len(self._buffer[next(iter(self.columns))])
+        if not count:
+            return
+
+        chunk = {"start": self.rows, "rows": count, "min": {}, "max": {}}
+        for column, kind in self.columns.items():
+            values = self._buffer[column]
+            if kind == CIPHERTEXT:
+                if any(not 0 <= ct < self.public.nsquared for ct in values):
+                    raise ValueError(
+                        f"Ciphertext of {column} must be in [0, nsquared)"
+                    )
+                raw = b"".join(ct.to_bytes(self.width, "big") for ct in values)
+            else:
+                raw = b"".join(PLAIN_RECORD.pack(value) for value in values)
+                chunk["min"][column] = min(values)
+                chunk["max"][column] = max(values)
+            self._files[column].write(raw)
+            self._buffer[column] = []
+
+        self.chunks.append(chunk)
+        self.rows += count
+
+    def close(self) -> None:
+        self.flush()
+        for file in self._files.values():
+            file.close()
+
+        meta = {
+            "version": VERSION,
+            "public": {
+                "n": self.public.n,
+                "g": self.public.g,
+                "nsquared": self.public.nsquared,
+            },
+            "key_fingerprint": key_fingerprint(self.public.n, self.public.g),
+            "width": self.width,
+            "rows": self.rows,
+            "chunk_rows": self.chunk_rows,
+            "columns": self.columns,
+            "chunks": self.chunks,
+        }
+        with open(
+            os.path.join(self.path, META_FILE + ".tmp"),
+            "w",
+            encoding="ISO-8859-2",
+        ) as file:
+            json.dump(meta, file)
+        os.replace(
+            os.path.join(self.path, META_FILE + ".tmp"),
+            os.path.join(self.path, META_FILE),
+        )
+
+    def __enter__(self) -> DatasetWriter:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            for file in self._files.values():
+                file.close()
+
+
+class Dataset:
+    """
+    Read-only memory-mapped dataset written by DatasetWriter.
+
+    Args:
+        path (str): directory of the dataset
+        public: if given, the dataset must be encrypted by this key
+    """
+
+    def __init__(self, path: str, public=None) -> None:
+        with open(
+            os.path.join(path, META_FILE), encoding="ISO-8859-2"
+        ) as file:
+            meta = json.load(file)
+            mtime_ns = os.fstat(file.fileno()).st_mtime_ns
+        if meta["version"] != VERSION:
+            raise ValueError(f"Unsupported dataset version: {meta['version']}")
+
+        self.path = path
+        self.meta = meta
+        self.mtime_ns = mtime_ns
+        self.nsquared = meta["public"]["nsquared"]
+        self.width = meta["width"]
+        self.rows = meta["rows"]
+        self.columns = meta["columns"]
+        self.chunks = meta["chunks"]
+
+        if public is not None and meta["key_fingerprint"] != key_fingerprint(
+            public.n, public.g
+        ):
+            raise ValueError("Dataset was encrypted by different key")
+
+        self._maps = {}
+
+    def _map(self, column: str) -> mmap.mmap:
+        mapped = self._maps.get(column)
+        if mapped is None:
+            if column not in self.columns:
+                raise KeyError(f"Unknown column: {column}")
+            with open(column_file(self.path, column), "rb") as file:
+                mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[column] = mapped
+        return mapped
+
+    def record_width(self, column: str) -> int:
+        if self.columns[column] == CIPHERTEXT:
+            return self.width
+        return PLAIN_RECORD.size
+
+    def chunk_view(self, column: str, index: int) -> memoryview:
+        chunk = self.chunks[index]
+        width = self.record_width(column)
+        start = chunk["start"] * width
+        return memoryview(self._map(column))[
+            start : start + chunk["rows"] * width
+        ]
+
+    def values(self, column: str, index: int) -> list:
+        view = self.chunk_view(column, index)
+        if self.columns[column] == PLAIN:
+            return [value for (value,) in PLAIN_RECORD.iter_unpack(view)]
+
+        width = self.width
+        return [
+            int.from_bytes(view[position : position + width], "big")
+            for position in range(0, len(view), width)
+        ]
+
+    def chunk_sum(self, column: str, index: int, where: list = None) -> int:
+        if self.columns[column] != CIPHERTEXT:
+            raise ValueError(f"{column} is not a ciphertext column")
+
+        ciphertexts = self.values(column, index)
+        if where:
+            mask = [True] * len(ciphertexts)
+            for condition_column, op, value in where:
+                compare = OPERATORS[op]
+                for row, plain in enumerate(
+                    self.values(condition_column, index)
+                ):
+                    if mask[row] and not compare(plain, value):
+                        mask[row] = False
+            ciphertexts = [ct for ct, keep in zip(ciphertexts, mask) if keep]
+
+        return product(ciphertexts, self.nsquared)
+
+    def sum(self, column: str, where: list = None) -> int:
+        """
+        Encrypted sum of column over rows matching all conditions of where.
+
+        Args:
+            column (str): ciphertext column
+            where (list): (plain column, operator, value) conditions
+
+        Returns:
+            int: ciphertext of the sum (1 if no row matches)
+        """
+        where = [tuple(condition) for condition in where or []]
+        for condition_column, op, _ in where:
+            if self.columns.get(condition_column) != PLAIN:
+                raise ValueError(f"{condition_column} is not a plain column")
+            if op not in OPERATORS:
+                raise ValueError(f"Unknown operator: {op}")
+
+        chunks = [
+            index
+            for index, chunk in enumerate(self.chunks)
+            if not where or chunk_may_match(chunk, where)
+        ]
+
+        if USE_PARALLEL and len(chunks) > 1:
+            sums = Parallel(n_jobs=min(NUM_CORES, len(chunks)))(
+                delayed(_chunk_sum)(
+                    self.path, self.mtime_ns, column, index, where
+                )
+                for index in chunks
+            )
+        else:
+            sums = [self.chunk_sum(column, index, where) for index in chunks]
+
+        return product(sums, self.nsquared)
+
+    def close(self) -> None:
+        for mapped in self._maps.values():
+            mapped.close()
+        self._maps = {}
+
+    def __enter__(self) -> Dataset:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+def _chunk_sum(
+    path: str, mtime_ns: int, column: str, index: int, where: list
+) -> int:
+    dataset = _datasets.get((path, mtime_ns))
+    if dataset is None:
+        # Dataset rewritten at the same path replaces the stale one
+        for key in [key for key in _datasets if key[0] == path]:
+            _datasets.pop(key).close()
+        dataset = Dataset(path)
+        if dataset.mtime_ns != mtime_ns:
+            dataset.close()
+            raise RuntimeError(f"Dataset {path} changed while being summed")
+        _datasets[(path, mtime_ns)] = dataset
+    return dataset.chunk_sum(column, index, where)
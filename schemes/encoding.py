@@ -0,0 +1,282 @@
+from __future__ import annotations
+
+import math
+from fractions import Fraction
+
+from .common import batch_inverse
+from .config import ENCODING_BASE, ENCODING_FLOAT_EXPONENT, POWER
+
+
+class EncodedNumber:
+    """
+    Signed value mantissa * base^exponent, mantissa is an arbitrary int.
+    """
+
+    def __init__(self, mantissa: int, exponent: int) -> None:
+        self.mantissa = mantissa
+        self.exponent = exponent
+
+    def __repr__(self) -> str:
+        return f"EncodedNumber({self.mantissa}, {self.exponent})"
+
+
+class Encoder:
+    """
+    Encoding of signed integers, floats and fractions above any scheme.
+
+    Values are encoded as mantissa * base^exponent. Only |mantissa| is
+    encrypted by the scheme, negative values are encrypted as the inverse
+    of the ciphertext mod nsquared (E(-m) = E(m)^-1), so the schemes still
+    get only non-negative messages. Mantissas longer than the scheme
+    accepts (2 * log2(POWER) bits for schemes with pre-computed g^m) are
+    encrypted in chunks of digits, every chunk being a term with its own
+    exponent (see EncryptedNumber). Decrypted plaintexts above n // 2 are
+    negative.
+
+    Args:
+        scheme: any PaillierScheme instance
+        base (int): base of the exponent
+        float_exponent (int): exponent of encoded floats (precision)
+        max_bits (int): longest message accepted by scheme, None = derive
+    """
+
+    def __init__(
+        self,
+        scheme,
+        base: int = ENCODING_BASE,
+        float_exponent: int = ENCODING_FLOAT_EXPONENT,
+        max_bits: int = None,
+    ) -> None:
+        if base < 2:
+            raise ValueError("base must be at least 2")
+
+        self.scheme = scheme
+        self.base = base
+        self.float_exponent = float_exponent
+
+        if max_bits is None:
+            if hasattr(scheme, "precomputed_gm"):
+                max_bits = int(math.log2(POWER)) * 2
+            else:
+                max_bits = scheme.public.n.bit_length() - 2
+        self.chunk_digits = 0
+        while base ** (self.chunk_digits + 1) <= 2 ** max_bits:
+            self.chunk_digits += 1
+        if not self.chunk_digits:
+            raise ValueError("base is larger than messages of scheme")
+        # Scale factors base^d used when aligning exponents, computed once
+        # per difference d
+        self._scales = {}
+
+    def scale(self, difference: int) -> int:
+        value = self._scales.get(difference)
+        if value is None:
+            value = self.base ** difference
+            self._scales[difference] = value
+        return value
+
+    def encode(self, value, exponent: int = None) -> EncodedNumber:
+        if isinstance(value, EncodedNumber):
+            return value
+
+        if exponent is None:
+            if isinstance(value, int):
+                exponent = 0
+            else:
+                exponent = self.float_exponent
+
+        if exponent >= 0:
+            mantissa = Fraction(value) / self.scale(exponent)
+        else:
+            mantissa = Fraction(value) * self.scale(-exponent)
+        return EncodedNumber(round(mantissa), exponent)
+
+    def encode_scalar(self, value) -> EncodedNumber:
+        # Plaintext multipliers are kept as short as possible, trailing
+        # zero digits are moved into the exponent
+        encoded = self.encode(value)
+        while encoded.mantissa and encoded.mantissa % self.base == 0:
+            encoded = EncodedNumber(
+                encoded.mantissa // self.base, encoded.exponent + 1
+            )
+        return encoded
+
+    def decode(self, encoded: EncodedNumber, exact: bool = False):
+        value = Fraction(encoded.mantissa) * Fraction(self.base) ** (
+            encoded.exponent
+        )
+        if exact:
+            return value
+        if value.denominator == 1 and encoded.exponent >= 0:
+            return int(value)
+        return float(value)
+
+    def signed(self, plaintext: int) -> int:
+        n = self.scheme.public.n
+        return plaintext - n if plaintext > n // 2 else plaintext
+
+    def chunks(self, encoded: EncodedNumber) -> list:
+        # (exponent, chunk) pairs of |mantissa|, each short enough for the
+        # scheme
+        mantissa = abs(encoded.mantissa)
+        exponent = encoded.exponent
+        chunk_scale = self.scale(self.chunk_digits)
+        if mantissa < chunk_scale:
+            return [(exponent, mantissa)]
+
+        # Trailing zero digits only move into the exponent
+        while mantissa % self.base == 0:
+            mantissa //= self.base
+            exponent += 1
+
+        chunks = []
+        while mantissa:
+            mantissa, chunk = divmod(mantissa, chunk_scale)
+            if chunk:
+                chunks.append((exponent, chunk))
+            exponent += self.chunk_digits
+        return chunks
+
+    def encrypt(self, value, exponent: int = None) -> EncryptedNumber:
+        return self.encrypt_many([value], exponent)[0]
+
+    def encrypt_many(self, values: list, exponent: int = None) -> list:
+        encoded = [self.encode(value, exponent) for value in values]
+        chunks = [self.chunks(e) for e in encoded]
+        ciphertexts = self.scheme.encrypt_many(
+            [chunk for pairs in chunks for _, chunk in pairs]
+        )
+
+        # Chunks of negative values are inverted together by one batch
+        # inversion
+        negative = [
+            e.mantissa < 0 for e, pairs in zip(encoded, chunks) for _ in pairs
+        ]
+        indices = [i for i, flag in enumerate(negative) if flag]
+        inverses = batch_inverse(
+            [ciphertexts[i] for i in indices], self.scheme.public.nsquared
+        )
+        for i, inverse in zip(indices, inverses):
+            ciphertexts[i] = inverse
+
+        ciphertexts = iter(ciphertexts)
+        return [
+            EncryptedNumber(self, {e: next(ciphertexts) for e, _ in pairs})
+            for pairs in chunks
+        ]
+
+    def decrypt(self, number: EncryptedNumber, exact: bool = False):
+        exponent, ciphertext = number.aligned()
+        mantissa = self.signed(self.scheme.decrypt(ciphertext))
+        return self.decode(EncodedNumber(mantissa, exponent), exact)
+
+
+class EncryptedNumber:
+    """
+    Encrypted signed value as a sum of ciphertexts with different exponents.
+
+    Additions never align exponents, ciphertexts with the same exponent are
+    multiplied together and terms with new exponents are only added to the
+    terms dict. Alignment to the smallest exponent (one exponentiation by
+    a cached base^d per distinct exponent) happens only when a single
+    ciphertext is needed, i.e. for decryption or by ciphertext(), so
+    mixed-precision aggregations pay one exponentiation per distinct
+    exponent instead of one per addition.
+
+    Args:
+        encoder (Encoder): encoder (and scheme) of the value
+        terms (dict): exponent -> ciphertext
+    """
+
+    def __init__(self, encoder: Encoder, terms: dict) -> None:
+        self.encoder = encoder
+        self.terms = terms
+
+    @property
+    def nsquared(self) -> int:
+        return self.encoder.scheme.public.nsquared
+
+    def _check(self, other: EncryptedNumber) -> None:
+        if other.encoder.scheme.public.n != self.encoder.scheme.public.n:
+            raise ValueError("Numbers are encrypted by different keys")
+
+    def aligned(self, exponent: int = None) -> tuple:
+        """
+        Returns (exponent, ciphertext) of the value aligned to exponent,
+        which must not be greater than any exponent of the terms (default
+        is the smallest one).
+        """
+        smallest = min(self.terms)
+        if exponent is None:
+            exponent = smallest
+        elif exponent > smallest:
+            raise ValueError("Exponent can be only decreased")
+
+        nsquared = self.nsquared
+        ciphertext = 1
+        for e, term in self.terms.items():
+            if e != exponent:
+                term = pow(term, self.encoder.scale(e - exponent), nsquared)
+            ciphertext = ciphertext * term % nsquared
+
+        # Keep the aligned form, so the next call costs nothing
+        self.terms = {exponent: ciphertext}
+        return exponent, ciphertext
+
+    def ciphertext(self, exponent: int = None) -> int:
+        return self.aligned(exponent)[1]
+
+    def __add__(self, other) -> EncryptedNumber:
+        if not isinstance(other, EncryptedNumber):
+            other = self.encoder.encrypt(other)
+        self._check(other)
+
+        terms = dict(self.terms)
+        for exponent, ciphertext in other.terms.items():
+            if exponent in terms:
+                terms[exponent] = self.encoder.scheme.add_two_ciphertexts(
+                    terms[exponent], ciphertext
+                )
+            else:
+                terms[exponent] = ciphertext
+        return EncryptedNumber(self.encoder, terms)
+
+    __radd__ = __add__
+
+    def __neg__(self) -> EncryptedNumber:
+        return EncryptedNumber(
+            self.encoder,
+            {
+                exponent: pow(ciphertext, -1, self.nsquared)
+                for exponent, ciphertext in self.terms.items()
+            },
+        )
+
+    def __sub__(self, other) -> EncryptedNumber:
+        if not isinstance(other, EncryptedNumber):
+            return self + self.encoder.encode(-other)
+        return self + -other
+
+    def __rsub__(self, other) -> EncryptedNumber:
+        return -self + other
+
+    def __mul__(self, other) -> EncryptedNumber:
+        if isinstance(other, EncryptedNumber):
+            raise TypeError("Paillier can't multiply two ciphertexts")
+
+        scalar = self.encoder.encode_scalar(other)
+        # Negative exponent of pow inverts the ciphertext
+        return EncryptedNumber(
+            self.encoder,
+            {
+                exponent + scalar.exponent: pow(
+                    ciphertext, scalar.mantissa, self.nsquared
+                )
+                for exponent, ciphertext in self.terms.items()
+            },
+        )
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other) -> EncryptedNumber:
+        return self * (1 / Fraction(other))
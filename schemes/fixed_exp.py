@@ -0,0 +1,263 @@
+"""
+Decryption by a fixed exponent with a pre-computed schedule.
+
+Every decryption raises a ciphertext to the same exponent (alpha, or lambd
+for scheme1). FixedExponent recodes the exponent once into a sliding-window
+schedule (window size chosen to minimize multiplications), the schedule is
+then replayed for every base. FixedExponentDecryptor computes c^e mod p^2
+and mod q^2 separately, with the exponent reduced modulo p*(p-1) and
+q*(q-1), and combines both by CRT, so all squarings work with half-size
+moduli.
+
+Usage:
+    python -m schemes.fixed_exp <params file> --scheme precompute_both
+"""
+
+from __future__ import annotations
+
+import argparse
+from timeit import default_timer as timer
+
+from .backend import powmod_base_list, releases_gil
+from .common import Lfunction
+from .config import FIXED_EXP_MAX_WINDOW
+
+
+class FixedExponent:
+    """
+    Sliding-window schedule of one exponent.
+
+    Args:
+        exponent (int): positive exponent
+        max_window (int): largest window size considered
+    """
+
+    def __init__(
+        self, exponent: int, max_window: int = FIXED_EXP_MAX_WINDOW
+    ) -> None:
+        if exponent < 1:
+            raise ValueError("exponent must be positive")
+
+        self.exponent = exponent
+        best = None
+        for window in range(1, max_window + 1):
+            steps, trailing = self.schedule(exponent, window)
+            # Odd powers 1, 3, ..., 2^w - 1 cost 2^(w-1) multiplications
+            # (including base^2), every step after the first one more
+            cost = len(steps) - 1 + (2 ** (window - 1) if window > 1 else 0)
+            if best is None or cost < best[0]:
+                best = (cost, window, steps, trailing)
+
+        self.multiplications, self.window, self.steps, self.trailing = best
+        self.squarings = sum(squarings for squarings, _ in self.steps[1:])
+        self.squarings += self.trailing
+
+    @staticmethod
+    def schedule(exponent: int, window: int) -> tuple:
+        """
+        Left-to-right sliding-window recoding of exponent.
+
+        Returns:
+            tuple: list of (squarings before, odd digit) steps and number
+                of squarings after the last step
+        """
+        bits = bin(exponent)[2:]
+        steps = []
+        squarings = 0
+        i = 0
+        while i < len(bits):
+            if bits[i] == "0":
+                squarings += 1
+                i += 1
+                continue
+
+            j = min(i + window, len(bits))
+            while bits[j - 1] == "0":
+                j -= 1
+            squarings += j - i
+            steps.append((squarings, int(bits[i:j], 2)))
+            squarings = 0
+            i = j
+        return steps, squarings
+
+    def power(self, base: int, modulus: int) -> int:
+        base %= modulus
+        odd = {1: base}
+        if self.window > 1:
+            square = base * base % modulus
+            for digit in range(3, 2 ** self.window, 2):
+                odd[digit] = odd[digit - 2] * square % modulus
+
+        # Squarings before the first digit only shift 1
+        result = odd[self.steps[0][1]]
+        for squarings, digit in self.steps[1:]:
+            for _ in range(squarings):
+                result = result * result % modulus
+            result = result * odd[digit] % modulus
+        for _ in range(self.trailing):
+            result = result * result % modulus
+        return result
+
+
+class FixedExponentDecryptor:
+    """
+    Decryption engine of one key, schedules are computed once when the key
+    is loaded (or generated) and reused by every decryption of the scheme.
+    With gmpy2 (backend.py), batches use its exponentiation with the
+    reduced exponents instead of the schedules, it is faster than the
+    schedule in Python and releases the GIL.
+
+    Args:
+        scheme: PaillierScheme with private p, q and alpha (or lambd)
+        max_window (int): largest window size considered
+    """
+
+    def __init__(
+        self, scheme, max_window: int = FIXED_EXP_MAX_WINDOW
+    ) -> None:
+        public = scheme.public
+        private = scheme.private
+        self.n = public.n
+        self.nsquared = public.nsquared
+
+        # scheme1 decrypts by lambd, the other schemes by alpha
+        self.exponent = getattr(private, "lambd", None) or private.alpha
+
+        p, q = private.p, private.q
+        self.psquared = p * p
+        self.qsquared = q * q
+        self.psquared_inverse = pow(self.psquared, -1, self.qsquared)
+
+        # Ciphertexts are units mod p^2, so the exponent can be reduced by
+        # the order p*(p-1) of the group
+        self.full = FixedExponent(self.exponent, max_window)
+        self.mod_p = FixedExponent(self.exponent % (p * (p - 1)), max_window)
+        self.mod_q = FixedExponent(self.exponent % (q * (q - 1)), max_window)
+
+        denominator = Lfunction(
+            pow(public.g, self.exponent, self.nsquared), self.n
+        )
+        self.inverse = pow(denominator, -1, self.n)
+
+    def combine(self, xp: int, xq: int) -> int:
+        # c^e mod nsquared from c^e mod p^2 and c^e mod q^2 (CRT)
+        return (
+            xp
+            + (xq - xp) * self.psquared_inverse % self.qsquared * self.psquared
+        )
+
+    def power(self, ciphertext: int) -> int:
+        return self.combine(
+            self.mod_p.power(ciphertext, self.psquared),
+            self.mod_q.power(ciphertext, self.qsquared),
+        )
+
+    def power_many(self, ciphertexts: list) -> list:
+        if not releases_gil():
+            return [self.power(ciphertext) for ciphertext in ciphertexts]
+
+        return [
+            self.combine(xp, xq)
+            for xp, xq in zip(
+                powmod_base_list(
+                    ciphertexts, self.mod_p.exponent, self.psquared
+                ),
+                powmod_base_list(
+                    ciphertexts, self.mod_q.exponent, self.qsquared
+                ),
+            )
+        ]
+
+    def decrypt(self, ciphertext: int) -> int:
+        return self.decrypt_many([ciphertext])[0]
+
+    def decrypt_many(self, ciphertexts: list) -> list:
+        if any(ct >= self.nsquared for ct in ciphertexts):
+            raise ValueError("Ciphertext must be less than nsquared")
+
+        return [
+            Lfunction(value, self.n) * self.inverse % self.n
+            for value in self.power_many(ciphertexts)
+        ]
+
+    def report(self) -> dict:
+        return {
+            name: {
+                "bits": schedule.exponent.bit_length(),
+                "window": schedule.window,
+                "squarings": schedule.squarings,
+                "multiplications": schedule.multiplications,
+            }
+            for name, schedule in (
+                ("full", self.full),
+                ("mod_p", self.mod_p),
+                ("mod_q", self.mod_q),
+            )
+        }
+
+
+def benchmark(scheme, ciphertexts: list) -> dict:
+    """
+    Times decryption of ciphertexts by builtin pow, by the schedule modulo
+    nsquared and by the schedules modulo p^2 and q^2 (CRT).
+    """
+    decryptor = FixedExponentDecryptor(scheme)
+    nsquared = decryptor.nsquared
+    exponent = decryptor.exponent
+    results = {}
+
+    start = timer()
+    expected = [pow(ct, exponent, nsquared) for ct in ciphertexts]
+    results["pow"] = timer() - start
+
+    start = timer()
+    full = [decryptor.full.power(ct, nsquared) for ct in ciphertexts]
+    results["schedule"] = timer() - start
+
+    start = timer()
+    crt = [decryptor.power(ct) for ct in ciphertexts]
+    results["schedule_crt"] = timer() - start
+
+    if full != expected or crt != expected:
+        raise ArithmeticError("Fixed exponent results differ from pow")
+
+    return {
+        "count": len(ciphertexts),
+        "seconds": results,
+        "speedup": {
+            name: results["pow"] / seconds for name, seconds in results.items()
+        },
+        "schedules": decryptor.report(),
+    }
+
+
+if __name__ == "__main__":
+    import json
+
+    from . import (
+        precompute_both_scheme,
+        precompute_gm_scheme,
+        precompute_gnr_scheme,
+    )
+
+    SCHEMES = {
+        "precompute_gm": precompute_gm_scheme,
+        "precompute_gnr": precompute_gnr_scheme,
+        "precompute_both": precompute_both_scheme,
+    }
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark fixed exponent decryption against pow"
+    )
+    parser.add_argument("params_file")
+    parser.add_argument(
+        "--scheme", choices=SCHEMES.keys(), default="precompute_both"
+    )
+    parser.add_argument("--count", type=int, default=200)
+    args = parser.parse_args()
+
+    ps = SCHEMES[args.scheme].PaillierScheme.constructFromJsonFile(
+        args.params_file
+    )
+    cts = ps.encrypt_many(list(range(args.count)))
+    print(json.dumps(benchmark(ps, cts), indent=4))
@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+
+
+class GmCache:
+    """
+    Bounded LRU cache of g^m mod nsquared for one key.
+
+    Only the message part of encryption is cached, noise is still computed
+    fresh for every ciphertext. The cache can be shared by threads, g^m of
+    a miss is computed outside the lock.
+
+    Args:
+        g (int): generator of the key
+        nsquared (int): modulus
+        capacity (int): maximal number of cached messages
+    """
+
+    def __init__(self, g: int, nsquared: int, capacity: int) -> None:
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+
+        self.g = g
+        self.nsquared = nsquared
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def peek(self, message: int) -> int:
+        # Cached value or None, a miss is not counted (the caller may
+        # compute g^m another way)
+        with self._lock:
+            value = self._values.get(message)
+            if value is not None:
+                self._values.move_to_end(message)
+                self.hits += 1
+            return value
+
+    def put(self, message: int, value: int) -> None:
+        with self._lock:
+            self._values[message] = value
+            if len(self._values) > self.capacity:
+                self._values.popitem(last=False)
+
+    def record_miss(self) -> None:
+        # For callers of peek which computed g^m themselves
+        with self._lock:
+            self.misses += 1
+
+    def get(self, message: int) -> int:
+        value = self.peek(message)
+        if value is not None:
+            return value
+
+        self.record_miss()
+        value = pow(self.g, message, self.nsquared)
+        self.put(message, value)
+        return value
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0
+
+    def stats(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "size": len(self._values),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate(),
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+            self.hits = 0
+            self.misses = 0
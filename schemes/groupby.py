@@ -0,0 +1,364 @@
+"""
+Encrypted group-by: sum of ciphertexts per plaintext group key.
+
+Pairs (key, ciphertext) are hash-partitioned by key in the calling process
+and sent in batches to one worker process per partition. Every worker
+keeps partial sums of its groups in a dict and multiplies new ciphertexts
+into them (as add_two_ciphertexts). When a worker holds more than
+max_groups groups, its dict is spilled to disk, split by a second hash of
+the key into fanout bucket files. The final merge of a partition reads
+one bucket at a time (all its spills plus the groups still in memory), so
+memory stays bounded by about max_groups groups per worker even for
+many more groups. Partitions have disjoint keys, their results are only
+concatenated.
+"""
+
+from __future__ import annotations
+
+import multiprocessing
+import os
+import pickle
+import queue
+import shutil
+import tempfile
+
+from .config import (
+    GROUPBY_BATCH,
+    GROUPBY_MAX_GROUPS,
+    GROUPBY_PARTITIONS,
+    GROUPBY_SPILL_FANOUT,
+    USE_PARALLEL,
+)
+
+# Seconds between checks that a partition worker is still alive while
+# waiting for room in its inbox
+_PUT_INTERVAL = 0.1
+
+
+def _read_batches(file_path: str):
+    with open(file_path, "rb") as file:
+        while True:
+            try:
+                yield pickle.load(file)
+            except EOFError:
+                return
+
+
+class PartialAggregate:
+    """
+    Partial encrypted sums of the groups of one partition.
+
+    Args:
+        nsquared (int): modulus of the key
+        max_groups (int): groups held in memory before spilling
+        spill_dir (str): directory for spill files of this partition
+        fanout (int): number of bucket files of one spill
+    """
+
+    def __init__(
+        self,
+        nsquared: int,
+        max_groups: int,
+        spill_dir: str,
+        fanout: int = GROUPBY_SPILL_FANOUT,
+    ) -> None:
+        self.nsquared = nsquared
+        self.max_groups = max_groups
+        self.spill_dir = spill_dir
+        self.fanout = fanout
+
+        self.groups = {}
+        self.spills = 0
+
+    def add_many(self, pairs: list) -> None:
+        groups = self.groups
+        nsquared = self.nsquared
+        for key, ciphertext in pairs:
+            partial = groups.get(key)
+            if partial is None:
+                groups[key] = ciphertext
+            else:
+                groups[key] = partial * ciphertext % nsquared
+
+        if len(groups) > self.max_groups:
+            self.spill()
+
+    def _bucket(self, key) -> int:
+        # Partitioning uses hash(key) % partitions, the bucket must not
+        # depend on those low bits only
+        return (hash(key) // 7919) % self.fanout
+
+    def _bucket_file(self, bucket: int) -> str:
+        return os.path.join(self.spill_dir, f"bucket-{bucket}.pickle")
+
+    def spill(self) -> None:
+        buckets = [[] for _ in range(self.fanout)]
+        for key, ciphertext in self.groups.items():
+            buckets[self._bucket(key)].append((key, ciphertext))
+
+        os.makedirs(self.spill_dir, exist_ok=True)
+        for bucket, pairs in enumerate(buckets):
+            if pairs:
+                with open(self._bucket_file(bucket), "ab") as file:
+                    pickle.dump(pairs, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+        self.groups = {}
+        self.spills += 1
+
+    def results(self):
+        """
+        Yields final (key, ciphertext) pairs of the partition.
+        """
+        if not self.spills:
+            yield from self.groups.items()
+            return
+
+        # Groups still in memory are merged bucket by bucket as well
+        self.spill()
+        for bucket in range(self.fanout):
+            file_path = self._bucket_file(bucket)
+            if not os.path.exists(file_path):
+                continue
+            groups = {}
+            for pairs in _read_batches(file_path):
+                for key, ciphertext in pairs:
+                    partial = groups.get(key)
+                    groups[key] = (
+                        ciphertext
+                        if partial is None
+                        else partial * ciphertext % self.nsquared
+                    )
+            os.remove(file_path)
+            yield from groups.items()
+
+
+def _partition_worker(
+    inbox,
+    errors,
+    nsquared: int,
+    max_groups: int,
+    spill_dir: str,
+    fanout: int,
+    out_file: str,
+    batch_size: int,
+) -> None:
+    try:
+        partial = PartialAggregate(nsquared, max_groups, spill_dir, fanout)
+        while True:
+            pairs = inbox.get()
+            if pairs is None:
+                break
+            partial.add_many(pairs)
+
+        with open(out_file + ".tmp", "wb") as file:
+            batch = []
+            for pair in partial.results():
+                batch.append(pair)
+                if len(batch) >= batch_size:
+                    pickle.dump(
+                        batch, file, protocol=pickle.HIGHEST_PROTOCOL
+                    )
+                    batch = []
+            pickle.dump(batch, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(out_file + ".tmp", out_file)
+    except Exception as error:
+        # The error is raised again by the parent, it must be picklable
+        try:
+            pickle.dumps(error)
+        except Exception:
+            error = RuntimeError(repr(error))
+        errors.put(error)
+        raise
+
+
+class GroupBy:
+    """
+    Encrypted sum per group of a stream of (group key, ciphertext) pairs.
+
+    Group keys must be hashable and picklable. Without USE_PARALLEL (or
+    with partitions=1) all partitions are aggregated in the calling
+    process, with the same spilling.
+
+    Args:
+        public: public key of the ciphertexts
+        partitions (int): number of partitions/worker processes,
+            None = number of cores
+        max_groups (int): groups held in memory by one partition before
+            spilling to disk
+        batch_size (int): pairs sent to a worker at once
+        spill_dir (str): directory for spill files, None = temporary
+        fanout (int): bucket files per spill
+    """
+
+    def __init__(
+        self,
+        public,
+        partitions: int = GROUPBY_PARTITIONS,
+        max_groups: int = GROUPBY_MAX_GROUPS,
+        batch_size: int = GROUPBY_BATCH,
+        spill_dir: str = None,
+        fanout: int = GROUPBY_SPILL_FANOUT,
+    ) -> None:
+        self.nsquared = public.nsquared
+        self.partitions = partitions or multiprocessing.cpu_count()
+        self.max_groups = max_groups
+        self.batch_size = batch_size
+        self.fanout = fanout
+        self.parallel = USE_PARALLEL and self.partitions > 1
+
+        self._own_dir = spill_dir is None
+        self.spill_dir = spill_dir or tempfile.mkdtemp(prefix="groupby-")
+
+        self._batches = [[] for _ in range(self.partitions)]
+        self._workers = None
+        self._errors = None
+        self._partials = None
+        self._finished = False
+
+    def _partition_dir(self, partition: int) -> str:
+        return os.path.join(self.spill_dir, f"partition-{partition}")
+
+    def _out_file(self, partition: int) -> str:
+        return os.path.join(self.spill_dir, f"partition-{partition}.out")
+
+    def _start(self) -> None:
+        if self.parallel:
+            self._workers = []
+            self._errors = multiprocessing.Queue()
+            for partition in range(self.partitions):
+                inbox = multiprocessing.Queue(maxsize=16)
+                process = multiprocessing.Process(
+                    target=_partition_worker,
+                    args=(
+                        inbox,
+                        self._errors,
+                        self.nsquared,
+                        self.max_groups,
+                        self._partition_dir(partition),
+                        self.fanout,
+                        self._out_file(partition),
+                        self.batch_size,
+                    ),
+                    daemon=True,
+                )
+                process.start()
+                self._workers.append((process, inbox))
+        else:
+            self._partials = [
+                PartialAggregate(
+                    self.nsquared,
+                    self.max_groups,
+                    self._partition_dir(partition),
+                    self.fanout,
+                )
+                for partition in range(self.partitions)
+            ]
+
+    def _raise_worker_error(self, partition: int) -> None:
+        process = self._workers[partition][0]
+        process.join()
+        try:
+            error = self._errors.get(timeout=1)
+        except queue.Empty:
+            error = None
+        if error is not None:
+            raise error
+        raise RuntimeError(
+            f"Partition worker {partition} failed"
+            f" (exit code {process.exitcode})"
+        )
+
+    def _put(self, partition: int, item) -> None:
+        # Inboxes are bounded, a worker which died would block put forever
+        process, inbox = self._workers[partition]
+        while True:
+            try:
+                inbox.put(item, timeout=_PUT_INTERVAL)
+                return
+            except queue.Full:
+                pass
+            if not process.is_alive():
+                self._raise_worker_error(partition)
+
+    def _send(self, partition: int) -> None:
+        pairs = self._batches[partition]
+        self._batches[partition] = []
+        if self._workers is not None:
+            self._put(partition, pairs)
+        else:
+            self._partials[partition].add_many(pairs)
+
+    def add_many(self, pairs) -> None:
+        if self._finished:
+            raise RuntimeError("Results were already computed")
+        if self._workers is None and self._partials is None:
+            self._start()
+
+        batches = self._batches
+        partitions = self.partitions
+        for pair in pairs:
+            partition = hash(pair[0]) % partitions
+            batches[partition].append(pair)
+            if len(batches[partition]) >= self.batch_size:
+                self._send(partition)
+
+    def add(self, key, ciphertext: int) -> None:
+        self.add_many([(key, ciphertext)])
+
+    def results(self):
+        """
+        Ends the input and yields (group key, encrypted sum) pairs, every
+        group exactly once, in no particular order.
+        """
+        if self._finished:
+            raise RuntimeError("Results were already computed")
+        self._finished = True
+        if self._workers is None and self._partials is None:
+            return
+
+        for partition in range(self.partitions):
+            if self._batches[partition]:
+                self._send(partition)
+
+        if self._partials is not None:
+            for partial in self._partials:
+                yield from partial.results()
+            return
+
+        for partition in range(self.partitions):
+            self._put(partition, None)
+        for partition, (process, _) in enumerate(self._workers):
+            process.join()
+            if process.exitcode != 0:
+                self._raise_worker_error(partition)
+        for partition in range(self.partitions):
+            for pairs in _read_batches(self._out_file(partition)):
+                yield from pairs
+            os.remove(self._out_file(partition))
+            shutil.rmtree(self._partition_dir(partition), ignore_errors=True)
+
+    def close(self) -> None:
+        if self._workers is not None:
+            for process, inbox in self._workers:
+                if process.is_alive():
+                    process.terminate()
+                # Batches nobody will read must not block the exit
+                inbox.cancel_join_thread()
+        if self._own_dir:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+    def __enter__(self) -> GroupBy:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+def group_sum(pairs, public, **kwargs) -> dict:
+    """
+    Encrypted sum per group key of (group key, ciphertext) pairs, all
+    results are collected into a dict (see GroupBy for streaming them).
+    """
+    with GroupBy(public, **kwargs) as group_by:
+        group_by.add_many(pairs)
+        return dict(group_by.results())
@@ -0,0 +1,188 @@
+"""
+Pool of keys with pre-computed tables generated ahead of time.
+
+Ready bundles are regular params files kept in PARAMS_PATH/pool/<scheme>,
+so they survive restarts and can be shared by several processes: taking a
+bundle moves its file into PARAMS_PATH (os.replace, only one process can
+win) and loads it by constructFromJsonFile. Every taken bundle is
+replaced by a new one generated in a worker process.
+
+Usage:
+    python -m schemes.key_factory precompute_both --pool-size 4
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from . import (
+    precompute_both_scheme,
+    precompute_gm_scheme,
+    precompute_gnr_scheme,
+)
+from .common import PARAMS_PATH
+from .config import DEFAULT_KEYSIZE, KEY_FACTORY_WORKERS, KEY_POOL_SIZE
+
+SCHEMES = {
+    "precompute_gm": precompute_gm_scheme,
+    "precompute_gnr": precompute_gnr_scheme,
+    "precompute_both": precompute_both_scheme,
+}
+
+
+def pool_path(scheme: str) -> str:
+    return os.path.join(PARAMS_PATH, "pool", scheme)
+
+
+def generate_bundle(scheme: str, n_length: int, pool_dir: str) -> str:
+    # Runs in a worker process, the scheme saves its params file as usual
+    # and the finished file is moved into the pool
+    module = SCHEMES[scheme]
+    ps = module.PaillierScheme(n_length=n_length)
+    os.replace(
+        os.path.join(module.PARAMS_PATH, ps.file_name),
+        os.path.join(pool_dir, ps.file_name),
+    )
+    return ps.file_name
+
+
+class KeyFactory:
+    """
+    Keeps pool_size ready key-plus-table bundles of one scheme.
+
+    Args:
+        scheme (str): precompute_gm, precompute_gnr or precompute_both
+        pool_size (int): number of ready bundles to keep
+        n_length (int): key size of generated keys
+        workers (int): number of bundles generated in parallel
+    """
+
+    def __init__(
+        self,
+        scheme: str = "precompute_both",
+        pool_size: int = KEY_POOL_SIZE,
+        n_length: int = DEFAULT_KEYSIZE,
+        workers: int = KEY_FACTORY_WORKERS,
+    ) -> None:
+        if scheme not in SCHEMES:
+            raise ValueError(f"Unknown scheme: {scheme}")
+
+        self.scheme = scheme
+        self.pool_size = pool_size
+        self.n_length = n_length
+        self.workers = workers
+        self.pool_dir = pool_path(scheme)
+        # Failures since the last successful generation
+        self.errors = []
+
+        self._pending = 0
+        self._last_error = None
+        self._condition = threading.Condition()
+        self._executor = None
+
+    def ready(self) -> list:
+        if not os.path.isdir(self.pool_dir):
+            return []
+        return sorted(
+            name
+            for name in os.listdir(self.pool_dir)
+            if name.endswith(".json")
+        )
+
+    def start(self) -> KeyFactory:
+        os.makedirs(self.pool_dir, exist_ok=True)
+        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        self.replenish()
+        return self
+
+    def replenish(self) -> None:
+        with self._condition:
+            missing = self.pool_size - len(self.ready()) - self._pending
+            for _ in range(max(0, missing)):
+                self._pending += 1
+                self._executor.submit(
+                    generate_bundle, self.scheme, self.n_length, self.pool_dir
+                ).add_done_callback(self._generated)
+
+    def _generated(self, future) -> None:
+        with self._condition:
+            self._pending -= 1
+            self._last_error = future.exception()
+            if self._last_error is not None:
+                self.errors.append(self._last_error)
+            else:
+                self.errors.clear()
+            self._condition.notify_all()
+
+    def take_file(self, timeout: float = None) -> str:
+        """
+        Claims one ready bundle and moves it into PARAMS_PATH, waits for a
+        bundle being generated if the pool is empty.
+
+        Returns:
+            str: params file name in PARAMS_PATH
+        """
+        with self._condition:
+            while True:
+                for name in self.ready():
+                    try:
+                        os.replace(
+                            os.path.join(self.pool_dir, name),
+                            os.path.join(PARAMS_PATH, name),
+                        )
+                    except FileNotFoundError:  # taken by another process
+                        continue
+                    if self._executor is not None:
+                        self.replenish()
+                    return name
+
+                if self._executor is None:
+                    raise LookupError(f"No ready {self.scheme} bundle")
+                if not self._pending:
+                    error = self._last_error
+                    if error is not None:
+                        # Reported once, the next call generates again
+                        self._last_error = None
+                        raise RuntimeError(
+                            f"Generation of {self.scheme} bundle failed"
+                        ) from error
+                    self.replenish()
+                if not self._condition.wait(timeout):
+                    raise TimeoutError(f"No {self.scheme} bundle in time")
+
+    def take(self, timeout: float = None):
+        file_name = self.take_file(timeout)
+        return SCHEMES[self.scheme].PaillierScheme.constructFromJsonFile(
+            file_name
+        )
+
+    def stop(self, wait: bool = True) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=not wait)
+            self._executor = None
+
+    def __enter__(self) -> KeyFactory:
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Fill pool of pre-generated keys with tables"
+    )
+    parser.add_argument("scheme", choices=SCHEMES.keys())
+    parser.add_argument("--pool-size", type=int, default=KEY_POOL_SIZE)
+    parser.add_argument("--n-length", type=int, default=DEFAULT_KEYSIZE)
+    parser.add_argument("--workers", type=int, default=KEY_FACTORY_WORKERS)
+    args = parser.parse_args()
+
+    factory = KeyFactory(
+        args.scheme, args.pool_size, args.n_length, args.workers
+    ).start()
+    factory.stop(wait=True)
+    print("\n".join(factory.ready()))
@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from .common import clear_params_cache, table_nbytes
+from .config import KEYRING_BUDGET
+from .precompute_both_scheme import PaillierScheme
+
+
+class Keyring:
+    """
+    Many precompute_both keys identified by key ID under one memory budget.
+
+    Keys are loaded from their params files on first use. Bytes held by the
+    pre-computed tables of every key are tracked and when the sum exceeds
+    budget, tables of the least recently used keys are unloaded. Schemes of
+    such keys keep working with table-free encryption (as scheme3) until
+    they are used through the keyring again and their tables are reloaded.
+    A single key larger than the budget is still loaded, but all other
+    tables are unloaded. Params files are parsed outside the lock, so
+    lookups of loaded keys never wait for a cold load, and callers asking
+    for a key being loaded wait for that load instead of repeating it.
+
+    Args:
+        budget (int): maximal number of bytes held by loaded tables
+    """
+
+    def __init__(self, budget: int = KEYRING_BUDGET) -> None:
+        self.budget = budget
+
+        self._files = {}
+        self._schemes = {}
+        self._loaded = OrderedDict()  # key ID -> table bytes, LRU order
+        self._loading = {}  # key ID -> Future of the scheme being loaded
+        self._lock = threading.RLock()
+
+    def register(self, key_id: str, file_name: str) -> None:
+        with self._lock:
+            self._files[key_id] = file_name
+
+    def get(self, key_id: str) -> PaillierScheme:
+        with self._lock:
+            if key_id not in self._files:
+                raise KeyError(f"Unknown key ID: {key_id}")
+
+            if key_id in self._loaded:
+                self._loaded.move_to_end(key_id)
+                return self._schemes[key_id]
+
+            future = self._loading.get(key_id)
+            if future is not None:
+                waiting = True
+            else:
+                waiting = False
+                future = self._loading[key_id] = Future()
+                file_name = self._files[key_id]
+        if waiting:
+            return future.result()
+
+        try:
+            loaded = PaillierScheme.constructFromJsonFile(file_name)
+            nbytes = table_nbytes(loaded.precomputed_gm) + table_nbytes(
+                loaded.precomputed_gnr
+            )
+        except BaseException as error:
+            with self._lock:
+                del self._loading[key_id]
+            future.set_exception(error)
+            raise
+
+        with self._lock:
+            scheme = self._schemes.get(key_id)
+            if scheme is None:
+                scheme = self._schemes[key_id] = loaded
+            else:
+                # Reuse the instance callers may hold, only tables are new
+                scheme.loadTables(
+                    loaded.precomputed_gm, loaded.precomputed_gnr
+                )
+
+            self._loaded[key_id] = nbytes
+            self._evict(keep=key_id)
+            del self._loading[key_id]
+        future.set_result(scheme)
+        return scheme
+
+    def _evict(self, keep: str) -> None:
+        while self.nbytes() > self.budget and len(self._loaded) > 1:
+            key_id = next(iter(self._loaded))
+            if key_id == keep:
+                self._loaded.move_to_end(key_id)
+                continue
+            self.unload(key_id)
+
+    def unload(self, key_id: str) -> None:
+        with self._lock:
+            if self._loaded.pop(key_id, None) is not None:
+                self._schemes[key_id].unloadTables()
+                # Parsed file would keep the tables alive otherwise
+                clear_params_cache(self._files[key_id])
+
+    def nbytes(self, key_id: str = None) -> int:
+        with self._lock:
+            if key_id is not None:
+                return self._loaded.get(key_id, 0)
+            return sum(self._loaded.values())
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "budget": self.budget,
+                "bytes": self.nbytes(),
+                "registered": len(self._files),
+                "loaded": list(self._loaded),
+                "bytes_per_key": dict(self._loaded),
+            }
@@ -0,0 +1,325 @@
+from __future__ import annotations
+
+import math
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from timeit import default_timer as timer
+
+from .batch_kernel import BatchModMul
+from .common import PARAMS_PATH, clear_params_cache, load_params, table_nbytes
+from .config import (
+    CHEAT,
+    GNR_GROUP_SIZE,
+    GNR_GROUPS,
+    GNR_REFRESH_BATCH,
+    GNR_REFRESH_RATE,
+    NO_GNR,
+)
+from .randomness import default_source
+from .table_writer import ParamsWriter
+from .validation import table_checksum
+
+# Params of the refreshed file without its noise table, loaded once by the
+# helper process of NoiseTableRefresher
+_persisted_params = {}
+
+
+class NoiseTable:
+    """
+    Pre-computed (g^n)^r values combined into the noise of one encryption.
+
+    Every encryption multiplies count random table entries. With
+    group_size > 1, a second level of products of group_size random
+    distinct entries is pre-computed, so count entries are covered by
+    count // group_size grouped entries (plus count % group_size plain
+    ones) and fewer modular multiplications are needed per encryption.
+    The product is reduced after every multiplication, so intermediate
+    values never grow over twice the size of nsquared.
+
+    Args:
+        entries (list): pre-computed (g^n)^r values, shared (not copied)
+        nsquared (int): modulus
+        count (int): number of entries multiplied per encryption
+        group_size (int): number of entries in one grouped product
+        groups (int): size of the grouped level, None = len(entries)
+    """
+
+    def __init__(
+        self,
+        entries: list,
+        nsquared: int,
+        count: int = NO_GNR,
+        group_size: int = GNR_GROUP_SIZE,
+        groups: int = GNR_GROUPS,
+        source=default_source,
+    ) -> None:
+        if group_size < 1 or count < 1:
+            raise ValueError("count and group_size must be at least 1")
+
+        self.entries = entries
+        self.nsquared = nsquared
+        self.count = count
+        self.group_size = group_size
+        self.source = source
+        self.kernel = BatchModMul(nsquared)
+
+        self.grouped = []
+        if 1 < group_size <= count:
+            self.grouped = [
+                self.product(source.sample(entries, group_size))
+                for _ in range(groups or len(entries))
+            ]
+
+        self.grouped_draws = count // group_size if self.grouped else 0
+        self.plain_draws = count - self.grouped_draws * group_size
+
+    def product(self, values: list) -> int:
+        result = values[0]
+        for value in values[1:]:
+            result = result * value % self.nsquared
+        return result
+
+    def sample_product(self) -> int:
+        values = self.source.sample(self.grouped, self.grouped_draws)
+        if self.plain_draws:
+            values += self.source.sample(self.entries, self.plain_draws)
+        return self.product(values)
+
+    def sample_products(self, count: int) -> list:
+        # Same draws as sample_product, but the products of all count
+        # encryptions are computed column by column by the batch kernel
+        rows = [
+            self.source.sample(self.grouped, self.grouped_draws)
+            + self.source.sample(self.entries, self.plain_draws)
+            for _ in range(count)
+        ]
+        return self.kernel.product_many(
+            [list(column) for column in zip(*rows)]
+        )
+
+    def multiplications(self) -> int:
+        return self.grouped_draws + self.plain_draws - 1
+
+    def entropy(self) -> float:
+        # Number of distinct subsets one encryption can choose from, grouped
+        # entries are fixed products so they count as single values
+        return (
+            math.log2(math.comb(len(self.grouped), self.grouped_draws))
+            + math.log2(math.comb(len(self.entries), self.plain_draws))
+        )
+
+    def report(self) -> dict:
+        return {
+            "count": self.count,
+            "group_size": self.group_size,
+            "entries": len(self.entries),
+            "grouped": len(self.grouped),
+            "multiplications": self.multiplications(),
+            "bytes": table_nbytes(self.entries) + table_nbytes(self.grouped),
+            "entropy_bits": self.entropy(),
+        }
+
+
+def fresh_entries(
+    g: int, n: int, nsquared: int, alpha: int, count: int
+) -> list:
+    gn = pow(g, n, nsquared)
+    entries = []
+    for _ in range(count):
+        # Generate r the same way as when pre-computing the table
+        if CHEAT:
+            r = default_source.randint(1, alpha - 1)
+        else:
+            r = pow(g, default_source.randint(1, n), n)
+        entries.append(pow(gn, r, nsquared))
+    return entries
+
+
+def persist_entries(source: str, file_name: str, entries: list) -> None:
+    """
+    Writes params file file_name with the noise table replaced by entries,
+    everything else is copied from params file source. Runs in the helper
+    process of NoiseTableRefresher, so serialization does not hold the GIL
+    of encrypting threads.
+    """
+    params = _persisted_params.get(source)
+    if params is None:
+        params = {
+            key: value
+            for key, value in load_params(source).items()
+            if key != "precomputed_gnr"
+        }
+        _persisted_params[source] = params
+
+    checksums = dict(params.get("checksums") or {})
+    checksums["precomputed_gnr"] = table_checksum(
+        entries, params["public"]["nsquared"]
+    )
+    header = {
+        key: value
+        for key, value in params.items()
+        if key not in ("precomputed_gm", "checksums")
+    }
+
+    file_path = os.path.join(PARAMS_PATH, file_name)
+    with ParamsWriter(file_path, header) as writer:
+        writer.begin("precomputed_gnr", "[")
+        for value in entries:
+            writer.item(value)
+        writer.end()
+
+        precomputed_gm = params.get("precomputed_gm")
+        if precomputed_gm is not None:
+            writer.begin("precomputed_gm")
+            for level, table in precomputed_gm.items():
+                writer.begin(level)
+                for key, value in table.items():
+                    writer.item(value, key)
+                writer.end()
+            writer.end()
+
+        writer.item(checksums, "checksums")
+
+
+class NoiseTableRefresher:
+    """
+    Background replacement of noise table entries by fresh (g^n)^r values.
+
+    Fresh values are computed in a separate process (so the exponentiation
+    does not hold the GIL of encrypting threads) in batches of batch_size,
+    at most rate entries per second. Entries are swapped in by plain list
+    item assignment, which is atomic, so encryption takes no lock; a
+    grouped entry is rebuilt for every refreshed plain entry. With
+    persist_interval set, a snapshot of the noise table is written every
+    persist_interval seconds by the same process (persist_entries), the
+    rest of the params file is copied from the file the scheme was loaded
+    from. A scheme without params file is saved once by saveJson first.
+
+    Args:
+        scheme: scheme with noise_table, public and private
+        rate (float): refreshed entries per second
+        batch_size (int): entries computed by one call of the worker
+        persist_interval (float): seconds between saves, None = never
+        file_name (str): params file name used for saving, None = the
+            scheme's file_name or the name chosen by the first save
+    """
+
+    def __init__(
+        self,
+        scheme,
+        rate: float = GNR_REFRESH_RATE,
+        batch_size: int = GNR_REFRESH_BATCH,
+        persist_interval: float = None,
+        file_name: str = None,
+    ) -> None:
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+
+        self.scheme = scheme
+        self.table = scheme.noise_table
+        self.rate = rate
+        self.batch_size = batch_size
+        self.persist_interval = persist_interval
+        self.file_name = file_name or getattr(scheme, "file_name", None)
+        self.refreshed = 0
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._executor = None
+
+    def start(self) -> NoiseTableRefresher:
+        # Entries are shared with every scheme loaded from the same params
+        # file (load_params cache), so they are refreshed in a private copy
+        entries = list(self.table.entries)
+        self.table.entries = entries
+        self.scheme.precomputed_gnr = entries
+
+        self._executor = ProcessPoolExecutor(max_workers=1)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self._executor.shutdown()
+
+    def swap(self, entries: list) -> None:
+        table = self.table
+        for value in entries:
+            table.entries[table.source.randbelow(len(table.entries))] = value
+            if table.grouped:
+                table.grouped[table.source.randbelow(len(table.grouped))] = (
+                    table.product(
+                        table.source.sample(table.entries, table.group_size)
+                    )
+                )
+        self.refreshed += len(entries)
+
+    def persist(self) -> None:
+        source = getattr(self.scheme, "file_name", None)
+        if source is None or self.file_name is None:
+            # Without file_name, saveJson chooses a new timestamped name,
+            # later saves replace that file
+            self.scheme.saveJson(self.file_name)
+            self.file_name = self.scheme.file_name
+        else:
+            # Copying the list is fast, serialization runs in the helper
+            self._executor.submit(
+                persist_entries,
+                source,
+                self.file_name,
+                list(self.table.entries),
+            ).result()
+        clear_params_cache(self.file_name)
+
+    def _run(self) -> None:
+        public = self.scheme.public
+        last_persist = timer()
+
+        while not self._stop.is_set():
+            start = timer()
+            entries = self._executor.submit(
+                fresh_entries,
+                public.g,
+                public.n,
+                public.nsquared,
+                self.scheme.private.alpha,
+                self.batch_size,
+            ).result()
+            self.swap(entries)
+
+            if (
+                self.persist_interval is not None
+                and timer() - last_persist >= self.persist_interval
+            ):
+                self.persist()
+                last_persist = timer()
+
+            # Keep the long-term rate at most rate entries per second
+            self._stop.wait(
+                max(0, len(entries) / self.rate - (timer() - start))
+            )
+
+
+if __name__ == "__main__":
+    from .precompute_gnr_scheme import PaillierScheme
+
+    if len(sys.argv) != 2:
+        raise SystemExit(
+            "Usage: python -m schemes.noise_table <params file name>"
+        )
+
+    ps = PaillierScheme.constructFromJsonFile(sys.argv[1])
+    for group_size in range(1, NO_GNR + 1):
+        table = NoiseTable(
+            ps.precomputed_gnr, ps.public.nsquared, group_size=group_size
+        )
+        report = table.report()
+        print(
+            f"group_size: {group_size}, "
+            f"multiplications: {report['multiplications']}, "
+            f"memory: {report['bytes'] / 2 ** 20:.1f} MiB, "
+            f"entropy: {report['entropy_bits']:.1f} bits"
+        )
@@ -3,22 +3,33 @@ from __future__ import annotations
 import json
 import math
 import os
-from datetime import datetime
-from functools import reduce
-from operator import mul
 
 from Cryptodome.PublicKey import DSA
-from Cryptodome.Random import random
 
-from .common import PARAMS_PATH, Lfunction, chinese_remainder
-from .config import CHEAT, DEFAULT_KEYSIZE, NO_GNR, POWER, USE_PARALLEL
+from .common import (
+    PARAMS_PATH,
+    batch_inverse,
+    chinese_remainder,
+    load_params,
+    sub_many,
+    timestamped_file_name,
+)
+from .config import CHEAT, DEFAULT_KEYSIZE, POWER, USE_PARALLEL
+from .fixed_exp import FixedExponentDecryptor
+from .noise_table import NoiseTable
+from .randomness import default_source
+from .table_writer import ParamsWriter
+from .validation import table_checksums, validate_tables
 
 if USE_PARALLEL:
     import multiprocessing
 
     from joblib import Parallel, delayed
 
+    from .affinity import Placement, pinned
+
     NUM_CORES = multiprocessing.cpu_count()
+    PLACEMENT = Placement(NUM_CORES)
 
 
 class Public:
@@ -73,74 +84,99 @@ class PaillierScheme:
 
             self.public = Public(n, g, nsquared)
             self.private = Private(p1, p2, alpha)
-
-            # Precompute g^m to speed up encryption
-            self.precomputed_gm = {}
-            self.precompute_gm(g, nsquared)
-
-            # Precompute (g^n)^r to speed up encryption
-            self.precomputed_gnr = []
-            self.precompute_gnr(g, n, nsquared, alpha)
-
-            self.saveJson()
+            self.decryptor = FixedExponentDecryptor(self)
+
+            self.file_name = timestamped_file_name("precompute_both-")
+            if not os.path.exists(PARAMS_PATH):
+                os.mkdir(PARAMS_PATH)
+
+            # Pre-computed values are streamed to the params file while
+            # they are computed instead of saving them by saveJson
+            with ParamsWriter(
+                os.path.join(PARAMS_PATH, self.file_name),
+                {
+                    "scheme": "precompute_both",
+                    "public": self.public.__dict__,
+                    "private": self.private.__dict__,
+                },
+            ) as writer:
+                # Precompute g^m to speed up encryption
+                self.precomputed_gm = {}
+                self.precompute_gm(g, nsquared, writer)
+
+                # Precompute (g^n)^r to speed up encryption
+                self.precomputed_gnr = []
+                self.precompute_gnr(g, n, nsquared, alpha, writer)
+                writer.item(table_checksums(self), key="checksums")
+
+            self.noise_table = NoiseTable(self.precomputed_gnr, nsquared)
 
     @staticmethod
     def constructFromJsonFile(file_name: str) -> PaillierScheme:
         ps = PaillierScheme(generate=False)
         if file_name is not None:
-            with open(
-                os.path.join(PARAMS_PATH, file_name), encoding="ISO-8859-2"
-            ) as file:
-                data = json.load(file)
-                public = data["public"]
-                private = data["private"]
-
-                ps.public = Public(
-                    public["n"], public["g"], public["nsquared"]
-                )
-                ps.private = Private(
-                    private["p"], private["q"], private["alpha"]
+            data = load_params(file_name)
+            ps.file_name = file_name
+            public = data["public"]
+            private = data["private"]
+
+            ps.public = Public(public["n"], public["g"], public["nsquared"])
+            ps.private = Private(private["p"], private["q"], private["alpha"])
+            ps.decryptor = FixedExponentDecryptor(ps)
+
+            if any(
+                key not in data
+                for key in ("precomputed_gnr", "precomputed_gm")
+            ):
+                raise ValueError(
+                    "precomputed_gnr or precomputed_gm is missing in the"
+                    " data"
                 )
 
-                if any(
-                    key not in data
-                    for key in ("precomputed_gnr", "precomputed_gm")
-                ):
-                    raise ValueError(
-                        "precomputed_gnr or precomputed_gm is missing in the"
-                        " data"
-                    )
+            ps.loadTables(data["precomputed_gm"], data["precomputed_gnr"])
 
-                ps.precomputed_gnr = data["precomputed_gnr"]
-                ps.precomputed_gm = data["precomputed_gm"]
-                return ps
+            # Sampled check that the tables belong to the key (and match
+            # checksums stored when they were saved)
+            validate_tables(ps, data.get("checksums"))
+            return ps
         else:
             raise AttributeError("File not found")
 
-    def saveJson(self) -> None:
+    def unloadTables(self) -> None:
+        self.precomputed_gm = None
+        self.precomputed_gnr = None
+        self.noise_table = None
+
+    def loadTables(self, precomputed_gm: dict, precomputed_gnr: list) -> None:
+        self.precomputed_gm = precomputed_gm
+        self.precomputed_gnr = precomputed_gnr
+        self.noise_table = NoiseTable(precomputed_gnr, self.public.nsquared)
+
+    def saveJson(self, file_name: str = None) -> None:
         params = {
             "scheme": "precompute_both",
             "public": self.public.__dict__,
             "private": self.private.__dict__,
             "precomputed_gnr": self.precomputed_gnr,
             "precomputed_gm": self.precomputed_gm,
+            "checksums": table_checksums(self),
         }
 
-        self.file_name = (
-            "precompute_both-"
-            + str(datetime.now()).replace(" ", "_").replace(":", ".")
-            + ".json"
-        )
+        self.file_name = file_name or timestamped_file_name("precompute_both-")
 
         if not os.path.exists(PARAMS_PATH):
             os.mkdir(PARAMS_PATH)
 
+        # Write to temporary file first, so an existing file is replaced
+        # only by a complete one
+        file_path = os.path.join(PARAMS_PATH, self.file_name)
         with open(
-            os.path.join(PARAMS_PATH, self.file_name),
+            file_path + ".tmp",
             "w",
             encoding="ISO-8859-2",
         ) as file:
             json.dump(params, file)
+        os.replace(file_path + ".tmp", file_path)
 
     @staticmethod
     def compute_gnr(
@@ -148,11 +184,11 @@ class PaillierScheme:
     ) -> int:
         # Generate r using generator g
         if CHEAT:
-            r = random.randint(1, alpha - 1)
+            r = default_source.randint(1, alpha - 1)
         else:
             r = pow(
                 g,
-                random.randint(1, n),
+                default_source.randint(1, n),
                 n,
             )
 
@@ -162,24 +198,45 @@ class PaillierScheme:
         return gnr
 
     def precompute_gnr(
-        self, g: int, n: int, nsquared: int, alpha: int
+        self,
+        g: int,
+        n: int,
+        nsquared: int,
+        alpha: int,
+        writer: ParamsWriter = None,
     ) -> None:
         gn = pow(g, n, nsquared)
 
+        # Values are consumed one by one as they are computed, so no list
+        # of all results is held next to the table
         if USE_PARALLEL:
-            result = Parallel(n_jobs=NUM_CORES)(
-                delayed(self.compute_gnr)(g, n, nsquared, gn, i, alpha)
+            result = Parallel(n_jobs=NUM_CORES, return_as="generator")(
+                delayed(pinned)(
+                    PLACEMENT.cpus_of(i),
+                    self.compute_gnr,
+                    g,
+                    n,
+                    nsquared,
+                    gn,
+                    i,
+                    alpha,
+                )
                 for i in range(POWER)
             )
-            if isinstance(result, list):
-                self.precomputed_gnr.extend(result)
-            else:
-                raise TypeError("Result should be list of ints!")
         else:
-            for i in range(POWER):
-                self.precomputed_gnr.append(
-                    self.compute_gnr(g, n, nsquared, gn, i, alpha)
-                )
+            result = (
+                self.compute_gnr(g, n, nsquared, gn, i, alpha)
+                for i in range(POWER)
+            )
+
+        if writer is not None:
+            writer.begin("precomputed_gnr", "[")
+        for value in result:
+            self.precomputed_gnr.append(value)
+            if writer is not None:
+                writer.item(value)
+        if writer is not None:
+            writer.end()
 
     @staticmethod
     def compute_gm(g: int, x: int, i: int, j: int, nsquared: int) -> int:
@@ -188,26 +245,48 @@ class PaillierScheme:
             print(f"Precomputed g^m for i = {i} and j = {j}")
         return value
 
-    def precompute_gm(self, g: int, nsquared: int) -> None:
+    def precompute_gm(
+        self, g: int, nsquared: int, writer: ParamsWriter = None
+    ) -> None:
+        if writer is not None:
+            writer.begin("precomputed_gm")
+
         for i in [0, 1]:
             self.precomputed_gm[str(i)] = {}
+            if writer is not None:
+                writer.begin(str(i))
 
+            # Values are consumed one by one as they are computed, so no
+            # list of all results is held next to the table
             if USE_PARALLEL:
-                result = Parallel(n_jobs=NUM_CORES)(
-                    delayed(self.compute_gm)(g, POWER, i, j, nsquared)
+                result = Parallel(n_jobs=NUM_CORES, return_as="generator")(
+                    delayed(pinned)(
+                        PLACEMENT.cpus_of(j),
+                        self.compute_gm,
+                        g,
+                        POWER,
+                        i,
+                        j,
+                        nsquared,
+                    )
                     for j in range(POWER)
                 )
-                if isinstance(result, list):
-                    self.precomputed_gm[str(i)] = {
-                        str(index): value for index, value in enumerate(result)
-                    }
-                else:
-                    raise TypeError("Result should be list of ints!")
             else:
-                for j in range(POWER):
-                    self.precomputed_gm[str(i)][str(i)] = self.compute_gm(
-                        g, POWER, i, j, nsquared
-                    )
+                result = (
+                    self.compute_gm(g, POWER, i, j, nsquared)
+                    for j in range(POWER)
+                )
+
+            for j, value in enumerate(result):
+                self.precomputed_gm[str(i)][str(j)] = value
+                if writer is not None:
+                    writer.item(value, key=str(j))
+
+            if writer is not None:
+                writer.end()
+
+        if writer is not None:
+            writer.end()
 
     def encrypt(self, message: int) -> int:
         if message >= self.public.n:
@@ -219,45 +298,88 @@ class PaillierScheme:
                 " bits long"
             )
 
-        # Split message into two 16-bits numbers
-        j0 = (message // (POWER ** 0)) % POWER
-        j1 = (message // (POWER ** 1)) % POWER
+        # Without pre-computed values (unloaded by unloadTables) encryption
+        # falls back to the same computation as in scheme3. Tables may be
+        # unloaded by another thread (Keyring), so each is read only once
+        precomputed_gm = self.precomputed_gm
+        noise_table = self.noise_table
 
-        gm = (
-            self.precomputed_gm["1"][str(j1)]
-            * self.precomputed_gm["0"][str(j0)]
-        ) % self.public.nsquared
+        if precomputed_gm is not None:
+            # Split message into two 16-bits numbers
+            j0 = (message // (POWER ** 0)) % POWER
+            j1 = (message // (POWER ** 1)) % POWER
 
-        # Get NO_GNR random precomputed (g^n)^r and
-        # multiply them with each other
-        gnr = (
-            reduce(mul, random.sample(self.precomputed_gnr, NO_GNR), 1)
-            % self.public.nsquared
-        )
+            gm = (
+                precomputed_gm["1"][str(j1)] * precomputed_gm["0"][str(j0)]
+            ) % self.public.nsquared
+        else:
+            gm = pow(self.public.g, message, self.public.nsquared)
+
+        if noise_table is not None:
+            # Get NO_GNR random precomputed (g^n)^r and
+            # multiply them with each other
+            gnr = noise_table.sample_product()
+        else:
+            if CHEAT:
+                r = default_source.randint(1, self.private.alpha - 1)
+            else:
+                r = pow(
+                    self.public.g,
+                    default_source.randint(1, self.public.n),
+                    self.public.n,
+                )
+
+            gnr = pow(
+                self.public.g,
+                self.public.n * r,
+                self.public.nsquared,
+            )
 
         ciphertext = (gm * gnr) % self.public.nsquared
 
         return ciphertext
 
     def decrypt(self, ciphertext: int) -> int:
-        if ciphertext >= self.public.nsquared:
-            raise ValueError("Ciphertext must be less than nsquared")
-
-        numerator = Lfunction(
-            pow(ciphertext, self.private.alpha, self.public.nsquared),
-            self.public.n,
-        )
-        denominator = Lfunction(
-            pow(self.public.g, self.private.alpha, self.public.nsquared),
-            self.public.n,
-        )
+        return self.decryptor.decrypt(ciphertext)
+
+    def encrypt_many(self, messages: list) -> list:
+        precomputed_gm = self.precomputed_gm
+        noise_table = self.noise_table
+        if (
+            precomputed_gm is None
+            or noise_table is None
+            or len(messages) < noise_table.kernel.min_batch
+        ):
+            return [self.encrypt(message) for message in messages]
+
+        limit = int(math.log2(POWER)) * 2
+        if any(
+            message >= self.public.n or message.bit_length() > limit
+            for message in messages
+        ):
+            raise ValueError(
+                f"Message must be less than n and at most {limit} bits long"
+            )
 
-        # numerator/denominator in modular arithmetic = find inverse
-        message = (
-            numerator * pow(denominator, -1, self.public.n) % self.public.n
+        # All modular multiplications of the batch (g^m halves, noise
+        # products and ciphertexts) go through the batch kernel
+        kernel = noise_table.kernel
+        high, low = precomputed_gm["1"], precomputed_gm["0"]
+        gm = kernel.mulmod(
+            [high[str(m // POWER % POWER)] for m in messages],
+            [low[str(m % POWER)] for m in messages],
         )
+        return kernel.mulmod(gm, noise_table.sample_products(len(gm)))
 
-        return message
+    def decrypt_many(self, ciphertexts: list) -> list:
+        return self.decryptor.decrypt_many(ciphertexts)
 
     def add_two_ciphertexts(self, ct1: int, ct2: int) -> int:
         return (ct1 * ct2) % self.public.nsquared
+
+    def neg_many(self, ciphertexts: list) -> list:
+        # E(-m) = E(m)^-1, all ciphertexts are inverted by one inversion
+        return batch_inverse(ciphertexts, self.public.nsquared)
+
+    def sub_ciphertexts_many(self, cts1: list, cts2: list) -> list:
+        return sub_many(cts1, cts2, self.public.nsquared)
@@ -3,20 +3,32 @@ from __future__ import annotations
 import json
 import math
 import os
-from datetime import datetime
 
 from Cryptodome.PublicKey import DSA
-from Cryptodome.Random import random
 
-from .common import PARAMS_PATH, Lfunction, chinese_remainder
+from .common import (
+    PARAMS_PATH,
+    batch_inverse,
+    chinese_remainder,
+    load_params,
+    sub_many,
+    timestamped_file_name,
+)
 from .config import CHEAT, DEFAULT_KEYSIZE, POWER, USE_PARALLEL
+from .fixed_exp import FixedExponentDecryptor
+from .randomness import default_source
+from .table_writer import ParamsWriter
+from .validation import table_checksums, validate_tables
 
 if USE_PARALLEL:
     import multiprocessing
 
     from joblib import Parallel, delayed
 
+    from .affinity import Placement, pinned
+
     NUM_CORES = multiprocessing.cpu_count()
+    PLACEMENT = Placement(NUM_CORES)
 
 
 class Public:
@@ -71,62 +83,76 @@ class PaillierScheme:
 
             self.public = Public(n, g, nsquared)
             self.private = Private(p1, p2, alpha)
-
-            # Precompute g^m to speed up encryption
-            self.precomputed_gm = {}
-            self.precompute_gm(g, nsquared)
-
-            self.saveJson()
+            self.decryptor = FixedExponentDecryptor(self)
+
+            self.file_name = timestamped_file_name("gm-")
+            if not os.path.exists(PARAMS_PATH):
+                os.mkdir(PARAMS_PATH)
+
+            # Pre-computed values are streamed to the params file while
+            # they are computed instead of saving them by saveJson
+            with ParamsWriter(
+                os.path.join(PARAMS_PATH, self.file_name),
+                {
+                    "scheme": "precompute_gm",
+                    "public": self.public.__dict__,
+                    "private": self.private.__dict__,
+                },
+            ) as writer:
+                # Precompute g^m to speed up encryption
+                self.precomputed_gm = {}
+                self.precompute_gm(g, nsquared, writer)
+                writer.item(table_checksums(self), key="checksums")
 
     @staticmethod
     def constructFromJsonFile(file_name: str) -> PaillierScheme:
         ps = PaillierScheme(generate=False)
         if file_name is not None:
-            with open(
-                os.path.join(PARAMS_PATH, file_name), encoding="ISO-8859-2"
-            ) as file:
-                data = json.load(file)
-                public = data["public"]
-                private = data["private"]
-
-                ps.public = Public(
-                    public["n"], public["g"], public["nsquared"]
-                )
-                ps.private = Private(
-                    private["p"], private["q"], private["alpha"]
-                )
+            data = load_params(file_name)
+            ps.file_name = file_name
+            public = data["public"]
+            private = data["private"]
+
+            ps.public = Public(public["n"], public["g"], public["nsquared"])
+            ps.private = Private(private["p"], private["q"], private["alpha"])
+            ps.decryptor = FixedExponentDecryptor(ps)
 
-                if "precomputed_gm" not in data:
-                    raise ValueError("precomputed_gm is missing in the data")
+            if "precomputed_gm" not in data:
+                raise ValueError("precomputed_gm is missing in the data")
 
-                ps.precomputed_gm = data["precomputed_gm"]
-                return ps
+            ps.precomputed_gm = data["precomputed_gm"]
+
+            # Sampled check that the tables belong to the key (and match
+            # checksums stored when they were saved)
+            validate_tables(ps, data.get("checksums"))
+            return ps
         else:
             raise AttributeError("File not found")
 
-    def saveJson(self) -> None:
+    def saveJson(self, file_name: str = None) -> None:
         params = {
             "scheme": "precompute_gm",
             "public": self.public.__dict__,
             "private": self.private.__dict__,
             "precomputed_gm": self.precomputed_gm,
+            "checksums": table_checksums(self),
         }
 
-        self.file_name = (
-            "gm-"
-            + str(datetime.now()).replace(" ", "_").replace(":", ".")
-            + ".json"
-        )
+        self.file_name = file_name or timestamped_file_name("gm-")
 
         if not os.path.exists(PARAMS_PATH):
             os.mkdir(PARAMS_PATH)
 
+        # Write to temporary file first, so an existing file is replaced
+        # only by a complete one
+        file_path = os.path.join(PARAMS_PATH, self.file_name)
         with open(
-            os.path.join(PARAMS_PATH, self.file_name),
+            file_path + ".tmp",
             "w",
             encoding="ISO-8859-2",
         ) as file:
             json.dump(params, file)
+        os.replace(file_path + ".tmp", file_path)
 
     @staticmethod
     def compute_gm(g: int, power: int, i: int, j: int, nsquared: int) -> int:
@@ -135,27 +161,48 @@ class PaillierScheme:
             print(f"Precomputed g^m for i = {i} and j = {j}")
         return value
 
-    def precompute_gm(self, g: int, nsquared: int) -> None:
+    def precompute_gm(
+        self, g: int, nsquared: int, writer: ParamsWriter = None
+    ) -> None:
+        if writer is not None:
+            writer.begin("precomputed_gm")
+
         for i in [0, 1]:
             self.precomputed_gm[str(i)] = {}
+            if writer is not None:
+                writer.begin(str(i))
 
+            # Values are consumed one by one as they are computed, so no
+            # list of all results is held next to the table
             if USE_PARALLEL:
-                result = Parallel(n_jobs=NUM_CORES)(
-                    delayed(self.compute_gm)(g, POWER, i, j, nsquared)
+                result = Parallel(n_jobs=NUM_CORES, return_as="generator")(
+                    delayed(pinned)(
+                        PLACEMENT.cpus_of(j),
+                        self.compute_gm,
+                        g,
+                        POWER,
+                        i,
+                        j,
+                        nsquared,
+                    )
                     for j in range(POWER)
                 )
-
-                if isinstance(result, list):
-                    self.precomputed_gm[str(i)] = {
-                        str(index): value for index, value in enumerate(result)
-                    }
-                else:
-                    raise TypeError("Result should be list of ints!")
             else:
-                for j in range(POWER):
-                    self.precomputed_gm[str(i)][str(i)] = self.compute_gm(
-                        g, POWER, i, j, nsquared
-                    )
+                result = (
+                    self.compute_gm(g, POWER, i, j, nsquared)
+                    for j in range(POWER)
+                )
+
+            for j, value in enumerate(result):
+                self.precomputed_gm[str(i)][str(j)] = value
+                if writer is not None:
+                    writer.item(value, key=str(j))
+
+            if writer is not None:
+                writer.end()
+
+        if writer is not None:
+            writer.end()
 
     def encrypt(self, message: int) -> int:
         if message >= self.public.n:
@@ -178,11 +225,11 @@ class PaillierScheme:
 
         # Generate r using generator g
         if CHEAT:
-            r = random.randint(1, self.private.alpha - 1)
+            r = default_source.randint(1, self.private.alpha - 1)
         else:
             r = pow(
                 self.public.g,
-                random.randint(1, self.public.n),
+                default_source.randint(1, self.public.n),
                 self.public.n,
             )
 
@@ -197,24 +244,20 @@ class PaillierScheme:
         return ciphertext
 
     def decrypt(self, ciphertext: int) -> int:
-        if ciphertext >= self.public.nsquared:
-            raise ValueError("Ciphertext must be less than nsquared")
+        return self.decryptor.decrypt(ciphertext)
 
-        numerator = Lfunction(
-            pow(ciphertext, self.private.alpha, self.public.nsquared),
-            self.public.n,
-        )
-        denominator = Lfunction(
-            pow(self.public.g, self.private.alpha, self.public.nsquared),
-            self.public.n,
-        )
-
-        # numerator/denominator in modular arithmetic = find inverse
-        message = (
-            numerator * pow(denominator, -1, self.public.n) % self.public.n
-        )
+    def encrypt_many(self, messages: list) -> list:
+        return [self.encrypt(message) for message in messages]
 
-        return message
+    def decrypt_many(self, ciphertexts: list) -> list:
+        return self.decryptor.decrypt_many(ciphertexts)
 
     def add_two_ciphertexts(self, ct1: int, ct2: int):
         return (ct1 * ct2) % self.public.nsquared
+
+    def neg_many(self, ciphertexts: list) -> list:
+        # E(-m) = E(m)^-1, all ciphertexts are inverted by one inversion
+        return batch_inverse(ciphertexts, self.public.nsquared)
+
+    def sub_ciphertexts_many(self, cts1: list, cts2: list) -> list:
+        return sub_many(cts1, cts2, self.public.nsquared)
@@ -3,22 +3,33 @@ from __future__ import annotations
 import json
 import math
 import os
-from datetime import datetime
-from functools import reduce
-from operator import mul
 
 from Cryptodome.PublicKey import DSA
-from Cryptodome.Random import random
 
-from .common import PARAMS_PATH, Lfunction, chinese_remainder
-from .config import CHEAT, DEFAULT_KEYSIZE, NO_GNR, POWER, USE_PARALLEL
+from .common import (
+    PARAMS_PATH,
+    batch_inverse,
+    chinese_remainder,
+    load_params,
+    sub_many,
+    timestamped_file_name,
+)
+from .config import CHEAT, DEFAULT_KEYSIZE, POWER, USE_PARALLEL
+from .fixed_exp import FixedExponentDecryptor
+from .noise_table import NoiseTable
+from .randomness import default_source
+from .table_writer import ParamsWriter
+from .validation import table_checksums, validate_tables
 
 if USE_PARALLEL:
     import multiprocessing
 
     from joblib import Parallel, delayed
 
+    from .affinity import Placement, pinned
+
     NUM_CORES = multiprocessing.cpu_count()
+    PLACEMENT = Placement(NUM_CORES)
 
 
 class Public:
@@ -68,66 +79,79 @@ class PaillierScheme:
 
             self.public = Public(n, g, nsquared)
             self.private = Private(p1, p2, alpha)
-
-            # Precompute (g^n)^r to speed up encryption
-            self.precomputed_gnr = []
-            self.precompute_gnr(g, n, nsquared, alpha)
-
-            self.saveJson()
+            self.decryptor = FixedExponentDecryptor(self)
+
+            self.file_name = timestamped_file_name("precompute_gnr-")
+            if not os.path.exists(PARAMS_PATH):
+                os.mkdir(PARAMS_PATH)
+
+            # Pre-computed values are streamed to the params file while
+            # they are computed instead of saving them by saveJson
+            with ParamsWriter(
+                os.path.join(PARAMS_PATH, self.file_name),
+                {
+                    "scheme": "precompute_gnr",
+                    "public": self.public.__dict__,
+                    "private": self.private.__dict__,
+                },
+            ) as writer:
+                # Precompute (g^n)^r to speed up encryption
+                self.precomputed_gnr = []
+                self.precompute_gnr(g, n, nsquared, alpha, writer)
+                writer.item(table_checksums(self), key="checksums")
+
+            self.noise_table = NoiseTable(self.precomputed_gnr, nsquared)
 
     @staticmethod
     def constructFromJsonFile(file_name: str) -> PaillierScheme:
         ps = PaillierScheme(generate=False)
         if file_name is not None:
-            with open(
-                os.path.join(
-                    PARAMS_PATH,
-                    file_name,
-                ),
-                encoding="ISO-8859-2",
-            ) as file:
-                data = json.load(file)
-                public = data["public"]
-                private = data["private"]
-
-                ps.public = Public(
-                    public["n"], public["g"], public["nsquared"]
-                )
-                ps.private = Private(
-                    private["p"], private["q"], private["alpha"]
-                )
+            data = load_params(file_name)
+            ps.file_name = file_name
+            public = data["public"]
+            private = data["private"]
 
-                if "precomputed_gnr" not in data:
-                    raise ValueError("precomputed_gnr is missing in the data")
+            ps.public = Public(public["n"], public["g"], public["nsquared"])
+            ps.private = Private(private["p"], private["q"], private["alpha"])
+            ps.decryptor = FixedExponentDecryptor(ps)
 
-                ps.precomputed_gnr = data["precomputed_gnr"]
-                return ps
+            if "precomputed_gnr" not in data:
+                raise ValueError("precomputed_gnr is missing in the data")
+
+            ps.precomputed_gnr = data["precomputed_gnr"]
+            ps.noise_table = NoiseTable(ps.precomputed_gnr, ps.public.nsquared)
+
+            # Sampled check that the tables belong to the key (and match
+            # checksums stored when they were saved)
+            validate_tables(ps, data.get("checksums"))
+            return ps
         else:
             raise AttributeError("File not found")
 
-    def saveJson(self) -> None:
+    def saveJson(self, file_name: str = None) -> None:
         params = {
             "scheme": "precompute_gnr",
             "public": self.public.__dict__,
             "private": self.private.__dict__,
             "precomputed_gnr": self.precomputed_gnr,
+            "checksums": table_checksums(self),
         }
 
-        self.file_name = (
-            "precompute_gnr-"
-            + str(datetime.now()).replace(" ", "_").replace(":", ".")
-            + ".json"
-        )
+        self.file_name = file_name or timestamped_file_name("precompute_gnr-")
 
         if not os.path.exists(PARAMS_PATH):
             os.mkdir(PARAMS_PATH)
 
+        # Write to temporary file first, so an existing file is replaced
+        # only by a complete one
+        file_path = os.path.join(PARAMS_PATH, self.file_name)
         with open(
-            os.path.join(PARAMS_PATH, self.file_name),
+            file_path + ".tmp",
             "w",
             encoding="ISO-8859-2",
         ) as file:
             json.dump(params, file)
+        os.replace(file_path + ".tmp", file_path)
 
     @staticmethod
     def compute_gnr(
@@ -135,11 +159,11 @@ class PaillierScheme:
     ) -> int:
         # Generate r using generator g
         if CHEAT:
-            r = random.randint(1, alpha - 1)
+            r = default_source.randint(1, alpha - 1)
         else:
             r = pow(
                 g,
-                random.randint(1, n),
+                default_source.randint(1, n),
                 n,
             )
 
@@ -149,25 +173,45 @@ class PaillierScheme:
         return gnr
 
     def precompute_gnr(
-        self, g: int, n: int, nsquared: int, alpha: int
+        self,
+        g: int,
+        n: int,
+        nsquared: int,
+        alpha: int,
+        writer: ParamsWriter = None,
     ) -> None:
         gn = pow(g, n, nsquared)
 
+        # Values are consumed one by one as they are computed, so no list
+        # of all results is held next to the table
         if USE_PARALLEL:
-            result = Parallel(n_jobs=NUM_CORES)(
-                delayed(self.compute_gnr)(g, n, nsquared, gn, i, alpha)
+            result = Parallel(n_jobs=NUM_CORES, return_as="generator")(
+                delayed(pinned)(
+                    PLACEMENT.cpus_of(i),
+                    self.compute_gnr,
+                    g,
+                    n,
+                    nsquared,
+                    gn,
+                    i,
+                    alpha,
+                )
                 for i in range(POWER)
             )
-
-            if isinstance(result, list):
-                self.precomputed_gnr.extend(result)
-            else:
-                raise TypeError("Result should be list of ints!")
         else:
-            for i in range(POWER):
-                self.precomputed_gnr.append(
-                    self.compute_gnr(g, n, nsquared, gn, i, alpha)
-                )
+            result = (
+                self.compute_gnr(g, n, nsquared, gn, i, alpha)
+                for i in range(POWER)
+            )
+
+        if writer is not None:
+            writer.begin("precomputed_gnr", "[")
+        for value in result:
+            self.precomputed_gnr.append(value)
+            if writer is not None:
+                writer.item(value)
+        if writer is not None:
+            writer.end()
 
     def encrypt(self, message: int) -> int:
         if message >= self.public.n:
@@ -177,34 +221,39 @@ class PaillierScheme:
 
         # Get NO_GNR random precomputed (g^n)^r and
         # multiply them with each other
-        gnr = (
-            reduce(mul, random.sample(self.precomputed_gnr, NO_GNR), 1)
-            % self.public.nsquared
-        )
+        gnr = self.noise_table.sample_product()
 
         ciphertext = (gm * gnr) % self.public.nsquared
 
         return ciphertext
 
     def decrypt(self, ciphertext: int) -> int:
-        if ciphertext >= self.public.nsquared:
-            raise ValueError("Ciphertext must be less than nsquared")
+        return self.decryptor.decrypt(ciphertext)
 
-        numerator = Lfunction(
-            pow(ciphertext, self.private.alpha, self.public.nsquared),
-            self.public.n,
-        )
-        denominator = Lfunction(
-            pow(self.public.g, self.private.alpha, self.public.nsquared),
-            self.public.n,
-        )
+    def encrypt_many(self, messages: list) -> list:
+        if any(message >= self.public.n for message in messages):
+            raise ValueError("Message must be less than n")
 
-        # numerator/denominator in modular arithmetic = find inverse
-        message = (
-            numerator * pow(denominator, -1, self.public.n) % self.public.n
+        # Noise products and ciphertexts of the batch go through the batch
+        # kernel (which falls back to scalar multiplication for small
+        # batches)
+        gm = [
+            pow(self.public.g, message, self.public.nsquared)
+            for message in messages
+        ]
+        return self.noise_table.kernel.mulmod(
+            gm, self.noise_table.sample_products(len(gm))
         )
 
-        return message
+    def decrypt_many(self, ciphertexts: list) -> list:
+        return self.decryptor.decrypt_many(ciphertexts)
 
     def add_two_ciphertexts(self, ct1: int, ct2: int) -> int:
         return (ct1 * ct2) % self.public.nsquared
+
+    def neg_many(self, ciphertexts: list) -> list:
+        # E(-m) = E(m)^-1, all ciphertexts are inverted by one inversion
+        return batch_inverse(ciphertexts, self.public.nsquared)
+
+    def sub_ciphertexts_many(self, cts1: list, cts2: list) -> list:
+        return sub_many(cts1, cts2, self.public.nsquared)
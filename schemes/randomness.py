@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import hashlib
+import multiprocessing
+import os
+import threading
+import weakref
+
+from Cryptodome.Cipher import ChaCha20
+
+from .config import RANDOM_BUFFER_SIZE, RANDOM_SEED
+
+_sources = weakref.WeakSet()
+
+
+class RandomSource:
+    """
+    Buffered source of randomness for encryption noise.
+
+    Bytes are drawn from the OS CSPRNG (or from a ChaCha20 keystream when
+    seed is given, for reproducible benchmarks) in chunks of buffer_size
+    and served from the buffer, so small draws like r values or table
+    indices do not hit the OS on every encryption. Buffer access is guarded
+    by a lock and the buffer is dropped in forked children, so parent and
+    child never serve the same bytes.
+
+    Args:
+        seed (bytes): seed of deterministic stream, None = OS CSPRNG
+        buffer_size (int): number of bytes drawn at once
+    """
+
+    def __init__(
+        self, seed: bytes = RANDOM_SEED, buffer_size: int = RANDOM_BUFFER_SIZE
+    ) -> None:
+        self.seed = seed
+        self.buffer_size = buffer_size
+
+        self._lock = threading.Lock()
+        self._creator = os.getpid()
+        self._reset()
+        _sources.add(self)
+
+    def __reduce__(self):
+        # Locks and buffered bytes are not copied to other processes, the
+        # default source is resolved to the default source of the receiver
+        if self is default_source:
+            return "default_source"
+        return RandomSource, (self.seed, self.buffer_size)
+
+    def _reset(self) -> None:
+        self._buffer = b""
+        self._offset = 0
+        self._pid = os.getpid()
+        self._cipher = None
+
+    def _stream_key(self) -> bytes:
+        # Only the process which created the source (and is not a child
+        # itself) uses the seed as is, forked children (reset inside
+        # os.fork, before multiprocessing knows the parent) and spawned
+        # ones get their own stream. Derived at the first draw, so spawned
+        # children already know their parent.
+        own = (
+            self._pid == self._creator
+            and multiprocessing.parent_process() is None
+        )
+        stream = b"" if own else str(self._pid).encode()
+        return hashlib.sha256(bytes(self.seed) + stream).digest()
+
+    def _refill(self, length: int) -> None:
+        size = max(self.buffer_size, length)
+        if self.seed is not None:
+            if self._cipher is None:
+                self._cipher = ChaCha20.new(
+                    key=self._stream_key(), nonce=bytes(8)
+                )
+            fresh = self._cipher.encrypt(bytes(size))
+        else:
+            fresh = os.urandom(size)
+
+        self._buffer = self._buffer[self._offset :] + fresh
+        self._offset = 0
+
+    def randbytes(self, length: int) -> bytes:
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            if self._offset + length > len(self._buffer):
+                self._refill(length)
+
+            start = self._offset
+            self._offset += length
+            return self._buffer[start : self._offset]
+
+    def getrandbits(self, k: int) -> int:
+        value = int.from_bytes(self.randbytes((k + 7) // 8), "little")
+        return value & ((1 << k) - 1)
+
+    def randbelow(self, n: int) -> int:
+        if n <= 0:
+            raise ValueError("Upper bound must be positive")
+
+        # Rejection sampling keeps the result uniform
+        k = n.bit_length()
+        value = self.getrandbits(k)
+        while value >= n:
+            value = self.getrandbits(k)
+        return value
+
+    def randint(self, a: int, b: int) -> int:
+        return a + self.randbelow(b - a + 1)
+
+    def sample_indices(self, population_size: int, k: int) -> list:
+        if k > population_size:
+            raise ValueError("Sample larger than population")
+
+        # Bytes for all k indices are taken from the buffer at once, out of
+        # range or repeated indices are rejected and drawn again
+        bits = max(1, (population_size - 1).bit_length())
+        width = (bits + 7) // 8
+        mask = (1 << bits) - 1
+
+        indices = []
+        chosen = set()
+        while len(indices) < k:
+            raw = self.randbytes(width * (k - len(indices)))
+            for offset in range(0, len(raw), width):
+                index = (
+                    int.from_bytes(raw[offset : offset + width], "little")
+                    & mask
+                )
+                if index < population_size and index not in chosen:
+                    chosen.add(index)
+                    indices.append(index)
+        return indices
+
+    def sample(self, population: list, k: int) -> list:
+        return [
+            population[index]
+            for index in self.sample_indices(len(population), k)
+        ]
+
+
+def _reset_after_fork() -> None:
+    for source in list(_sources):
+        source._lock = threading.Lock()
+        source._reset()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+default_source = RandomSource()
@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+from collections import Counter, deque
+from timeit import default_timer as timer
+
+from .config import CHEAT, GM_CACHE_SIZE
+from .gm_cache import GmCache
+from .randomness import default_source
+
+# Strategies for g^m, in the order they are tried
+GM_CACHE = "cache"
+GM_SPECIAL = "g=n+1"
+GM_TABLE = "table"
+GM_POW = "pow"
+
+# Strategies for noise (g^n)^r or r^n
+NOISE_POOL = "pool"
+NOISE_TABLE = "table"
+NOISE_FRESH = "fresh"
+
+
+class AdaptivePaillierScheme:
+    """
+    Facade over any PaillierScheme which picks the fastest available way
+    of computing every part of each encryption.
+
+    g^m is taken from the g^m cache (hit), computed as 1 + m*n when
+    g = n + 1, combined from the pre-computed table when the message fits
+    its limbs (precompute_gm, precompute_both) or computed by pow (and then
+    cached). Messages too long for the table fall back to pow instead of
+    failing. Noise is taken from the pool filled by fill_pool, from the
+    pre-computed noise table (precompute_gnr, precompute_both) or computed
+    fresh the same way as the wrapped scheme does.
+
+    Choices and their times are recorded in metrics (see report).
+
+    Args:
+        scheme: wrapped PaillierScheme instance (key, tables, decryption)
+        gm_cache_size (int): capacity of g^m cache if scheme has none,
+            0 = no cache
+    """
+
+    def __init__(self, scheme, gm_cache_size: int = GM_CACHE_SIZE) -> None:
+        self.scheme = scheme
+        self.public = scheme.public
+        self.private = scheme.private
+
+        self.gm_cache = getattr(scheme, "gm_cache", None)
+        if self.gm_cache is None and gm_cache_size:
+            self.gm_cache = GmCache(
+                self.public.g, self.public.nsquared, gm_cache_size
+            )
+
+        self.noise_pool = deque()
+        self.counts = Counter()
+        self.seconds = Counter()
+
+    def _record(self, strategy: str, start: float) -> None:
+        self.counts[strategy] += 1
+        self.seconds[strategy] += timer() - start
+
+    def _table_gm(self, message: int) -> int:
+        # Combines one entry per limb of the message, None if the message
+        # has more limbs than the table has levels
+        table = getattr(self.scheme, "precomputed_gm", None)
+        if not table:
+            return None
+
+        power = len(table["0"])
+        if message >= power ** len(table):
+            return None
+
+        nsquared = self.public.nsquared
+        gm = 1
+        level = 0
+        while message:
+            message, limb = divmod(message, power)
+            if limb:
+                gm = gm * table[str(level)][str(limb)] % nsquared
+            level += 1
+        return gm
+
+    def gm(self, message: int) -> int:
+        start = timer()
+        public = self.public
+
+        if self.gm_cache is not None:
+            gm = self.gm_cache.peek(message)
+            if gm is not None:
+                self._record("gm:" + GM_CACHE, start)
+                return gm
+            self.gm_cache.record_miss()
+
+        if public.g == public.n + 1:
+            gm = (1 + message * public.n) % public.nsquared
+            self._record("gm:" + GM_SPECIAL, start)
+            return gm
+
+        gm = self._table_gm(message)
+        if gm is not None:
+            self._record("gm:" + GM_TABLE, start)
+            return gm
+
+        gm = pow(public.g, message, public.nsquared)
+        if self.gm_cache is not None:
+            self.gm_cache.put(message, gm)
+        self._record("gm:" + GM_POW, start)
+        return gm
+
+    def noise(self) -> int:
+        start = timer()
+
+        if self.noise_pool:
+            try:
+                noise = self.noise_pool.popleft()
+                self._record("noise:" + NOISE_POOL, start)
+                return noise
+            except IndexError:  # emptied by another thread
+                pass
+
+        noise_table = getattr(self.scheme, "noise_table", None)
+        if noise_table is not None:
+            noise = noise_table.sample_product()
+            self._record("noise:" + NOISE_TABLE, start)
+            return noise
+
+        noise = self.fresh_noise()
+        self._record("noise:" + NOISE_FRESH, start)
+        return noise
+
+    def fresh_noise(self) -> int:
+        # Computed directly, encryption of 0 would go through the g^m cache.
+        # Keys with g of order alpha (scheme3 and pre-computing schemes)
+        # use (g^n)^r, scheme1 keys r^n
+        public = self.public
+        alpha = getattr(self.private, "alpha", None)
+        if alpha is not None and CHEAT:
+            r = default_source.randint(1, alpha - 1)
+        else:
+            r = pow(public.g, default_source.randint(1, public.n), public.n)
+
+        if alpha is None:
+            return pow(r, public.n, public.nsquared)
+        return pow(public.g, public.n * r, public.nsquared)
+
+    def fill_pool(self, count: int) -> None:
+        """
+        Computes count fresh noise values ahead of time (e.g. when idle),
+        every value is used by one encryption only.
+        """
+        for _ in range(count):
+            self.noise_pool.append(self.fresh_noise())
+
+    def encrypt(self, message: int) -> int:
+        if message < 0:
+            raise ValueError("Message must not be negative")
+        if message >= self.public.n:
+            raise ValueError("Message must be less than n")
+
+        return self.gm(message) * self.noise() % self.public.nsquared
+
+    def decrypt(self, ciphertext: int) -> int:
+        return self.scheme.decrypt(ciphertext)
+
+    def encrypt_many(self, messages: list) -> list:
+        return [self.encrypt(message) for message in messages]
+
+    def decrypt_many(self, ciphertexts: list) -> list:
+        return self.scheme.decrypt_many(ciphertexts)
+
+    def add_two_ciphertexts(self, ct1: int, ct2: int) -> int:
+        return (ct1 * ct2) % self.public.nsquared
+
+    def report(self) -> dict:
+        report = {
+            strategy: {
+                "count": count,
+                "mean_us": self.seconds[strategy] / count * 10 ** 6,
+            }
+            for strategy, count in sorted(self.counts.items())
+        }
+        if self.gm_cache is not None:
+            report["gm_cache"] = self.gm_cache.stats()
+        report["noise_pool"] = len(self.noise_pool)
+        return report
@@ -1,10 +1,12 @@
 import math
 
-from Cryptodome.Random import random
 from Cryptodome.Util.number import getStrongPrime
 
-from .common import Lfunction
-from .config import DEFAULT_KEYSIZE
+from .common import Lfunction, batch_inverse, sub_many
+from .config import DEFAULT_KEYSIZE, GM_CACHE_SIZE
+from .fixed_exp import FixedExponentDecryptor
+from .gm_cache import GmCache
+from .randomness import default_source
 
 
 class Public:
@@ -22,7 +24,11 @@ class Private:
 
 
 class PaillierScheme:
-    def __init__(self, n_length: int = DEFAULT_KEYSIZE) -> None:
+    def __init__(
+        self,
+        n_length: int = DEFAULT_KEYSIZE,
+        gm_cache_size: int = GM_CACHE_SIZE,
+    ) -> None:
         p = q = n = 0
         n_len = 0
 
@@ -51,6 +57,12 @@ class PaillierScheme:
 
         self.public = Public(n, g, nsquared)
         self.private = Private(p, q, lambd)
+        self.decryptor = FixedExponentDecryptor(self)
+
+        # Optional LRU cache of g^m for repeated messages
+        self.gm_cache = (
+            GmCache(g, nsquared, gm_cache_size) if gm_cache_size else None
+        )
 
     def encrypt(self, message: int) -> int:
         if message >= self.public.n:
@@ -58,11 +70,14 @@ class PaillierScheme:
 
         r = pow(
             self.public.g,
-            random.randint(1, self.public.n),
+            default_source.randint(1, self.public.n),
             self.public.n,
         )
 
-        gm = pow(self.public.g, message, self.public.nsquared)
+        if self.gm_cache is not None:
+            gm = self.gm_cache.get(message)
+        else:
+            gm = pow(self.public.g, message, self.public.nsquared)
         rn = pow(r, self.public.n, self.public.nsquared)
 
         ciphertext = (gm * rn) % self.public.nsquared
@@ -70,24 +85,20 @@ class PaillierScheme:
         return ciphertext
 
     def decrypt(self, ciphertext: int) -> int:
-        if ciphertext >= self.public.nsquared:
-            raise ValueError("Ciphertext must be less than nsquared")
-
-        numerator = Lfunction(
-            pow(ciphertext, self.private.lambd, self.public.nsquared),
-            self.public.n,
-        )
-        denominator = Lfunction(
-            pow(self.public.g, self.private.lambd, self.public.nsquared),
-            self.public.n,
-        )
+        return self.decryptor.decrypt(ciphertext)
 
-        # numerator/denominator in modular arithmetic = find inverse
-        message = (
-            numerator * pow(denominator, -1, self.public.n) % self.public.n
-        )
+    def encrypt_many(self, messages: list) -> list:
+        return [self.encrypt(message) for message in messages]
 
-        return message
+    def decrypt_many(self, ciphertexts: list) -> list:
+        return self.decryptor.decrypt_many(ciphertexts)
 
     def add_two_ciphertexts(self, ct1: int, ct2: int) -> int:
         return (ct1 * ct2) % self.public.nsquared
+
+    def neg_many(self, ciphertexts: list) -> list:
+        # E(-m) = E(m)^-1, all ciphertexts are inverted by one inversion
+        return batch_inverse(ciphertexts, self.public.nsquared)
+
+    def sub_ciphertexts_many(self, cts1: list, cts2: list) -> list:
+        return sub_many(cts1, cts2, self.public.nsquared)
@@ -1,10 +1,12 @@
 import math
 
 from Cryptodome.PublicKey import DSA
-from Cryptodome.Random import random
 
-from .common import Lfunction, chinese_remainder
-from .config import CHEAT, DEFAULT_KEYSIZE
+from .common import batch_inverse, chinese_remainder, sub_many
+from .config import CHEAT, DEFAULT_KEYSIZE, GM_CACHE_SIZE
+from .fixed_exp import FixedExponentDecryptor
+from .gm_cache import GmCache
+from .randomness import default_source
 
 
 class Public:
@@ -22,7 +24,11 @@ class Private:
 
 
 class PaillierScheme:
-    def __init__(self, n_length: int = DEFAULT_KEYSIZE) -> None:
+    def __init__(
+        self,
+        n_length: int = DEFAULT_KEYSIZE,
+        gm_cache_size: int = GM_CACHE_SIZE,
+    ) -> None:
         # Generate DSA g, p, q parameters twice
         dsa1 = DSA.generate(n_length // 2)
         dsa2 = DSA.generate(n_length // 2)
@@ -55,21 +61,30 @@ class PaillierScheme:
 
         self.public = Public(n, g, nsquared)
         self.private = Private(p1, p2, alpha)
+        self.decryptor = FixedExponentDecryptor(self)
+
+        # Optional LRU cache of g^m for repeated messages
+        self.gm_cache = (
+            GmCache(g, nsquared, gm_cache_size) if gm_cache_size else None
+        )
 
     def encrypt(self, message: int) -> int:
         if message >= self.public.n:
             raise ValueError("Message must be less than n")
 
         if CHEAT:
-            r = random.randint(1, self.private.alpha - 1)
+            r = default_source.randint(1, self.private.alpha - 1)
         else:
             r = pow(
                 self.public.g,
-                random.randint(1, self.public.n),
+                default_source.randint(1, self.public.n),
                 self.public.n,
             )
 
-        gm = pow(self.public.g, message, self.public.nsquared)
+        if self.gm_cache is not None:
+            gm = self.gm_cache.get(message)
+        else:
+            gm = pow(self.public.g, message, self.public.nsquared)
 
         gnr = pow(
             self.public.g,
@@ -82,24 +97,20 @@ class PaillierScheme:
         return ciphertext
 
     def decrypt(self, ciphertext: int) -> int:
-        if ciphertext >= self.public.nsquared:
-            raise ValueError("Ciphertext must be less than nsquared")
+        return self.decryptor.decrypt(ciphertext)
 
-        numerator = Lfunction(
-            pow(ciphertext, self.private.alpha, self.public.nsquared),
-            self.public.n,
-        )
-        denominator = Lfunction(
-            pow(self.public.g, self.private.alpha, self.public.nsquared),
-            self.public.n,
-        )
+    def encrypt_many(self, messages: list) -> list:
+        return [self.encrypt(message) for message in messages]
 
-        # numerator/denominator in modular arithmetic = find inverse
-        message = (
-            numerator * pow(denominator, -1, self.public.n) % self.public.n
-        )
-
-        return message
+    def decrypt_many(self, ciphertexts: list) -> list:
+        return self.decryptor.decrypt_many(ciphertexts)
 
     def add_two_ciphertexts(self, ct1: int, ct2: int) -> int:
         return (ct1 * ct2) % self.public.nsquared
+
+    def neg_many(self, ciphertexts: list) -> list:
+        # E(-m) = E(m)^-1, all ciphertexts are inverted by one inversion
+        return batch_inverse(ciphertexts, self.public.nsquared)
+
+    def sub_ciphertexts_many(self, cts1: list, cts2: list) -> list:
+        return sub_many(cts1, cts2, self.public.nsquared)
@@ -0,0 +1,116 @@
+"""
+Binary ciphertext codec.
+
+A ciphertext batch is a header followed by fixed-width big-endian records,
+every record is as wide as nsquared of the key:
+
+    magic (4 bytes) | version (1 byte) | record width (2 bytes)
+    | number of records (8 bytes) | key fingerprint (16 bytes) | records
+
+Records are converted by int.to_bytes/int.from_bytes directly from/to one
+contiguous buffer (records are written into and read from memoryview
+slices of it, the batch is never copied as a whole), which is much
+cheaper than decimal conversion of big ints in JSON.
+"""
+
+from __future__ import annotations
+
+import struct
+
+from .common import key_fingerprint
+
+MAGIC = b"PCT1"
+VERSION = 1
+HEADER = struct.Struct(">4sBHQ16s")
+
+
+class CiphertextCodec:
+    """
+    Fixed-width binary encoding of ciphertexts of one key.
+
+    Args:
+        public: public key (n, g, nsquared) of the ciphertexts
+    """
+
+    def __init__(self, public) -> None:
+        self.nsquared = public.nsquared
+        self.width = (public.nsquared.bit_length() + 7) // 8
+        self.fingerprint = bytes.fromhex(key_fingerprint(public.n, public.g))
+
+    def nbytes(self, count: int) -> int:
+        return HEADER.size + count * self.width
+
+    def to_bytes(self, ciphertexts: list) -> bytearray:
+        # The buffer written by pack_into is returned as is, without a copy
+        buffer = bytearray(self.nbytes(len(ciphertexts)))
+        self.pack_into(buffer, ciphertexts)
+        return buffer
+
+    def pack_into(self, buffer, ciphertexts: list, offset: int = 0) -> int:
+        """
+        Writes the batch into a pre-allocated writable buffer (bytearray,
+        mmap, memoryview) at offset, returns offset after the batch.
+        """
+        if any(not 0 <= ct < self.nsquared for ct in ciphertexts):
+            raise ValueError("Ciphertext must be in range [0, nsquared)")
+
+        view = memoryview(buffer)
+        end = offset + self.nbytes(len(ciphertexts))
+        if end > len(view):
+            raise ValueError("Buffer is too small")
+
+        width = self.width
+        HEADER.pack_into(
+            view,
+            offset,
+            MAGIC,
+            VERSION,
+            width,
+            len(ciphertexts),
+            self.fingerprint,
+        )
+        position = offset + HEADER.size
+        for ct in ciphertexts:
+            view[position : position + width] = ct.to_bytes(width, "big")
+            position += width
+        return end
+
+    def read_header(self, buffer, offset: int = 0) -> int:
+        """
+        Checks the header at offset, returns the number of records.
+        """
+        if len(buffer) - offset < HEADER.size:
+            raise ValueError("Buffer is too short for header")
+
+        magic, version, width, count, fingerprint = HEADER.unpack_from(
+            buffer, offset
+        )
+        if magic != MAGIC:
+            raise ValueError("Not a ciphertext batch")
+        if version != VERSION:
+            raise ValueError(f"Unsupported version: {version}")
+        if fingerprint != self.fingerprint:
+            raise ValueError("Ciphertexts were encrypted by different key")
+        if width != self.width:
+            raise ValueError(f"Unexpected record width: {width}")
+        if len(buffer) - offset < self.nbytes(count):
+            raise ValueError("Buffer is too short for all records")
+        return count
+
+    def from_bytes(self, buffer, offset: int = 0) -> list:
+        view = memoryview(buffer)
+        count = self.read_header(view, offset)
+        width = self.width
+        start = offset + HEADER.size
+        return [
+            int.from_bytes(view[position : position + width], "big")
+            for position in range(start, start + count * width, width)
+        ]
+
+    def write(self, file, ciphertexts: list) -> None:
+        file.write(self.to_bytes(ciphertexts))
+
+    def read(self, file) -> list:
+        header = file.read(HEADER.size)
+        count = HEADER.unpack(header)[3] if len(header) == HEADER.size else 0
+        return self.from_bytes(header + file.read(count * self.width))
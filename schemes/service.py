@@ -0,0 +1,514 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hmac
+import os
+import queue
+import secrets
+import socket
+import stat
+import struct
+import tempfile
+from collections import deque
+from functools import reduce
+from timeit import default_timer as timer
+
+from . import (
+    precompute_both_scheme,
+    precompute_gm_scheme,
+    precompute_gnr_scheme,
+)
+from .aio import AsyncPaillierScheme, _run_batch
+from .config import (
+    ASYNC_MAX_BATCH_SIZE,
+    ASYNC_MAX_WAIT,
+    ASYNC_WORKERS,
+    SERVICE_MAX_FRAME,
+    SERVICE_POOL_SIZE,
+    SERVICE_SOCKET_PATH,
+    SERVICE_TOKEN_PATH,
+)
+
+SCHEMES = {
+    "precompute_gm": precompute_gm_scheme,
+    "precompute_gnr": precompute_gnr_scheme,
+    "precompute_both": precompute_both_scheme,
+}
+
+# Frame = header (1 byte op/status + 4 bytes payload length) + payload,
+# payload is a sequence of integers, each prefixed by its 2 byte length
+HEADER = struct.Struct(">BI")
+INT_LENGTH = struct.Struct(">H")
+# struct ucred of SO_PEERCRED: pid, uid, gid
+PEERCRED = struct.Struct("3i")
+
+ENCRYPT = 1
+DECRYPT = 2
+AGGREGATE = 3
+RERANDOMIZE = 4
+# First frame of a TCP connection, payload is the shared token
+AUTH = 5
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+
+def pack_ints(values: list) -> bytes:
+    parts = []
+    for value in values:
+        if value < 0:
+            raise ValueError("Only non-negative integers can be sent")
+        raw = value.to_bytes((value.bit_length() + 7) // 8, "big")
+        parts.append(INT_LENGTH.pack(len(raw)))
+        parts.append(raw)
+    return b"".join(parts)
+
+
+def unpack_ints(payload: bytes) -> list:
+    values = []
+    view = memoryview(payload)
+    offset = 0
+    while offset < len(view):
+        (length,) = INT_LENGTH.unpack_from(view, offset)
+        offset += INT_LENGTH.size
+        values.append(int.from_bytes(view[offset : offset + length], "big"))
+        offset += length
+    return values
+
+
+def check_private(path: str) -> None:
+    # Directory of the socket and token, nobody else may create files there
+    info = os.lstat(path)
+    if (
+        not stat.S_ISDIR(info.st_mode)
+        or info.st_uid != os.getuid()
+        or info.st_mode & 0o077
+    ):
+        raise PermissionError(
+            f"{path} must be a directory of the user with mode 0700"
+        )
+
+
+def runtime_dir() -> str:
+    """
+    Private directory of the service socket and token, paillier in
+    $XDG_RUNTIME_DIR or paillier-<uid> in the temporary directory, created
+    with mode 0700 when missing.
+    """
+    base = os.environ.get("XDG_RUNTIME_DIR")
+    if base:
+        path = os.path.join(base, "paillier")
+    else:
+        path = os.path.join(tempfile.gettempdir(), f"paillier-{os.getuid()}")
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    check_private(path)
+    return path
+
+
+def socket_path(path: str = SERVICE_SOCKET_PATH) -> str:
+    return path or os.path.join(runtime_dir(), "paillier.sock")
+
+
+def token_path(path: str = SERVICE_TOKEN_PATH) -> str:
+    return path or os.path.join(runtime_dir(), "service.token")
+
+
+def read_token(path: str = SERVICE_TOKEN_PATH, create: bool = False) -> bytes:
+    """
+    Shared token of TCP connections, stored in a file readable only by the
+    user. With create, a missing file is created with a random token.
+    """
+    path = token_path(path)
+    if create:
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            pass
+        else:
+            with os.fdopen(fd, "w", encoding="ISO-8859-2") as file:
+                file.write(secrets.token_hex(32))
+
+    if os.stat(path).st_mode & 0o077:
+        raise PermissionError(f"{path} must not be readable by others")
+    with open(path, encoding="ISO-8859-2") as file:
+        return file.read().strip().encode()
+
+
+def peer_uid(sock: socket.socket) -> int:
+    # User of the other end of a Unix socket, None where it can't be read
+    if sock.family != socket.AF_UNIX or not hasattr(socket, "SO_PEERCRED"):
+        return None
+    credentials = sock.getsockopt(
+        socket.SOL_SOCKET, socket.SO_PEERCRED, PEERCRED.size
+    )
+    return PEERCRED.unpack(credentials)[1]
+
+
+def _aggregate(ciphertexts: list, nsquared: int) -> int:
+    return reduce(lambda acc, ct: acc * ct % nsquared, ciphertexts, 1)
+
+
+class PaillierServer:
+    """
+    Long-running process holding one key and its pre-computed tables.
+
+    The params file is loaded once, encrypt/decrypt requests from all
+    connections are micro-batched by AsyncPaillierScheme into a worker
+    pool which received its copy of the scheme at startup.
+
+    The server decrypts anything it is sent, so only trusted peers may
+    connect: the Unix socket lives in a private directory (see
+    runtime_dir) with mode 0600 and peers of other users are rejected
+    (SO_PEERCRED), TCP connections must start with the shared token.
+    Frames longer than max_frame bytes close the connection.
+
+    Args:
+        scheme: PaillierScheme instance
+        token (bytes): shared token of TCP connections, None = no TCP
+        allowed_uids (set): users allowed on the Unix socket, None = the
+            user of the server
+        max_frame (int): longest accepted payload in bytes
+    """
+
+    def __init__(
+        self,
+        scheme,
+        max_batch_size: int = ASYNC_MAX_BATCH_SIZE,
+        max_wait: float = ASYNC_MAX_WAIT,
+        workers: int = ASYNC_WORKERS,
+        token: bytes = None,
+        allowed_uids: set = None,
+        max_frame: int = SERVICE_MAX_FRAME,
+    ) -> None:
+        self.scheme = AsyncPaillierScheme(
+            scheme, max_batch_size, max_wait, workers
+        )
+        self.nsquared = scheme.public.nsquared
+        self.token = token
+        self.allowed_uids = (
+            {os.getuid()} if allowed_uids is None else set(allowed_uids)
+        )
+        self.max_frame = max_frame
+
+    async def handle(self, op: int, values: list) -> list:
+        if op == ENCRYPT:
+            return await asyncio.gather(
+                *(self.scheme.aencrypt(m) for m in values)
+            )
+        if op == DECRYPT:
+            return await asyncio.gather(
+                *(self.scheme.adecrypt(ct) for ct in values)
+            )
+        if op == AGGREGATE:
+            if any(ct >= self.nsquared for ct in values):
+                raise ValueError("Ciphertext must be less than nsquared")
+            loop = asyncio.get_running_loop()
+            return [
+                await loop.run_in_executor(
+                    self.scheme.executor, _aggregate, values, self.nsquared
+                )
+            ]
+        if op == RERANDOMIZE:
+            # Multiplying by a fresh encryption of zero gives a new
+            # ciphertext of the same plaintext
+            zeros = await asyncio.gather(
+                *(self.scheme.aencrypt(0) for _ in values)
+            )
+            return [
+                self.scheme.add_two_ciphertexts(ct, zero)
+                for ct, zero in zip(values, zeros)
+            ]
+        raise ValueError(f"Unknown operation: {op}")
+
+    @staticmethod
+    async def _reply(writer, status: int, response: bytes) -> None:
+        writer.write(HEADER.pack(status, len(response)) + response)
+        await writer.drain()
+
+    async def serve_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        sock = writer.get_extra_info("socket")
+        uid = peer_uid(sock)
+        # Without SO_PEERCRED only the directory protects the Unix socket
+        authenticated = sock.family == socket.AF_UNIX
+        try:
+            if uid is not None and uid not in self.allowed_uids:
+                return
+
+            while True:
+                try:
+                    header = await reader.readexactly(HEADER.size)
+                except asyncio.IncompleteReadError:
+                    break
+                op, length = HEADER.unpack(header)
+                if length > self.max_frame:
+                    await self._reply(
+                        writer, STATUS_ERROR, b"Frame is too large"
+                    )
+                    break
+                payload = await reader.readexactly(length)
+
+                if not authenticated:
+                    if (
+                        op != AUTH
+                        or self.token is None
+                        or not hmac.compare_digest(payload, self.token)
+                    ):
+                        await self._reply(
+                            writer, STATUS_ERROR, b"Authentication failed"
+                        )
+                        break
+                    authenticated = True
+                    await self._reply(writer, STATUS_OK, b"")
+                    continue
+
+                try:
+                    response = pack_ints(
+                        await self.handle(op, unpack_ints(payload))
+                    )
+                    status = STATUS_OK
+                except Exception as error:
+                    response = str(error).encode()
+                    status = STATUS_ERROR
+
+                await self._reply(writer, status, response)
+        finally:
+            writer.close()
+
+    async def warm_up(self) -> None:
+        # Start all workers (and copy the scheme into them) before the
+        # first client request arrives
+        loop = asyncio.get_running_loop()
+        workers = self.scheme.executor._max_workers
+        await asyncio.gather(
+            *(
+                loop.run_in_executor(
+                    self.scheme.executor, _run_batch, "encrypt_many", [0]
+                )
+                for _ in range(workers)
+            )
+        )
+
+    async def serve(
+        self, path: str = SERVICE_SOCKET_PATH, port: int = None
+    ) -> None:
+        if port is not None and self.token is None:
+            raise ValueError("TCP connections require a token")
+
+        if port is None:
+            path = socket_path(path)
+            check_private(os.path.dirname(os.path.abspath(path)))
+
+        await self.warm_up()
+
+        if port is not None:
+            server = await asyncio.start_server(
+                self.serve_connection, "127.0.0.1", port
+            )
+        else:
+            # Only a stale socket of the user is replaced
+            try:
+                info = os.lstat(path)
+            except FileNotFoundError:
+                pass
+            else:
+                if not stat.S_ISSOCK(info.st_mode) or (
+                    info.st_uid != os.getuid()
+                ):
+                    raise FileExistsError(f"{path} is not a stale socket")
+                os.remove(path)
+            server = await asyncio.start_unix_server(
+                self.serve_connection, path
+            )
+            os.chmod(path, 0o600)
+
+        async with server:
+            await server.serve_forever()
+
+    def close(self) -> None:
+        self.scheme.close()
+
+
+class PaillierClient:
+    """
+    Client of PaillierServer keeping a pool of open connections.
+
+    Every call takes a connection from the pool (or opens a new one), so the
+    client can be shared by threads. End-to-end latency of the last
+    requests (in seconds) is kept in latencies.
+
+    Plaintexts are sent only to a Unix socket server of server_uid (checked
+    by SO_PEERCRED where available), TCP connections send the token first
+    (read from the token file when not given).
+    """
+
+    def __init__(
+        self,
+        path: str = SERVICE_SOCKET_PATH,
+        port: int = None,
+        pool_size: int = SERVICE_POOL_SIZE,
+        keep_latencies: int = 100000,
+        token: bytes = None,
+        server_uid: int = None,
+    ) -> None:
+        self.path = socket_path(path) if port is None else path
+        self.port = port
+        self.token = token
+        if port is not None and token is None:
+            self.token = read_token()
+        self.server_uid = os.getuid() if server_uid is None else server_uid
+        self.latencies = deque(maxlen=keep_latencies)
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+
+    def _connect(self) -> socket.socket:
+        if self.port is not None:
+            sock = socket.create_connection(("127.0.0.1", self.port))
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            try:
+                sock.sendall(HEADER.pack(AUTH, len(self.token)) + self.token)
+                status, length = HEADER.unpack(
+                    self._recv_exactly(sock, HEADER.size)
+                )
+                response = self._recv_exactly(sock, length)
+            except BaseException:
+                sock.close()
+                raise
+            if status != STATUS_OK:
+                sock.close()
+                raise PermissionError(response.decode())
+        else:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.path)
+                uid = peer_uid(sock)
+            except BaseException:
+                sock.close()
+                raise
+            if uid is not None and uid != self.server_uid:
+                sock.close()
+                raise PermissionError(
+                    f"{self.path} is served by another user ({uid})"
+                )
+        return sock
+
+    @staticmethod
+    def _recv_exactly(sock: socket.socket, length: int) -> bytes:
+        buffer = bytearray(length)
+        view = memoryview(buffer)
+        received = 0
+        while received < length:
+            count = sock.recv_into(view[received:])
+            if count == 0:
+                raise ConnectionError("Connection closed by server")
+            received += count
+        return bytes(buffer)
+
+    def request(self, op: int, values: list) -> list:
+        try:
+            sock = self._pool.get_nowait()
+        except queue.Empty:
+            sock = self._connect()
+
+        start = timer()
+        try:
+            payload = pack_ints(values)
+            sock.sendall(HEADER.pack(op, len(payload)) + payload)
+            status, length = HEADER.unpack(
+                self._recv_exactly(sock, HEADER.size)
+            )
+            response = self._recv_exactly(sock, length)
+        except BaseException:
+            sock.close()
+            raise
+        self.latencies.append(timer() - start)
+
+        try:
+            self._pool.put_nowait(sock)
+        except queue.Full:
+            sock.close()
+
+        if status != STATUS_OK:
+            raise ValueError(response.decode())
+        return unpack_ints(response)
+
+    def encrypt(self, message: int) -> int:
+        return self.request(ENCRYPT, [message])[0]
+
+    def encrypt_many(self, messages: list) -> list:
+        return self.request(ENCRYPT, messages)
+
+    def decrypt(self, ciphertext: int) -> int:
+        return self.request(DECRYPT, [ciphertext])[0]
+
+    def decrypt_many(self, ciphertexts: list) -> list:
+        return self.request(DECRYPT, ciphertexts)
+
+    def aggregate(self, ciphertexts: list) -> int:
+        return self.request(AGGREGATE, ciphertexts)[0]
+
+    def rerandomize(self, ciphertext: int) -> int:
+        return self.request(RERANDOMIZE, [ciphertext])[0]
+
+    def rerandomize_many(self, ciphertexts: list) -> list:
+        return self.request(RERANDOMIZE, ciphertexts)
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve Paillier operations over a Unix or TCP socket"
+    )
+    parser.add_argument("params", help="params file name in params directory")
+    parser.add_argument(
+        "--scheme", choices=SCHEMES.keys(), default="precompute_both"
+    )
+    parser.add_argument("--socket", default=SERVICE_SOCKET_PATH)
+    parser.add_argument("--port", type=int, default=None)
+    parser.add_argument(
+        "--token-file",
+        default=SERVICE_TOKEN_PATH,
+        help="shared token of TCP clients, created when missing",
+    )
+    parser.add_argument("--workers", type=int, default=ASYNC_WORKERS)
+    parser.add_argument(
+        "--max-batch-size", type=int, default=ASYNC_MAX_BATCH_SIZE
+    )
+    parser.add_argument("--max-wait", type=float, default=ASYNC_MAX_WAIT)
+    args = parser.parse_args()
+
+    start = timer()
+    scheme = SCHEMES[args.scheme].PaillierScheme.constructFromJsonFile(
+        args.params
+    )
+    token = None
+    if args.port is not None:
+        token = read_token(args.token_file, create=True)
+    server = PaillierServer(
+        scheme, args.max_batch_size, args.max_wait, args.workers, token
+    )
+    print(f"{args.scheme} loaded in {timer() - start:.2f} s")
+    if args.port is not None:
+        print(
+            f"Listening on 127.0.0.1:{args.port}, token in"
+            f" {token_path(args.token_file)}"
+        )
+    else:
+        print(f"Listening on {socket_path(args.socket)}")
+
+    try:
+        asyncio.run(server.serve(args.socket, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
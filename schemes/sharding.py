@@ -0,0 +1,324 @@
+"""
+Sharded pre-computation of g^m and (g^n)^r tables.
+
+A key file holds the key and table parameters. Every shard job computes
+one index range of one table from the key file alone and writes a partial
+table file, so shards can run on different hosts. The merge step validates
+the partial files (same key, ranges covering the whole table exactly once,
+spot checks of values) and streams them into a regular params file which
+can be loaded by constructFromJsonFile.
+
+Usage:
+    python -m schemes.sharding key precompute_both
+    python -m schemes.sharding plan <key file> --shards 64
+    python -m schemes.sharding shard <key file> gm 0 8192 <out file>
+    python -m schemes.sharding merge <key file> <shard files...>
+    python -m schemes.sharding local <key file> --shards 4
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from . import precompute_both_scheme, scheme3
+from .common import (
+    PARAMS_PATH,
+    key_fingerprint,
+    load_params,
+    timestamped_file_name,
+)
+from .config import DEFAULT_KEYSIZE, POWER
+from .randomness import default_source
+from .table_writer import ParamsWriter
+from .validation import Checksum
+
+# Both tables are computed by the same functions as in precompute_both
+compute_gm = precompute_both_scheme.PaillierScheme.compute_gm
+compute_gnr = precompute_both_scheme.PaillierScheme.compute_gnr
+
+TABLES = {
+    "precompute_gm": ("gm",),
+    "precompute_gnr": ("gnr",),
+    "precompute_both": ("gm", "gnr"),
+}
+
+SPOT_CHECKS = 4
+
+
+def table_size(table: str, power: int) -> int:
+    # g^m table has two levels of power values
+    return 2 * power if table == "gm" else power
+
+
+def create_key(
+    scheme: str, n_length: int = DEFAULT_KEYSIZE, power: int = POWER
+) -> str:
+    if scheme not in TABLES:
+        raise ValueError(f"Unknown scheme: {scheme}")
+    # Encryption splits messages into POWER-sized limbs, only the number of
+    # noise values can differ
+    if power != POWER and "gm" in TABLES[scheme]:
+        raise ValueError(f"{scheme} needs g^m tables of power {POWER}")
+
+    # scheme3 generates the same kind of key as the pre-computing schemes
+    key = scheme3.PaillierScheme(n_length)
+    file_name = timestamped_file_name(f"{scheme}-key-")
+
+    if not os.path.exists(PARAMS_PATH):
+        os.mkdir(PARAMS_PATH)
+
+    with ParamsWriter(
+        os.path.join(PARAMS_PATH, file_name),
+        {
+            "scheme": scheme,
+            "public": key.public.__dict__,
+            "private": key.private.__dict__,
+            "power": power,
+            "key_fingerprint": key_fingerprint(key.public.n, key.public.g),
+        },
+    ):
+        pass
+
+    return file_name
+
+
+def plan(key_file: str, shards: int) -> list:
+    key = load_params(key_file)
+    jobs = []
+    for table in TABLES[key["scheme"]]:
+        size = table_size(table, key["power"])
+        step = -(-size // shards)
+        for start in range(0, size, step):
+            stop = min(size, start + step)
+            jobs.append(
+                (table, start, stop, f"{key_file}.{table}-{start}-{stop}")
+            )
+    return jobs
+
+
+def run_shard(
+    key_file: str, table: str, start: int, stop: int, out_file: str
+) -> None:
+    key = load_params(key_file)
+    public = key["public"]
+    power = key["power"]
+    n, g, nsquared = public["n"], public["g"], public["nsquared"]
+
+    if not 0 <= start < stop <= table_size(table, power):
+        raise ValueError(f"Invalid index range {start}-{stop} of {table}")
+
+    with ParamsWriter(
+        os.path.join(PARAMS_PATH, out_file),
+        {
+            "key_fingerprint": key["key_fingerprint"],
+            "table": table,
+            "power": power,
+            "start": start,
+            "stop": stop,
+        },
+    ) as writer:
+        writer.begin("values", "[")
+        if table == "gm":
+            for index in range(start, stop):
+                writer.item(
+                    compute_gm(
+                        g, power, index // power, index % power, nsquared
+                    )
+                )
+        else:
+            gn = pow(g, n, nsquared)
+            alpha = key["private"]["alpha"]
+            for index in range(start, stop):
+                writer.item(compute_gnr(g, n, nsquared, gn, index, alpha))
+        writer.end()
+
+
+def _validate_shard(key: dict, shard: dict) -> None:
+    public = key["public"]
+    power = key["power"]
+    nsquared = public["nsquared"]
+
+    if shard["key_fingerprint"] != key["key_fingerprint"]:
+        raise ValueError("Shard was computed for different key")
+    if shard["power"] != power:
+        raise ValueError("Shard was computed for different POWER")
+    if len(shard["values"]) != shard["stop"] - shard["start"]:
+        raise ValueError("Shard does not contain its whole index range")
+
+    for _ in range(min(SPOT_CHECKS, len(shard["values"]))):
+        offset = default_source.randbelow(len(shard["values"]))
+        value = shard["values"][offset]
+        index = shard["start"] + offset
+        if shard["table"] == "gm":
+            exponent = (power ** (index // power)) * (index % power)
+            valid = value == pow(public["g"], exponent, nsquared)
+        else:
+            # Every (g^n)^r has order dividing alpha
+            valid = pow(value, key["private"]["alpha"], nsquared) == 1
+        if not valid:
+            raise ValueError(
+                f"Invalid value at index {index} of {shard['table']} table"
+            )
+
+
+def merge(key_file: str, shard_files: list, file_name: str = None) -> str:
+    key = load_params(key_file)
+    scheme = key["scheme"]
+
+    shards = {table: [] for table in TABLES[scheme]}
+    for shard_file in shard_files:
+        # Only headers are kept, values are read again when writing
+        with open(
+            os.path.join(PARAMS_PATH, shard_file), encoding="ISO-8859-2"
+        ) as file:
+            shard = json.load(file)
+        if shard["table"] not in shards:
+            raise ValueError(f"{scheme} does not use {shard['table']} table")
+        _validate_shard(key, shard)
+        shards[shard["table"]].append(
+            (shard["start"], shard["stop"], shard_file)
+        )
+
+    for table, ranges in shards.items():
+        ranges.sort()
+        expected = 0
+        for start, stop, shard_file in ranges:
+            if start != expected:
+                raise ValueError(
+                    f"{table} table: shard {shard_file} starts at {start},"
+                    f" expected {expected} (gap or overlap)"
+                )
+            expected = stop
+        if expected != table_size(table, key["power"]):
+            raise ValueError(f"{table} table is not complete")
+
+    file_name = file_name or timestamped_file_name(f"{scheme}-")
+    with ParamsWriter(
+        os.path.join(PARAMS_PATH, file_name),
+        {
+            "scheme": scheme,
+            "public": key["public"],
+            "private": key["private"],
+        },
+    ) as writer:
+        checksums = {}
+        for table, ranges in shards.items():
+            checksum = Checksum(key["public"]["nsquared"])
+            if table == "gm":
+                writer.begin("precomputed_gm")
+            else:
+                writer.begin("precomputed_gnr", "[")
+
+            for start, stop, shard_file in ranges:
+                with open(
+                    os.path.join(PARAMS_PATH, shard_file),
+                    encoding="ISO-8859-2",
+                ) as file:
+                    values = json.load(file)["values"]
+
+                for index, value in zip(range(start, stop), values):
+                    checksum.update(value)
+                    if table == "gm":
+                        i, j = divmod(index, key["power"])
+                        if j == 0:
+                            if i > 0:
+                                writer.end()
+                            writer.begin(str(i))
+                        writer.item(value, key=str(j))
+                    else:
+                        writer.item(value)
+
+            if table == "gm":
+                writer.end()
+            writer.end()
+            checksums[f"precomputed_{table}"] = checksum.hexdigest()
+
+        writer.item(checksums, key="checksums")
+
+    return file_name
+
+
+def run_local(key_file: str, shards: int) -> str:
+    # Every shard is a separate process, the same as on separate hosts
+    jobs = plan(key_file, shards)
+    processes = [
+        subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "schemes.sharding",
+                "shard",
+                key_file,
+                table,
+                str(start),
+                str(stop),
+                out_file,
+            ],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            stdout=subprocess.DEVNULL,
+        )
+        for table, start, stop, out_file in jobs
+    ]
+    for process in processes:
+        if process.wait() != 0:
+            raise RuntimeError("Shard job failed")
+
+    file_name = merge(key_file, [job[3] for job in jobs])
+    for job in jobs:
+        os.remove(os.path.join(PARAMS_PATH, job[3]))
+    return file_name
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Sharded pre-computation of tables"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("key", help="generate key file")
+    command.add_argument("scheme", choices=TABLES.keys())
+    command.add_argument("--n-length", type=int, default=DEFAULT_KEYSIZE)
+    command.add_argument("--power", type=int, default=POWER)
+
+    command = commands.add_parser("plan", help="print shard jobs")
+    command.add_argument("key_file")
+    command.add_argument("--shards", type=int, required=True)
+
+    command = commands.add_parser("shard", help="compute one shard")
+    command.add_argument("key_file")
+    command.add_argument("table", choices=["gm", "gnr"])
+    command.add_argument("start", type=int)
+    command.add_argument("stop", type=int)
+    command.add_argument("out_file")
+
+    command = commands.add_parser("merge", help="merge shards")
+    command.add_argument("key_file")
+    command.add_argument("shard_files", nargs="+")
+    command.add_argument("--out", default=None)
+
+    command = commands.add_parser("local", help="run shards locally")
+    command.add_argument("key_file")
+    command.add_argument("--shards", type=int, default=os.cpu_count())
+
+    args = parser.parse_args()
+
+    if args.command == "key":
+        print(create_key(args.scheme, args.n_length, args.power))
+    elif args.command == "plan":
+        for table, start, stop, out_file in plan(args.key_file, args.shards):
+            print(
+                f"python -m schemes.sharding shard {args.key_file} {table}"
+                f" {start} {stop} {out_file}"
+            )
+    elif args.command == "shard":
+        run_shard(
+            args.key_file, args.table, args.start, args.stop, args.out_file
+        )
+    elif args.command == "merge":
+        print(merge(args.key_file, args.shard_files, args.out))
+    else:
+        print(run_local(args.key_file, args.shards))
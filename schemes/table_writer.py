@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import json
+import os
+
+from .config import TABLE_WRITE_BUFFER
+
+
+class ParamsWriter:
+    """
+    Writes params file in the same JSON format as saveJson, but streams
+    table entries to disk as they are produced.
+
+    Only up to buffer_size serialized entries are held in memory, so tables
+    do not have to be collected (and copied) before saving. The file is
+    written under a temporary name and renamed when closed, a failed write
+    leaves no partial file behind.
+
+    Args:
+        file_path (str): path of the params file
+        header (dict): small top-level values (scheme, public, private)
+        buffer_size (int): number of entries buffered before writing
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        header: dict,
+        buffer_size: int = TABLE_WRITE_BUFFER,
+    ) -> None:
+        self.file_path = file_path
+        self.buffer_size = buffer_size
+
+        self._file = open(file_path + ".tmp", "w", encoding="ISO-8859-2")
+        self._file.write(json.dumps(header)[:-1])
+        self._buffer = []
+        # Stack of [no item written yet, closing bracket] of open containers
+        self._stack = [[not header, "}"]]
+
+    def _separator(self) -> str:
+        if self._stack[-1][0]:
+            self._stack[-1][0] = False
+            return ""
+        return ", "
+
+    def begin(self, key: str = None, kind: str = "{") -> None:
+        prefix = self._separator()
+        if key is not None:
+            prefix += json.dumps(key) + ": "
+        self._buffer.append(prefix + kind)
+        self._stack.append([True, "]" if kind == "[" else "}"])
+
+    def item(self, value, key: str = None) -> None:
+        prefix = self._separator()
+        if key is not None:
+            prefix += json.dumps(key) + ": "
+        self._buffer.append(prefix + json.dumps(value))
+
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def end(self) -> None:
+        _, closing = self._stack.pop()
+        self._buffer.append(closing)
+
+    def flush(self) -> None:
+        self._file.write("".join(self._buffer))
+        self._buffer = []
+
+    def close(self) -> None:
+        while self._stack:
+            self.end()
+        self.flush()
+        self._file.close()
+        os.replace(self.file_path + ".tmp", self.file_path)
+
+    def abort(self) -> None:
+        self._file.close()
+        os.remove(self.file_path + ".tmp")
+
+    def __enter__(self) -> ParamsWriter:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
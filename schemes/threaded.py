@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from .affinity import Placement
+from .backend import powmod_base_list, powmod_exp_list
+from .batch_kernel import product
+from .config import AFFINITY_PIN, CHEAT, POWER, THREAD_CHUNK, THREAD_WORKERS
+from .randomness import default_source
+
+
+class ThreadedPaillierScheme:
+    """
+    Batch encryption, decryption and aggregation in a thread pool.
+
+    All threads share the wrapped scheme (key, pre-computed tables, g^m
+    cache, randomness source), nothing is pickled or copied. Batches are
+    split into chunks of THREAD_CHUNK items and exponentiations of a chunk
+    are computed by one call of the backend (backend.py), which releases
+    the GIL with gmpy2. Table lookups and multiplications hold the GIL
+    (except NumPy blocks of the batch kernel).
+
+    With a placement (affinity.py), threads are split into one pool per
+    NUMA node, pinned to the CPUs of the node, and chunks are dealt to the
+    pools round-robin. Every node then reads its own copy of the g^m and
+    noise tables; copies are snapshots, entries swapped in later by
+    NoiseTableRefresher only reach the wrapped scheme.
+
+    Args:
+        scheme: wrapped PaillierScheme instance
+        workers (int): number of threads, None = number of cores
+        chunk (int): items computed by one task
+        placement (Placement): NUMA placement, None = one unpinned pool
+            (or Placement(workers) with AFFINITY_PIN)
+    """
+
+    def __init__(
+        self,
+        scheme,
+        workers: int = THREAD_WORKERS,
+        chunk: int = THREAD_CHUNK,
+        placement: Placement = None,
+    ) -> None:
+        self.scheme = scheme
+        self.public = scheme.public
+        self.private = scheme.private
+        self.chunk = chunk
+
+        workers = workers or os.cpu_count()
+        if placement is None and AFFINITY_PIN:
+            placement = Placement(workers)
+        self.placement = placement
+
+        tables = {
+            "precomputed_gm": getattr(scheme, "precomputed_gm", None),
+            "noise_table": getattr(scheme, "noise_table", None),
+        }
+        if placement is None:
+            self.nodes = [None]
+            self.executors = {None: ThreadPoolExecutor(max_workers=workers)}
+            self.tables = {None: tables}
+        else:
+            self.nodes = [
+                node for node in placement.nodes if placement.groups[node]
+            ]
+            self.executors = {}
+            for node in self.nodes:
+                initializer, initargs = placement.initializer(node)
+                self.executors[node] = ThreadPoolExecutor(
+                    max_workers=placement.groups[node],
+                    initializer=initializer,
+                    initargs=initargs,
+                )
+            self.tables = placement.replicate(tables)
+
+        # scheme1 uses r^n noise, the other schemes use (g^n)^r noise
+        self.lambd = getattr(scheme.private, "lambd", None)
+
+        # Decryption schedules of the key, built when the scheme was loaded
+        self.decryptor = scheme.decryptor
+
+    def _chunks(self, items: list) -> list:
+        return [
+            items[start : start + self.chunk]
+            for start in range(0, len(items), self.chunk)
+        ]
+
+    def _submit(self, function, items: list) -> list:
+        # Chunk i goes to the pool of node i % len(nodes), which passes its
+        # own copy of the tables
+        futures = []
+        for index, chunk in enumerate(self._chunks(items)):
+            node = self.nodes[index % len(self.nodes)]
+            futures.append(
+                self.executors[node].submit(function, chunk, self.tables[node])
+            )
+        return futures
+
+    def _map(self, function, items: list) -> list:
+        results = []
+        for future in self._submit(function, items):
+            results += future.result()
+        return results
+
+    def _gm(self, messages: list, tables: dict) -> list:
+        scheme = self.scheme
+        public = self.public
+
+        table = tables["precomputed_gm"]
+        if table is not None:
+            limit = int(math.log2(POWER)) * 2
+            if any(message.bit_length() > limit for message in messages):
+                raise ValueError(
+                    f"Message can't be more than {limit} bits long"
+                )
+            return [
+                table["1"][str(m // POWER % POWER)]
+                * table["0"][str(m % POWER)]
+                % public.nsquared
+                for m in messages
+            ]
+
+        gm_cache = getattr(scheme, "gm_cache", None)
+        if gm_cache is not None:
+            return [gm_cache.get(message) for message in messages]
+
+        return powmod_exp_list(public.g, messages, public.nsquared)
+
+    def _noise(self, count: int, tables: dict) -> list:
+        noise_table = tables["noise_table"]
+        if noise_table is not None:
+            return noise_table.sample_products(count)
+
+        public = self.public
+        if CHEAT and self.lambd is None:
+            rs = [
+                default_source.randint(1, self.private.alpha - 1)
+                for _ in range(count)
+            ]
+        else:
+            rs = powmod_exp_list(
+                public.g,
+                [default_source.randint(1, public.n) for _ in range(count)],
+                public.n,
+            )
+
+        if self.lambd is not None:
+            return powmod_base_list(rs, public.n, public.nsquared)
+        return powmod_exp_list(
+            public.g, [public.n * r for r in rs], public.nsquared
+        )
+
+    def _encrypt_chunk(self, messages: list, tables: dict) -> list:
+        nsquared = self.public.nsquared
+        return [
+            gm * noise % nsquared
+            for gm, noise in zip(
+                self._gm(messages, tables), self._noise(len(messages), tables)
+            )
+        ]
+
+    def _decrypt_chunk(self, ciphertexts: list, tables: dict) -> list:
+        return self.decryptor.decrypt_many(ciphertexts)
+
+    def encrypt(self, message: int) -> int:
+        return self.scheme.encrypt(message)
+
+    def decrypt(self, ciphertext: int) -> int:
+        return self.scheme.decrypt(ciphertext)
+
+    def encrypt_many(self, messages: list) -> list:
+        if any(message >= self.public.n for message in messages):
+            raise ValueError("Message must be less than n")
+        return self._map(self._encrypt_chunk, messages)
+
+    def decrypt_many(self, ciphertexts: list) -> list:
+        if any(ct >= self.public.nsquared for ct in ciphertexts):
+            raise ValueError("Ciphertext must be less than nsquared")
+        return self._map(self._decrypt_chunk, ciphertexts)
+
+    def aggregate(self, ciphertexts: list) -> int:
+        # Encrypted sum, every thread multiplies one chunk
+        nsquared = self.public.nsquared
+        partials = self._submit(
+            lambda chunk, tables: product(chunk, nsquared), ciphertexts
+        )
+        return product([future.result() for future in partials], nsquared)
+
+    def add_two_ciphertexts(self, ct1: int, ct2: int) -> int:
+        return (ct1 * ct2) % self.public.nsquared
+
+    def close(self) -> None:
+        for executor in self.executors.values():
+            executor.shutdown()
+
+    def __enter__(self) -> ThreadedPaillierScheme:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+import hashlib
+
+from .config import USE_PARALLEL, VALIDATE_CHUNK, VALIDATE_SAMPLE_SIZE
+from .randomness import default_source
+
+if USE_PARALLEL:
+    import multiprocessing
+
+    from joblib import Parallel, delayed
+
+    NUM_CORES = multiprocessing.cpu_count()
+
+TABLES = ("precomputed_gm", "precomputed_gnr")
+
+# Wrong entries pass a batch check only when the random coefficients cancel
+# their errors: a single entry T*d when d^c = 1, which has probability about
+# 1/order(d) (negligible for a corrupted value, d has huge order), errors of
+# several entries in one chunk with probability up to 1/128 for odd 8-bit
+# coefficients. 64-bit coefficients would bring that to 2^-63 but make every
+# checked entry cost 64 squarings instead of 8 (loading about 7x slower)
+COEFFICIENT_BITS = 8
+
+# Below this number of sampled entries, starting worker processes takes
+# longer than checking the entries serially
+PARALLEL_MIN_ENTRIES = 1024
+
+
+class Checksum:
+    """
+    SHA-256 over table values as fixed-width big-endian integers, values
+    are added in table order (g^m tables level by level, index by index).
+    """
+
+    def __init__(self, nsquared: int) -> None:
+        self.width = (nsquared.bit_length() + 7) // 8
+        self._digest = hashlib.sha256()
+
+    def update(self, value: int) -> None:
+        self._digest.update(value.to_bytes(self.width, "big"))
+
+    def hexdigest(self) -> str:
+        return self._digest.hexdigest()
+
+
+def table_checksum(table, nsquared: int) -> str:
+    checksum = Checksum(nsquared)
+    if isinstance(table, dict):
+        for i in sorted(table, key=int):
+            for j in range(len(table[i])):
+                checksum.update(table[i][str(j)])
+    else:
+        for value in table:
+            checksum.update(value)
+    return checksum.hexdigest()
+
+
+def table_checksums(scheme) -> dict:
+    return {
+        name: table_checksum(getattr(scheme, name), scheme.public.nsquared)
+        for name in TABLES
+        if getattr(scheme, name, None) is not None
+    }
+
+
+def coefficient() -> int:
+    return default_source.getrandbits(COEFFICIENT_BITS) | 1
+
+
+def check_gm_batch(
+    g: int, nsquared: int, exponents: list, values: list, coefficients: list
+) -> bool:
+    # For g^e_k = T_k holds prod(T_k^c_k) = g^sum(c_k*e_k), which needs
+    # only one exponentiation for the whole batch
+    product = 1
+    exponent = 0
+    for e, value, c in zip(exponents, values, coefficients):
+        product = product * pow(value, c, nsquared) % nsquared
+        exponent += c * e
+    return product == pow(g, exponent, nsquared)
+
+
+def check_gnr_batch(
+    alpha: int, nsquared: int, values: list, coefficients: list
+) -> bool:
+    # Every (g^n)^r has order dividing alpha, so has any product of their
+    # powers, one exponentiation by alpha checks the whole batch
+    product = 1
+    for value, c in zip(values, coefficients):
+        product = product * pow(value, c, nsquared) % nsquared
+    return pow(product, alpha, nsquared) == 1
+
+
+def validate_tables(
+    scheme, checksums: dict = None, sample_size: int = VALIDATE_SAMPLE_SIZE
+) -> None:
+    """
+    Checks that pre-computed tables of scheme belong to its key.
+
+    Stored checksums (if any) are compared first, then sample_size random
+    entries of every table are checked with batched identities, in chunks
+    of VALIDATE_CHUNK entries (in parallel for large samples).
+
+    Args:
+        scheme: scheme with public, private and pre-computed tables
+        checksums (dict): table name -> checksum stored in params file
+        sample_size (int): entries checked per table, 0 = no sampling
+
+    Raises:
+        ValueError: if any check fails
+    """
+    public = scheme.public
+
+    for name, expected in (checksums or {}).items():
+        table = getattr(scheme, name, None)
+        if table is not None:
+            if table_checksum(table, public.nsquared) != expected:
+                raise ValueError(f"Checksum of {name} does not match")
+
+    jobs = []
+    gm = getattr(scheme, "precomputed_gm", None)
+    if gm is not None and sample_size:
+        power = len(gm["0"])
+        sample = default_source.sample_indices(
+            len(gm) * power, min(sample_size, len(gm) * power)
+        )
+        for start in range(0, len(sample), VALIDATE_CHUNK):
+            chunk = sample[start : start + VALIDATE_CHUNK]
+            jobs.append(
+                (
+                    "gm",
+                    check_gm_batch,
+                    (
+                        public.g,
+                        public.nsquared,
+                        [(power ** (k // power)) * (k % power) for k in chunk],
+                        [gm[str(k // power)][str(k % power)] for k in chunk],
+                        [coefficient() for _ in chunk],
+                    ),
+                )
+            )
+
+    gnr = getattr(scheme, "precomputed_gnr", None)
+    if gnr is not None and sample_size:
+        sample = default_source.sample(gnr, min(sample_size, len(gnr)))
+        for start in range(0, len(sample), VALIDATE_CHUNK):
+            chunk = sample[start : start + VALIDATE_CHUNK]
+            jobs.append(
+                (
+                    "gnr",
+                    check_gnr_batch,
+                    (
+                        scheme.private.alpha,
+                        public.nsquared,
+                        chunk,
+                        [coefficient() for _ in chunk],
+                    ),
+                )
+            )
+
+    entries = sum(len(args[-1]) for _, _, args in jobs)
+    if USE_PARALLEL and len(jobs) > 1 and entries >= PARALLEL_MIN_ENTRIES:
+        results = Parallel(n_jobs=min(NUM_CORES, len(jobs)))(
+            delayed(check)(*args) for _, check, args in jobs
+        )
+    else:
+        results = [check(*args) for _, check, args in jobs]
+
+    for (table, _, _), valid in zip(jobs, results):
+        if not valid:
+            raise ValueError(
+                f"Pre-computed {table} values do not match the key"
+            )
@@ -0,0 +1,281 @@
+import argparse
+import contextlib
+import gc
+import importlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tracemalloc
+from datetime import datetime
+from timeit import default_timer as timer
+
+RESULTS_PATH = os.path.join(os.path.dirname(__file__), "results")
+
+SCHEMES = [
+    "scheme1",
+    "scheme3",
+    "precompute_gm",
+    "precompute_gnr",
+    "precompute_both",
+]
+
+# Schemes without params files, their startup is key generation
+KEYGEN_ONLY = ("scheme1", "scheme3")
+
+PATHS = ("fresh", "json", "pickle")
+
+
+def module_name(scheme):
+    return scheme if scheme in KEYGEN_ONLY else scheme + "_scheme"
+
+
+def read_memory():
+    # Resident set size and its peak in bytes, peak only without /proc
+    try:
+        memory = {}
+        with open("/proc/self/status", encoding="ISO-8859-2") as file:
+            for line in file:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "VmHWM"):
+                    memory[key] = int(value.split()[0]) * 1024
+        return {"rss": memory["VmRSS"], "peak": memory["VmHWM"]}
+    except (OSError, KeyError, ValueError):
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS, in kilobytes elsewhere
+        return {
+            "rss": None,
+            "peak": peak if sys.platform == "darwin" else peak * 1024,
+        }
+
+
+def table_entries(ps):
+    entries = 0
+    precomputed_gm = getattr(ps, "precomputed_gm", None)
+    if precomputed_gm:
+        entries += sum(len(table) for table in precomputed_gm.values())
+    precomputed_gnr = getattr(ps, "precomputed_gnr", None)
+    if precomputed_gnr:
+        entries += len(precomputed_gnr)
+    return entries
+
+
+def measureChild(scheme, path, params, n_length, trace):
+    # Runs in a fresh interpreter, so nothing is imported or cached yet
+    baseline = read_memory()["rss"]
+    if trace:
+        tracemalloc.start()
+
+    start = timer()
+    module = importlib.import_module("schemes." + module_name(scheme))
+    imported = timer()
+
+    traced_before = tracemalloc.get_traced_memory()[0] if trace else 0
+    with open(os.devnull, "w", encoding="ISO-8859-2") as devnull:
+        with contextlib.redirect_stdout(devnull):  # progress of generation
+            if path == "fresh":
+                ps = module.PaillierScheme(n_length=n_length)
+            else:
+                common = importlib.import_module("schemes.common")
+                common.PARAMS_DISK_CACHE = path == "pickle"
+                ps = module.PaillierScheme.constructFromJsonFile(params)
+    loaded = timer()
+    if trace:
+        traced = tracemalloc.get_traced_memory()[0] - traced_before
+
+    ct = ps.encrypt(1)
+    first = timer()
+
+    if ps.decrypt(ct) != 1:
+        raise ValueError(f"{scheme}: Decrypted is not the same as message")
+
+    # Fresh precompute schemes save their params file, it is not needed
+    file_name = getattr(ps, "file_name", None)
+    if path == "fresh" and file_name is not None:
+        os.remove(os.path.join(module.PARAMS_PATH, file_name))
+
+    gc.collect()
+    memory = read_memory()
+    entries = table_entries(ps)
+
+    result = {
+        "scheme": scheme,
+        "path": path,
+        "import": imported - start,
+        "load": loaded - imported,
+        "first_encryption": first - loaded,
+        "startup": first - start,
+        "rss_baseline": baseline,
+        "rss_steady": memory["rss"],
+        "rss_peak": memory["peak"],
+        "entries": entries,
+    }
+    if trace:
+        result["traced_bytes"] = traced
+        result["bytes_per_entry"] = traced / entries if entries else None
+    return result
+
+
+def runChild(scheme, path, params, n_length, trace=False):
+    command = [
+        sys.executable,
+        os.path.abspath(__file__),
+        "--child",
+        scheme,
+        path,
+        "--n-length",
+        str(n_length),
+    ]
+    if params is not None:
+        command += ["--params", params]
+    if trace:
+        command.append("--trace")
+
+    output = subprocess.run(
+        command,
+        check=True,
+        stdout=subprocess.PIPE,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def summary(runs):
+    timed = [run for run in runs if "traced_bytes" not in run]
+    traced = [run for run in runs if "traced_bytes" in run]
+    result = {
+        key: statistics.mean(run[key] for run in timed)
+        for key in ("import", "load", "first_encryption", "startup")
+    }
+    result["rss_steady"] = max(run["rss_steady"] or 0 for run in timed)
+    result["rss_peak"] = max(run["rss_peak"] for run in timed)
+    result["entries"] = timed[0]["entries"]
+    if traced:
+        result["traced_bytes"] = traced[0]["traced_bytes"]
+        result["bytes_per_entry"] = traced[0]["bytes_per_entry"]
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure import, load and first encryption time and"
+        " memory of schemes, every run in a new process"
+    )
+    parser.add_argument(
+        "--schemes",
+        default=",".join(SCHEMES),
+        help="comma separated schemes",
+    )
+    parser.add_argument(
+        "--paths",
+        default="json,pickle",
+        help="comma separated load paths of precompute schemes: fresh"
+        " (generation of key and tables), json (constructFromJsonFile"
+        " without disk cache), pickle (with PARAMS_DISK_CACHE)",
+    )
+    parser.add_argument(
+        "--params",
+        help="params file name with the tables of all precompute schemes"
+        " (precompute_both file)",
+    )
+    parser.add_argument("--n-length", type=int, default=None)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--child", nargs=2, metavar=("SCHEME", "PATH"))
+    parser.add_argument("--trace", action="store_true")
+    args = parser.parse_args()
+
+    if args.child:
+        # Nothing of schemes may be imported before the measurement
+        scheme, path = args.child
+        print(
+            json.dumps(
+                measureChild(
+                    scheme, path, args.params, args.n_length, args.trace
+                )
+            )
+        )
+        raise SystemExit(0)
+
+    from schemes.config import CHEAT, DEFAULT_KEYSIZE, NO_GNR, POWER
+
+    n_length = args.n_length or DEFAULT_KEYSIZE
+
+    schemes = args.schemes.split(",")
+    for scheme in schemes:
+        if scheme not in SCHEMES:
+            raise ValueError(f"Unknown scheme: {scheme}")
+    paths = args.paths.split(",")
+    for path in paths:
+        if path not in PATHS:
+            raise ValueError(f"Unknown load path: {path}")
+    if (
+        args.params is None
+        and set(paths) - {"fresh"}
+        and set(schemes) - set(KEYGEN_ONLY)
+    ):
+        parser.error("--params is required for json and pickle paths")
+
+    results = {
+        "type": "startup",
+        "cheat": CHEAT,
+        "no_gnr": NO_GNR,
+        "power": POWER,
+        "default_keysize": n_length,
+        "params": args.params,
+        "runs": [],
+        "summary": {},
+    }
+
+    for scheme in schemes:
+        for path in ["fresh"] if scheme in KEYGEN_ONLY else paths:
+            print(f"{scheme} ({path}): {args.repeat} runs...")
+            if path == "pickle":
+                # Unmeasured run writes the pickled cache of the params
+                runChild(scheme, path, args.params, n_length)
+
+            runs = [
+                dict(runChild(scheme, path, args.params, n_length), repeat=i)
+                for i in range(args.repeat)
+            ]
+            # Key generation allocates no tables, nothing to trace
+            if scheme not in KEYGEN_ONLY and path != "fresh":
+                runs.append(
+                    runChild(scheme, path, args.params, n_length, trace=True)
+                )
+            results["runs"] += runs
+
+            stats = summary(runs)
+            results["summary"][f"{scheme}/{path}"] = stats
+            print(
+                f"import: {stats['import'] * 10 ** 3:.0f} ms, "
+                f"load: {stats['load'] * 10 ** 3:.0f} ms, "
+                f"first encryption: {stats['first_encryption'] * 10 ** 3:.1f}"
+                f" ms, peak RSS: {stats['rss_peak'] / 2 ** 20:.0f} MiB"
+            )
+
+    file_path = os.path.join(
+        RESULTS_PATH,
+        (
+            "startup-"
+            + str(datetime.now()).replace(" ", "_").replace(":", ".")
+            + ".json"
+        ),
+    )
+
+    print(f"Results file path: {file_path}")
+
+    if not os.path.exists(RESULTS_PATH):
+        os.mkdir(RESULTS_PATH)
+
+    with open(
+        file_path,
+        "w",
+        encoding="ISO-8859-2",
+    ) as file:
+        json.dump(results, file)
+
+    print("Finished successfully")
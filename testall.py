@@ -1,4 +1,12 @@
+import asyncio
 import math
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from fractions import Fraction
 
 from Cryptodome.Random import random
 
@@ -9,7 +17,35 @@ from schemes import (
     scheme1,
     scheme3,
 )
+from schemes.aio import AsyncPaillierScheme
+from schemes.batch_kernel import BatchModMul
+from schemes.common import PARAMS_PATH, batch_inverse, clear_params_cache
 from schemes.config import POWER
+from schemes.dataset import (
+    CIPHERTEXT,
+    PLAIN,
+    Dataset,
+    DatasetWriter,
+    _chunk_sum,
+)
+from schemes.encoding import Encoder
+from schemes.groupby import group_sum
+from schemes.key_factory import KeyFactory
+from schemes.keyring import Keyring
+from schemes.noise_table import NoiseTableRefresher
+from schemes.router import AdaptivePaillierScheme
+from schemes.serialization import CiphertextCodec
+from schemes.service import (
+    ENCRYPT,
+    HEADER,
+    STATUS_ERROR,
+    PaillierClient,
+    PaillierServer,
+    runtime_dir,
+)
+from schemes.sharding import create_key, merge, run_local
+from schemes.threaded import ThreadedPaillierScheme
+from schemes.validation import table_checksums, validate_tables
 
 
 def testScheme1(m1, m2):
@@ -98,6 +134,384 @@ def testPrecomputeBoth(m1, m2):
     assert pt1 + pt2 == pt3
 
 
+def testBatchInverse():
+    ps = scheme1.PaillierScheme()
+    nsquared = ps.public.nsquared
+    values = [ps.encrypt(random.getrandbits(16)) for _ in range(8)]
+
+    assert batch_inverse(values, nsquared) == [
+        pow(value, -1, nsquared) for value in values
+    ]
+    assert batch_inverse(values[:1], nsquared) == [
+        pow(values[0], -1, nsquared)
+    ]
+    assert batch_inverse([], nsquared) == []
+
+
+def testGroupBy(m1, m2):
+    ps = scheme1.PaillierScheme()
+    pairs = [("a", ps.encrypt(m1)), ("b", ps.encrypt(m2))] * 3
+    pairs += [(i, ps.encrypt(i)) for i in range(8)]
+
+    # Two worker processes which spill after a few groups
+    sums = group_sum(
+        pairs, ps.public, partitions=2, max_groups=2, batch_size=2
+    )
+
+    assert {key: ps.decrypt(ct) for key, ct in sums.items()} == {
+        "a": 3 * m1,
+        "b": 3 * m2,
+        **{i: i for i in range(8)},
+    }
+
+    # Error of a worker is raised instead of blocking the caller
+    try:
+        group_sum([("a", 1), ("a", "x")] * 100, ps.public, partitions=2)
+        assert False
+    except TypeError:
+        pass
+
+
+def testRefresher(m1, m2):
+    ps = precompute_both_scheme.PaillierScheme.constructFromJsonFile(
+        "precompute_both-2022-01-07_14.47.27.047353.json"
+    )
+    entries = list(ps.precomputed_gnr)
+
+    refresher = NoiseTableRefresher(
+        ps, rate=1000, persist_interval=0, file_name="refreshed-test.json"
+    ).start()
+    time.sleep(1)
+    refresher.stop()
+
+    assert refresher.refreshed > 0
+    assert ps.precomputed_gnr != entries
+    assert ps.decrypt(ps.encrypt(m1)) == m1
+
+    # Persisted table is loaded (and its checksum checked) as any other
+    clear_params_cache("refreshed-test.json")
+    loaded = precompute_both_scheme.PaillierScheme.constructFromJsonFile(
+        "refreshed-test.json"
+    )
+    assert loaded.precomputed_gnr != entries
+    assert loaded.precomputed_gm == ps.precomputed_gm
+    assert loaded.decrypt(ps.encrypt(m2)) == m2
+    os.remove(os.path.join(PARAMS_PATH, "refreshed-test.json"))
+
+
+def testService(m1, m2):
+    ps = precompute_both_scheme.PaillierScheme.constructFromJsonFile(
+        "precompute_both-2022-01-07_14.47.27.047353.json"
+    )
+    server = PaillierServer(ps, workers=1, max_frame=2 ** 16)
+    path = os.path.join(runtime_dir(), "testall.sock")
+    if os.path.exists(path):  # left by an interrupted run
+        os.remove(path)
+
+    stop = threading.Event()
+
+    async def serve():
+        task = asyncio.ensure_future(server.serve(path))
+        while not stop.is_set() and not task.done():
+            await asyncio.sleep(0.1)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    thread = threading.Thread(
+        target=asyncio.run, args=(serve(),), daemon=True
+    )
+    thread.start()
+    while not os.path.exists(path):
+        time.sleep(0.1)
+
+    client = PaillierClient(path)
+    ct1, ct2 = client.encrypt_many([m1, m2])
+    assert client.decrypt(ct1) == m1
+    assert ps.decrypt(client.aggregate([ct1, ct2])) == m1 + m2
+    assert client.decrypt(client.rerandomize(ct2)) == m2
+    client.close()
+
+    # Socket is private and frames over max_frame are refused
+    assert os.stat(path).st_mode & 0o077 == 0
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    sock.sendall(HEADER.pack(ENCRYPT, 2 ** 20))
+    assert HEADER.unpack(sock.recv(HEADER.size))[0] == STATUS_ERROR
+    sock.close()
+
+    stop.set()
+    thread.join()
+    server.close()
+    os.remove(path)
+
+
+def testBatchModMul():
+    ps = scheme1.PaillierScheme()
+    nsquared = ps.public.nsquared
+    xs = [random.randrange(nsquared) for _ in range(64)]
+    ys = [random.randrange(nsquared) for _ in range(64)]
+    expected = [x * y % nsquared for x, y in zip(xs, ys)]
+
+    # Vectorized (with NumPy), calibrated and scalar paths
+    for vectorized in (True, None, False):
+        kernel = BatchModMul(nsquared, min_batch=8, vectorized=vectorized)
+        assert kernel.mulmod(xs, ys) == expected
+
+    kernel = BatchModMul(nsquared, min_batch=8, vectorized=True)
+    assert kernel.product_many([xs, ys, xs]) == [
+        x * y % nsquared * x % nsquared for x, y in zip(xs, ys)
+    ]
+
+
+def testEncoder(m1, m2):
+    ps = scheme1.PaillierScheme()
+    encoder = Encoder(ps)
+
+    # Signs
+    assert encoder.decrypt(encoder.encrypt(-m1)) == -m1
+    assert encoder.decrypt(encoder.encrypt(-m1) + encoder.encrypt(m2)) == (
+        m2 - m1
+    )
+    assert encoder.decrypt(encoder.encrypt(m1) - m2) == m1 - m2
+
+    # Floats
+    assert encoder.decrypt(encoder.encrypt(-2.25)) == -2.25
+    assert encoder.decrypt(encoder.encrypt(1.5) * -3) == -4.5
+
+    # Alignment of different exponents
+    number = encoder.encrypt(m1) + encoder.encrypt(0.5)
+    assert len(number.terms) == 2
+    assert encoder.decrypt(number, exact=True) == Fraction(m1) + Fraction(
+        1, 2
+    )
+    assert len(number.terms) == 1
+
+    # Mantissas longer than messages of the scheme are split into chunks
+    chunked = Encoder(ps, max_bits=8)
+    assert chunked.decrypt(chunked.encrypt(-m1 * m2)) == -m1 * m2
+
+
+def testCiphertextCodec(m1, m2):
+    ps = scheme1.PaillierScheme()
+    codec = CiphertextCodec(ps.public)
+    cts = [ps.encrypt(m1), ps.encrypt(m2), 0, ps.public.nsquared - 1]
+
+    assert codec.from_bytes(codec.to_bytes(cts)) == cts
+
+    buffer = bytearray(3 + codec.nbytes(len(cts)))
+    assert codec.pack_into(buffer, cts, offset=3) == len(buffer)
+    assert bytes(buffer[3:]) == codec.to_bytes(cts)
+    assert codec.from_bytes(buffer, offset=3) == cts
+
+    other = CiphertextCodec(scheme1.PaillierScheme().public)
+    try:
+        other.from_bytes(codec.to_bytes(cts))
+        assert False
+    except ValueError:
+        pass
+
+
+def testKeyring(m1, m2):
+    file_name = "precompute_both-2022-01-07_14.47.27.047353.json"
+    keyring = Keyring()
+    keyring.register("k1", file_name)
+    keyring.register("k2", file_name)
+
+    # Concurrent first uses of a key load it once, into one instance
+    schemes = []
+    threads = [
+        threading.Thread(target=lambda: schemes.append(keyring.get("k1")))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    ps = schemes[0]
+    assert all(scheme is ps for scheme in schemes)
+    assert ps.decrypt(ps.encrypt(m1)) == m1
+
+    # Budget of one key, loading the other one unloads the tables
+    keyring.budget = keyring.nbytes("k1")
+    keyring.get("k2")
+    assert keyring.stats()["loaded"] == ["k2"]
+    assert ps.precomputed_gm is None
+    assert ps.decrypt(ps.encrypt(m2)) == m2
+
+    assert keyring.get("k1") is ps
+    assert ps.precomputed_gm is not None
+    assert keyring.stats()["loaded"] == ["k1"]
+
+
+def testKeyFactory(m1, m2):
+    file_name = "precompute_both-2022-01-07_14.47.27.047353.json"
+    factory = KeyFactory("precompute_both", pool_size=1, n_length=100)
+    # Bundles already waiting in params/pool are left alone
+    factory.pool_dir = tempfile.mkdtemp()
+    with open(os.path.join(PARAMS_PATH, file_name), "rb") as source:
+        with open(
+            os.path.join(factory.pool_dir, "pooled-test.json"), "wb"
+        ) as target:
+            target.write(source.read())
+
+    # Ready bundle is moved out of the pool and loaded
+    ps = factory.take()
+    assert ps.decrypt(ps.encrypt(m1)) == m1
+    assert "pooled-test.json" not in factory.ready()
+    os.remove(os.path.join(PARAMS_PATH, "pooled-test.json"))
+
+    # Failed generation (DSA can't generate such keys) is raised once, the
+    # next call generates again instead of failing without trying
+    with factory.start():
+        for attempt in (1, 2):
+            try:
+                factory.take_file()
+                assert False
+            except RuntimeError:
+                pass
+            assert len(factory.errors) == attempt
+    shutil.rmtree(factory.pool_dir)
+
+
+def testAio(m1, m2):
+    ps = precompute_both_scheme.PaillierScheme.constructFromJsonFile(
+        "precompute_both-2022-01-07_14.47.27.047353.json"
+    )
+
+    async def run():
+        async with AsyncPaillierScheme(ps, max_wait=0.01, workers=2) as aps:
+            # Concurrent requests share a batch, the invalid one fails alone
+            cts = await asyncio.gather(aps.aencrypt(m1), aps.aencrypt(m2))
+            results = await asyncio.gather(
+                *(aps.adecrypt(ct) for ct in cts),
+                aps.aencrypt(ps.public.n),
+                return_exceptions=True,
+            )
+            assert results[:2] == [m1, m2]
+            assert isinstance(results[2], ValueError)
+            ct3 = aps.add_two_ciphertexts(*cts)
+            assert await aps.adecrypt(ct3) == m1 + m2
+
+    asyncio.run(run())
+
+
+def testValidation(m1, m2):
+    ps = precompute_both_scheme.PaillierScheme.constructFromJsonFile(
+        "precompute_both-2022-01-07_14.47.27.047353.json"
+    )
+    checksums = table_checksums(ps)
+    validate_tables(ps, checksums)
+    assert ps.decrypt(ps.encrypt(m1)) == m1
+
+    # A single wrong g^m entry is caught by the checksum and by sampling
+    # (tables are shared through the params cache, so the entry is restored)
+    gm = ps.precomputed_gm
+    value = gm["0"]["1"]
+    gm["0"]["1"] = value * 2 % ps.public.nsquared
+    try:
+        for stored in (checksums, None):
+            try:
+                validate_tables(ps, stored, len(gm) * len(gm["0"]))
+                assert False
+            except ValueError:
+                pass
+    finally:
+        gm["0"]["1"] = value
+
+
+def testDataset(m1, m2):
+    ps = precompute_both_scheme.PaillierScheme.constructFromJsonFile(
+        "precompute_both-2022-01-07_14.47.27.047353.json"
+    )
+    root = tempfile.mkdtemp()
+    path = os.path.join(root, "sales")
+    columns = {"amount": CIPHERTEXT, "region": PLAIN}
+
+    for amounts in ((m1, m2, m1), (m2, m2, m1)):
+        with DatasetWriter(path, ps.public, columns, chunk_rows=2) as writer:
+            for region, amount in enumerate(amounts):
+                writer.append({"amount": ps.encrypt(amount), "region": region})
+
+        with Dataset(path, ps.public) as dataset:
+            assert ps.decrypt(dataset.sum("amount")) == sum(amounts)
+            where = [("region", ">=", 1)]
+            assert ps.decrypt(dataset.sum("amount", where)) == sum(amounts[1:])
+
+            # Worker cache must not serve the dataset previously at path
+            total = _chunk_sum(path, dataset.mtime_ns, "amount", 0, [])
+            assert ps.decrypt(total) == amounts[0] + amounts[1]
+        shutil.rmtree(path)
+    os.rmdir(root)
+
+
+def testRouter(m1, m2):
+    ps = precompute_both_scheme.PaillierScheme.constructFromJsonFile(
+        "precompute_both-2022-01-07_14.47.27.047353.json"
+    )
+    # Longer than the g^m table covers, falls back to pow
+    gm = ps.precomputed_gm
+    too_long = len(gm["0"]) ** len(gm) + m1
+
+    # Every g^m and noise strategy must give a valid ciphertext, for
+    # pre-computing keys (g^n)^r and for scheme1 keys r^n noise
+    for scheme in (ps, scheme1.PaillierScheme()):
+        aps = AdaptivePaillierScheme(scheme)
+        aps.fill_pool(1)
+        for message in (m1, m2, m1, too_long):
+            ct = aps.encrypt(message)
+            assert aps.decrypt(ct) == message
+        assert aps.report()["noise:pool"]["count"] == 1
+
+        try:
+            aps.encrypt(-m1 - 1)
+            assert False
+        except ValueError:
+            pass
+
+
+def testThreaded(m1, m2):
+    ps = precompute_both_scheme.PaillierScheme.constructFromJsonFile(
+        "precompute_both-2022-01-07_14.47.27.047353.json"
+    )
+    messages = [m1, m2] * 5
+
+    with ThreadedPaillierScheme(ps, workers=2, chunk=3) as tps:
+        cts = tps.encrypt_many(messages)
+        assert tps.decrypt_many(cts) == messages
+        assert ps.decrypt_many(cts) == messages
+        assert tps.decrypt(tps.aggregate(cts)) == sum(messages)
+
+
+def testSharding(m1, m2):
+    # Small noise table, the full one takes minutes on a single core
+    key_file = create_key("precompute_gnr", power=2 ** 8)
+    file_name = run_local(key_file, 2)
+    ps = precompute_gnr_scheme.PaillierScheme.constructFromJsonFile(file_name)
+
+    ct1 = ps.encrypt(m1)
+    ct2 = ps.encrypt(m2)
+    assert ps.decrypt(ps.add_two_ciphertexts(ct1, ct2)) == m1 + m2
+
+    # Merge refuses a table not covered by shards
+    try:
+        merge(key_file, [])
+        assert False
+    except ValueError:
+        pass
+
+    try:
+        create_key("precompute_gm", power=2 ** 8)
+        assert False
+    except ValueError:
+        pass
+
+    for name in (key_file, file_name):
+        os.remove(os.path.join(PARAMS_PATH, name))
+
+
 if __name__ == "__main__":
     m1 = random.getrandbits(int(math.log2(POWER)) * 2)
     m2 = random.getrandbits(int(math.log2(POWER)) * 2)
@@ -117,4 +531,49 @@ if __name__ == "__main__":
     print("Testing precompute_both")
     testPrecomputeBoth(m1, m2)
 
+    print("Testing batch_inverse")
+    testBatchInverse()
+
+    print("Testing GroupBy")
+    testGroupBy(m1, m2)
+
+    print("Testing NoiseTableRefresher")
+    testRefresher(m1, m2)
+
+    print("Testing service")
+    testService(m1, m2)
+
+    print("Testing BatchModMul")
+    testBatchModMul()
+
+    print("Testing Encoder")
+    testEncoder(m1, m2)
+
+    print("Testing CiphertextCodec")
+    testCiphertextCodec(m1, m2)
+
+    print("Testing Keyring")
+    testKeyring(m1, m2)
+
+    print("Testing KeyFactory")
+    testKeyFactory(m1, m2)
+
+    print("Testing aio")
+    testAio(m1, m2)
+
+    print("Testing validation")
+    testValidation(m1, m2)
+
+    print("Testing dataset")
+    testDataset(m1, m2)
+
+    print("Testing AdaptivePaillierScheme")
+    testRouter(m1, m2)
+
+    print("Testing ThreadedPaillierScheme")
+    testThreaded(m1, m2)
+
+    print("Testing sharding")
+    testSharding(m1, m2)
+
     print("Finished successfully")